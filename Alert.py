@@ -1,18 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
 import re
-import csv
 import time
-import requests
-from io import StringIO
-from typing import Optional
 from pathlib import Path
-from collections import OrderedDict
 
 from dotenv import load_dotenv
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+from sap_stream import SapReader, split_keyword_stream, match_docnums_stream
+from line_outbox import LineOutbox
+from folder_jobs import FolderJobPool
+from file_stability import FolderReadiness
+
 # ===================== โหลดคอนฟิกจาก .env =====================
 load_dotenv()
 
@@ -20,82 +20,33 @@ WATCH_ROOT = os.getenv("WATCH_ROOT", r"C:\Users\kornkanok\Documents\Automation_a
 FOLDER_NAME_PATTERN = os.getenv("FOLDER_NAME_PATTERN", r"^\d{4}-\d{2}-\d{2}_to_\d{4}-\d{2}-\d{2}$")
 HEADER_ROWS = int(os.getenv("HEADER_ROWS", "2"))
 KEYWORD = os.getenv("KEYWORD", "ส่วนลดติดลบ")
-SLEEP_AFTER_CREATE = int(os.getenv("SLEEP_AFTER_CREATE", "3"))
+# โฟลเดอร์พร้อมเมื่อมี sap1/sap2 ครบและไม่มีการเขียนเพิ่ม READY_QUIET_S วินาที (เดิมคือ SLEEP_AFTER_CREATE)
+READY_QUIET_S = float(os.getenv("READY_QUIET_S") or os.getenv("SLEEP_AFTER_CREATE") or "3")
+READY_MAX_WAIT_S = float(os.getenv("READY_MAX_WAIT_S", "1800"))  # ไม่พร้อมภายในเวลานี้ -> แจ้ง timeout
+FOLDER_WORKERS = int(os.getenv("FOLDER_WORKERS", "2"))        # จำนวน process ที่ประมวลผลโฟลเดอร์พร้อมกัน
+FOLDER_QUEUE_MAX = int(os.getenv("FOLDER_QUEUE_MAX", "100"))  # คิวเต็ม -> handler รอ
 
 SAP1_GLOB = "sap1_*.txt"
 SAP2_GLOB = "sap2_*.txt"
 
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN") or ""
 LINE_TO_ID = os.getenv("LINE_TO_ID") or ""
+# ข้อความที่ยังส่งไม่สำเร็จค้างในโฟลเดอร์นี้ แล้วส่งต่อเมื่อเปิดสคริปต์ใหม่
+LINE_OUTBOX_DIR = os.getenv("LINE_OUTBOX_DIR", str(Path(__file__).resolve().parent / ".line_outbox"))
+LINE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("LINE_OUTBOX_MAX_ATTEMPTS", "20"))
 
-# ===================== ยูทิล CSV/ไฟล์ =====================
-def read_text(path: Path) -> str:
-    try:
-        return path.read_text(encoding="utf-8-sig")
-    except UnicodeError:
-        return path.read_text(encoding="utf-8")
-
-def detect_dialect(sample_text: str):
-    sniffer = csv.Sniffer()
-    try:
-        return sniffer.sniff(sample_text, delimiters=[",", "\t", "|", ";"])
-    except Exception:
-        class Fallback(csv.Dialect):
-            delimiter = "\t"
-            quotechar = '"'
-            doublequote = True
-            skipinitialspace = False
-            lineterminator = "\n"
-            quoting = csv.QUOTE_MINIMAL
-        return Fallback
-
-def iter_rows(text: str, header_rows: int = 1):
-    lines = text.splitlines(keepends=True)
-    return lines[:header_rows], lines[header_rows:]
-
-def find_docnum_index(header_line: str, dialect) -> Optional[int]:
-    reader = csv.reader(StringIO(header_line), dialect=dialect)
-    cols = next(reader)
-    lowered = [c.strip().lower() for c in cols]
-    for i, name in enumerate(lowered):
-        if name == "docnum":
-            return i
-    return None
-
-def get_field(line: str, idx: Optional[int], dialect) -> Optional[str]:
-    reader = csv.reader(StringIO(line), dialect=dialect)
-    try:
-        row = next(reader)
-        if idx is None or idx >= len(row):
-            return None
-        return row[idx]
-    except Exception:
-        return None
+OUTBOX = LineOutbox(LINE_OUTBOX_DIR, LINE_CHANNEL_ACCESS_TOKEN, max_attempts=LINE_OUTBOX_MAX_ATTEMPTS)
 
 # ===================== LINE =====================
 def line_push(text: str) -> bool:
-    """ส่งข้อความหา LINE user/group ด้วย Messaging API (push message)"""
+    """
+    เข้าคิวข้อความหา LINE user/group (push message) แล้วคืนทันที
+    thread ของ OUTBOX เป็นคนส่งจริง (retry เองถ้าส่งไม่สำเร็จ)
+    """
     if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_TO_ID:
         print("⚠️ LINE config ไม่ครบ (LINE_CHANNEL_ACCESS_TOKEN/LINE_TO_ID) : ข้ามการส่งแจ้งเตือน")
         return False
-    url = "https://api.line.me/v2/bot/message/push"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-    }
-    payload = {
-        "to": LINE_TO_ID,
-        "messages": [{"type": "text", "text": text}],
-    }
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=20)
-        if resp.status_code == 200:
-            return True
-        print(f"⚠️ ส่ง LINE ไม่สำเร็จ: {resp.status_code} {resp.text}")
-        return False
-    except Exception as e:
-        print(f"❌ ส่ง LINE error: {e}")
-        return False
+    return OUTBOX.enqueue(text, to_ids=[LINE_TO_ID]) is not None
 
 # ===================== แกนประมวลผลหนึ่งโฟลเดอร์ =====================
 def process_folder(folder: Path):
@@ -105,7 +56,8 @@ def process_folder(folder: Path):
     - เก็บ DocNum ของบรรทัดที่พบไว้ ไป match กับ sap2
     - sap2: แยกเป็น match กับ not match ตาม DocNum
     - เขียนเอาท์พุตทั้งหมดในโฟลเดอร์ย่อย minus_0
-    - แจ้ง LINE เมื่อพบ (count_keyword > 0)
+    - คืนข้อความแจ้ง LINE เมื่อพบ (count_keyword > 0) / None ถ้าไม่ต้องแจ้ง
+      (รันใน worker process: process หลักเป็นคนเข้าคิว outbox)
     """
     print(f"\n=== เริ่มประมวลผลโฟลเดอร์: {folder} ===")
     out_dir = folder / "minus_0"
@@ -116,75 +68,32 @@ def process_folder(folder: Path):
 
     if not sap1_files:
         print("⚠️ ไม่พบไฟล์ sap1_*.txt ในโฟลเดอร์นี้ ข้าม")
-        return
+        return None
     if not sap2_files:
         print("⚠️ ไม่พบไฟล์ sap2_*.txt ในโฟลเดอร์นี้ ข้าม")
-        return
+        return None
 
     # เลือกไฟล์แรก (ถ้าต้องการวนทุกไฟล์ ปรับเพิ่มได้)
     src_file = sap1_files[0]
     lookup_file = sap2_files[0]
 
     # ---------- ขั้นตอน 1: sap1 แยก KEYWORD ----------
-    src_text = read_text(src_file)
-    src_header, src_body = iter_rows(src_text, header_rows=HEADER_ROWS)
-
-    sample_for_sniff = "".join(src_header[-1:]) or "".join(src_body[:1])
-    src_dialect = detect_dialect(sample_for_sniff)
-    docnum_idx_src = find_docnum_index(src_header[-1], src_dialect)
-
-    lines_with_keyword = []
-    lines_without_keyword = []
-    docnums_found = OrderedDict()
-    count_keyword = 0
-
-    for lineno, line in enumerate(src_body, start=HEADER_ROWS + 1):
-        # >>> จุด “ทำเกี่ยวกับส่วนลดติดลบ”
-        occ = line.count(KEYWORD)
-        if occ > 0:
-            lines_with_keyword.append(line)
-            count_keyword += occ
-            dv = get_field(line, docnum_idx_src, src_dialect)
-            dv = (dv or "").strip()
-            if dv:
-                docnums_found[dv] = True
-        else:
-            lines_without_keyword.append(line)
-
     out_with_keyword    = out_dir / "sap1_only_negative.txt"
     out_without_keyword = out_dir / "sap1_without_negative.txt"
 
-    out_with_keyword.write_text("".join(src_header) + "".join(lines_with_keyword), encoding="utf-8")
-    out_without_keyword.write_text("".join(src_header) + "".join(lines_without_keyword), encoding="utf-8")
+    # >>> จุด “ทำเกี่ยวกับส่วนลดติดลบ” (อ่านทีละบรรทัด เขียนผลไปพร้อมกัน)
+    with SapReader(src_file, header_rows=HEADER_ROWS) as rd:
+        res = split_keyword_stream(rd, out_with_keyword, out_without_keyword,
+                                   keyword=KEYWORD, case_insensitive=False)
+    docnums_found = res["docnums"]
+    count_keyword = res["count_keyword"]
 
     # ---------- ขั้นตอน 2: sap2 match/not-match ----------
-    lookup_text = read_text(lookup_file)
-    lookup_header, lookup_body = iter_rows(lookup_text, header_rows=HEADER_ROWS)
-
-    sample_for_sniff2 = "".join(lookup_header[-1:]) or "".join(lookup_body[:1])
-    lookup_dialect = detect_dialect(sample_for_sniff2)
-    docnum_idx_lookup = find_docnum_index(lookup_header[-1], lookup_dialect)
-
-    lookup_matches = []
-    lookup_without_matches = []
-
-    if docnum_idx_lookup is None:
-        print("⚠️ ไม่พบคอลัมน์ DocNum ในไฟล์ sap2")
-    else:
-        targets = set(docnums_found.keys())
-        for line in lookup_body:
-            dv = get_field(line, docnum_idx_lookup, lookup_dialect)
-            dv = (dv or "").strip()
-            if dv in targets:
-                lookup_matches.append(line)
-            else:
-                lookup_without_matches.append(line)
-
     out_lookup_matches = out_dir / "sap2_match_negative_docnums.txt"
     out_lookup_without = out_dir / "sap2_without_negative_docnums.txt"
 
-    out_lookup_matches.write_text("".join(lookup_header) + "".join(lookup_matches), encoding="utf-8")
-    out_lookup_without.write_text("".join(lookup_header) + "".join(lookup_without_matches), encoding="utf-8")
+    with SapReader(lookup_file, header_rows=HEADER_ROWS) as rd:
+        match_docnums_stream(rd, out_lookup_matches, out_lookup_without, docnums_found)
 
     # ---------- สรุป + แจ้ง LINE ----------
     summary = []
@@ -199,9 +108,9 @@ def process_folder(folder: Path):
     print("\n".join(summary))
     print("================================\n")
 
-    # ส่ง LINE เฉพาะเมื่อพบ (count_keyword > 0)
+    # แจ้ง LINE เฉพาะเมื่อพบ (count_keyword > 0)
     if count_keyword > 0:
-        msg = (
+        return (
             f"แจ้งเตือน: พบ \"{KEYWORD}\"\n"
             f"- โฟลเดอร์: {folder.name}\n"
             f"- ไฟล์: {src_file.name}\n"
@@ -211,32 +120,57 @@ def process_folder(folder: Path):
             f"  • {out_with_keyword.name}\n"
             f"  • {out_lookup_matches.name}"
         )
+    return None
+
+def on_job_done(folder: Path, msg):
+    if msg:
         line_push(msg)
 
+def on_job_error(folder: Path, e: BaseException):
+    print(f"❌ เกิดข้อผิดพลาดขณะประมวลผล {folder}: {e}")
+    # แจ้ง LINE กรณี error (ถ้าต้องการ)
+    line_push(f"❌ ERROR: ประมวลผลโฟลเดอร์ {folder.name} ล้มเหลว\nรายละเอียด: {e}")
+
+def on_not_ready(folder: Path, missing):
+    line_push(f"⚠️ TIMEOUT: โฟลเดอร์ {folder.name} ไฟล์ไม่ครบ/ยังเขียนไม่เสร็จภายใน {READY_MAX_WAIT_S:.0f}s\n"
+              f"ยังขาด: {', '.join(missing) or '-'} (ไม่ได้ประมวลผล)")
+
 # ===================== Watchdog Handler =====================
 class NewFolderHandler(FileSystemEventHandler):
-    """จับเหตุการณ์โฟลเดอร์ใหม่ถูกสร้างใน WATCH_ROOT (ชั้นเดียว)"""
-    def __init__(self, folder_name_pattern: str):
+    """
+    จับเหตุการณ์โฟลเดอร์ใหม่ถูกสร้างใน WATCH_ROOT (ชั้นเดียว) -> รอให้พร้อม
+    event ของไฟล์ในโฟลเดอร์ -> บอก FolderReadiness ว่าไฟล์ยังถูกเขียนอยู่
+    """
+    def __init__(self, root: Path, folder_name_pattern: str, ready: FolderReadiness):
         super().__init__()
+        self._root = os.path.abspath(root)
         self._pattern = re.compile(folder_name_pattern)
+        self._ready = ready
 
     def on_created(self, event):
         if not event.is_directory:
+            self._ready.touch(event.src_path)
             return
         new_path = Path(event.src_path)
+        if os.path.dirname(os.path.abspath(new_path)) != self._root:
+            return  # โฟลเดอร์ย่อย เช่น minus_0
         if not self._pattern.match(new_path.name):
             print(f"พบโฟลเดอร์ใหม่ แต่ชื่อไม่ตรง pattern: {new_path.name} -> ข้าม")
             return
 
-        print(f"📁 พบโฟลเดอร์ใหม่: {new_path} รอ {SLEEP_AFTER_CREATE}s ให้ไฟล์เซฟเสร็จ...")
-        time.sleep(SLEEP_AFTER_CREATE)
+        print(f"📁 พบโฟลเดอร์ใหม่: {new_path} รอ sap1/sap2 เขียนเสร็จ (นิ่ง {READY_QUIET_S:g}s)...")
+        self._ready.watch(new_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._ready.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._ready.touch(event.dest_path)
 
-        try:
-            process_folder(new_path)
-        except Exception as e:
-            print(f"❌ เกิดข้อผิดพลาดขณะประมวลผล {new_path}: {e}")
-            # แจ้ง LINE กรณี error (ถ้าต้องการ)
-            line_push(f"❌ ERROR: ประมวลผลโฟลเดอร์ {new_path.name} ล้มเหลว\nรายละเอียด: {e}")
+    def on_closed(self, event):
+        self._ready.touch(event.src_path, closed=True)
 
 # ===================== main =====================
 def main():
@@ -245,9 +179,17 @@ def main():
         raise SystemExit(f"โฟลเดอร์ที่เฝ้าไม่มีอยู่จริง: {root}")
 
     print(f"เริ่มเฝ้าโฟลเดอร์: {root}")
+    OUTBOX.start()
+    pool = FolderJobPool(process_folder, workers=FOLDER_WORKERS, max_queue=FOLDER_QUEUE_MAX,
+                         on_result=on_job_done, on_error=on_job_error)
+    # on_ready ถูกเรียกใน thread ของ FolderReadiness เอง: pool.submit รอได้ตอนคิวเต็ม
+    # โดยไม่หยุดการจับเวลาไฟล์ของโฟลเดอร์อื่น
+    ready = FolderReadiness((SAP1_GLOB, SAP2_GLOB), quiet=READY_QUIET_S, max_wait=READY_MAX_WAIT_S,
+                            on_ready=pool.submit, on_timeout=on_not_ready).start()
     observer = Observer()
-    event_handler = NewFolderHandler(FOLDER_NAME_PATTERN)
-    observer.schedule(event_handler, str(root), recursive=False)  # เฝ้าเฉพาะชั้นเดียว
+    event_handler = NewFolderHandler(root, FOLDER_NAME_PATTERN, ready)
+    # recursive เพื่อรับ event ของไฟล์ในโฟลเดอร์ใหม่ (โฟลเดอร์ใหม่ยังนับเฉพาะชั้นแรก)
+    observer.schedule(event_handler, str(root), recursive=True)
     observer.start()
     try:
         while True:
@@ -257,6 +199,9 @@ def main():
     finally:
         observer.stop()
         observer.join()
+        ready.stop()
+        pool.shutdown()
+        OUTBOX.stop()
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,13 @@
-import os, sys, csv, argparse, re, json, time, shutil
-from io import StringIO
+import os, sys, csv, argparse, re, json, shutil
 from pathlib import Path
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
-import requests
+
+from sap_stream import SapReader, split_keyword_file, match_docnums_file, run_chunks, open_out
+from msrp_cache import cached_msrp_map
+from http_client import get_client
+from line_notifier import notify, all_ok
+from export_client import download_all, fetch_resumable
 
 # ---------- โหลด .env ให้ครอบคลุม ----------
 # ---------- โหลด .env แบบครอบคลุม ----------
@@ -24,7 +28,6 @@ def _load_env_smart():
             break
 
 _load_env_smart()
-import os, requests
 
 # ---------- โฟลเดอร์ปลายทาง (รองรับ DEFAULT_FOLDER ของคุณด้วย) ----------
 DEFAULT_OUT_DIR = (
@@ -48,43 +51,18 @@ LINE_GROUP_IDS = [g.strip() for g in _line_groups_raw.split(",") if g.strip()]
 # ส่งสรุปเสมอจาก .env ได้ (เลือก)
 LINE_NOTIFY_ALWAYS_DEFAULT = os.getenv("LINE_NOTIFY_ALWAYS", "false").lower() == "true"
 
-def line_push(text: str) -> bool:
-    tok = LINE_CHANNEL_ACCESS_TOKEN
-    if not tok:
-        print("⚠️ LINE token ไม่ถูกตั้งค่า (.env: LINE_CHANNEL_ACCESS_TOKEN)")
-        return False
-    headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
-    ok = True
-    # ส่งไปทั้งผู้ใช้เดียว และหลายกลุ่มตามที่ตั้ง
-    targets = []
-    if LINE_USER_ID:
-        targets.append(LINE_USER_ID)
-    targets.extend(LINE_GROUP_IDS)
-    if not targets:
-        print("⚠️ ไม่พบ LINE target (ตั้ง LINE_TO_ID/LINE_USER_ID หรือ LINE_GROUP_IDS)")
-        return False
-
-    for to in targets:
-        payload = {"to": to, "messages": [{"type": "text", "text": text}]}
-        try:
-            r = requests.post("https://api.line.me/v2/bot/message/push",
-                              headers=headers, json=payload, timeout=20)
-            print(f"[LINE] to={to[:1]}...{to[-4:]} status={r.status_code} body={r.text}")
-            ok = ok and (r.status_code == 200)
-        except Exception as e:
-            print(f"[LINE] error sending to {to}: {e}")
-            ok = False
-    return ok
-
 # ---------- ค่าพื้นฐาน ----------
 DEFAULT_OUT_DIR     = os.getenv("FIXED_OUT_DIR", "/Users/pianoxyz/Documents/Automation-main/mizerp_api")
 DEFAULT_HEADER_ROWS = int(os.getenv("HEADER_ROWS", "2"))
 DEFAULT_KEYWORD     = os.getenv("KEYWORD", "ส่วนลดติดลบ")
 CASE_INSENSITIVE    = os.getenv("CASE_INSENSITIVE", "true").lower() == "true"
+DEFAULT_WORKERS     = int(os.getenv("WORKERS", "1"))   # >1 = แบ่งไฟล์เป็น chunk ประมวลผลหลาย process
 
 MASTER_DATA_DEFAULT = os.getenv("MASTER_DATA_CSV", "/Users/pianoxyz/Documents/Automation-main/MasterData.xls")
 MASTER_CODE_COL     = (os.getenv("MASTER_CODE_COL") or "code").strip()
 MASTER_MSRP_COL     = (os.getenv("MASTER_MSRP_COL") or "msrp").strip()
+MSRP_ENGINE         = (os.getenv("MSRP_ENGINE") or "row").strip().lower()   # row | columnar (ต้องมี numpy)
+MSRP_BATCH_ROWS     = int(os.getenv("MSRP_BATCH_ROWS", "50000"))
 
 BASE_URL        = (os.getenv("BASE_URL") or "https://mizerp.com").rstrip("/")
 EXPORT_PATH     = os.getenv("EXPORT_PATH", "/wh/api/exportSap")
@@ -92,36 +70,16 @@ VERIFY_TLS      = os.getenv("VERIFY_TLS", "true").lower() == "true"
 TIMEOUT         = int(os.getenv("TIMEOUT_SECONDS", "60"))
 AUTH_HEADER_NAME  = os.getenv("AUTH_HEADER_NAME") or None
 AUTH_HEADER_VALUE = os.getenv("AUTH_HEADER_VALUE") or None
+DOWNLOAD_WORKERS  = int(os.getenv("DOWNLOAD_WORKERS", "4"))   # จำนวนไฟล์ที่ดาวน์โหลดพร้อมกัน
+DOWNLOAD_RETRIES  = int(os.getenv("DOWNLOAD_RETRIES", "3"))
 
-SESSION = requests.Session()
+HTTP = get_client()  # session + pool กลาง (export / ดาวน์โหลด / LINE)
 
 # ---------- LINE ----------
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
 LINE_USER_ID  = os.getenv("LINE_USER_ID", "")
 LINE_GROUP_ID = os.getenv("LINE_GROUP_ID", "")
 
-def line_push(text: str) -> bool:
-    """ส่งข้อความไป LINE (user/group ที่ตั้งใน .env)"""
-    tok = LINE_CHANNEL_ACCESS_TOKEN
-    if not tok:
-        print("⚠️ LINE token ไม่ถูกตั้งค่า (.env: LINE_CHANNEL_ACCESS_TOKEN)")
-        return False
-    headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
-    ok = True
-    for to in [LINE_USER_ID, LINE_GROUP_ID]:
-        if not to:
-            continue
-        payload = {"to": to, "messages": [{"type": "text", "text": text}]}
-        try:
-            r = requests.post("https://api.line.me/v2/bot/message/push",
-                              headers=headers, json=payload, timeout=20)
-            print(f"[LINE] to={to[:1]}...{to[-4:]} status={r.status_code} body={r.text}")
-            ok = ok and (r.status_code == 200)
-        except Exception as e:
-            print(f"[LINE] error sending to {to}: {e}")
-            ok = False
-    return ok
-
 # ---------- โหลด .env แบบครอบคลุม ----------
 def _load_env_smart():
     try:
@@ -140,7 +98,6 @@ def _load_env_smart():
             break
 
 _load_env_smart()
-import os, requests
 
 # ---------- โฟลเดอร์ปลายทาง (รองรับ DEFAULT_FOLDER/FIXED_OUT_DIR) ----------
 DEFAULT_OUT_DIR = (
@@ -166,27 +123,8 @@ def line_push(text: str) -> bool:
     if not tok:
         print("⚠️ LINE token ไม่ถูกตั้งค่า (.env: LINE_CHANNEL_ACCESS_TOKEN)")
         return False
-    headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
-
-    targets = []
-    if LINE_USER_ID: targets.append(LINE_USER_ID)
-    targets.extend(LINE_GROUP_IDS)
-    if not targets:
-        print("⚠️ ไม่พบ LINE target (ตั้ง LINE_USER_ID/LINE_TO_ID หรือ LINE_GROUP_IDS/LINE_GROUP_ID)")
-        return False
-
-    ok = True
-    for to in targets:
-        payload = {"to": to, "messages": [{"type": "text", "text": text}]}
-        try:
-            r = requests.post("https://api.line.me/v2/bot/message/push",
-                              headers=headers, json=payload, timeout=20)
-            print(f"[LINE] to={_obf(to)} status={r.status_code} body={r.text}")
-            ok = ok and (r.status_code == 200)
-        except Exception as e:
-            print(f"[LINE] error sending to {to}: {e}")
-            ok = False
-    return ok
+    # user + ทุกกลุ่ม ส่งพร้อมกัน ผลรายผู้รับพิมพ์โดย line_notifier
+    return all_ok(notify(text, tok, to_ids=[LINE_USER_ID], group_ids=LINE_GROUP_IDS))
 
 def line_diag():
     tok = LINE_CHANNEL_ACCESS_TOKEN
@@ -198,7 +136,7 @@ def line_diag():
         print("❌ ไม่มี LINE_CHANNEL_ACCESS_TOKEN"); return
     headers = {"Authorization": f"Bearer {tok}", "Content-Type": "application/json"}
     try:
-        r = requests.get("https://api.line.me/v2/bot/info", headers=headers, timeout=10)
+        r = get_client().get("https://api.line.me/v2/bot/info", headers=headers, timeout=10)
         print("bot/info:", r.status_code)
     except Exception as e:
         print("❌ bot/info error:", e)
@@ -214,44 +152,10 @@ def iso_date(s):
     except ValueError:
         raise argparse.ArgumentTypeError("Date must be yyyy-mm-dd")
 
-def read_text(path: Path) -> str:
-    try: return path.read_text(encoding="utf-8-sig")
-    except UnicodeError: return path.read_text(encoding="utf-8")
-
 def sanitize(name: str) -> str:
     for ch in '<>:"/\\|?*': name = name.replace(ch, "_")
     return name
 
-# ---------- CSV helpers ----------
-def detect_dialect(sample_text: str):
-    sniffer = csv.Sniffer()
-    try: return sniffer.sniff(sample_text, delimiters=[",","\t","|",";"])
-    except Exception:
-        class Fallback(csv.Dialect):
-            delimiter="\t"; quotechar='"'; doublequote=True
-            skipinitialspace=False; lineterminator="\n"; quoting=csv.QUOTE_MINIMAL
-        return Fallback
-
-def iter_rows(text: str, header_rows: int = 1):
-    lines = text.splitlines(keepends=True)
-    return lines[:header_rows], lines[header_rows:]
-
-def find_index_ci(header_line: str, dialect, names):
-    cols = next(csv.reader(StringIO(header_line), dialect=dialect))
-    idx = {c.strip().lower(): i for i, c in enumerate(cols)}
-    for name in names:
-        i = idx.get(name.lower())
-        if i is not None: return i
-    return None
-
-def get_field(line: str, idx, dialect):
-    try:
-        row = next(csv.reader(StringIO(line), dialect=dialect))
-        if idx is None or idx >= len(row): return None
-        return row[idx]
-    except Exception:
-        return None
-
 # ---------- number helpers ----------
 def parse_float(s):
     if s is None: return None
@@ -268,8 +172,38 @@ def parse_float(s):
 
 def fmt2(x): return f"{x:.2f}"
 
+PRICE_JUNK_RX = r"[฿$€ \u00a0,]"
+# เพิ่มทุกครั้งที่ read_msrp_map / msrp_map_from_frame ให้ผลต่างจากเดิม (cache เก่าจะถูกสร้างใหม่)
+# 2: Excel แบบ vectorized (code ที่เป็น NaN ถูกข้าม เดิมกลายเป็น "NAN")
+MSRP_LOADER_VERSION = 2
+
+def parse_float_series(col):
+    """parse_float แบบทั้งคอลัมน์ (pandas): คืน Series float, ค่าที่แปลงไม่ได้/ว่าง = NaN"""
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        return col.astype(float)
+    t = col.where(col.notna(), "").astype(str).str.strip()
+    neg = t.str.startswith("(") & t.str.endswith(")")
+    t = t.mask(neg, t.str[1:-1]).str.replace(PRICE_JUNK_RX, "", regex=True)
+    v = pd.to_numeric(t, errors="coerce").astype(float)
+    return v.mask(neg, -v)
+
+def msrp_map_from_frame(df, ccol, mcol):
+    """สร้าง msrp map จาก DataFrame ด้วย operation ทั้งคอลัมน์ (แทน iterrows)"""
+    codes = df[ccol]
+    codes = codes.where(codes.notna(), "").astype(str).str.strip().str.upper()
+    msrp = parse_float_series(df[mcol])
+    keep = codes.ne("") & msrp.notna()
+    return dict(zip(codes[keep].tolist(), msrp[keep].tolist()))
+
 # ---------- MasterData loader (csv/xlsx/xls) ----------
 def load_msrp_map(master_path: Path, code_col="code", msrp_col="msrp"):
+    """โหลด msrp map ผ่าน cache (msrp_cache) — parse MasterData ใหม่เฉพาะตอนไฟล์เปลี่ยน"""
+    return cached_msrp_map(master_path, code_col, msrp_col,
+                           lambda: read_msrp_map(master_path, code_col, msrp_col),
+                           version=MSRP_LOADER_VERSION)
+
+def read_msrp_map(master_path: Path, code_col="code", msrp_col="msrp"):
     suffix = master_path.suffix.lower()
     def _norm_cols(cols): return {str(c).strip().lower(): c for c in cols}
 
@@ -301,19 +235,17 @@ def load_msrp_map(master_path: Path, code_col="code", msrp_col="msrp"):
         except ImportError:
             raise RuntimeError("ต้องติดตั้ง pandas / openpyxl / (xlrd==1.2.0 สำหรับ .xls)")
         engine = "openpyxl" if suffix == ".xlsx" else "xlrd"
+        want = {code_col.strip().lower(), msrp_col.strip().lower()}
         try:
-            df = pd.read_excel(master_path, engine=engine)
+            # อ่านเฉพาะ 2 คอลัมน์ที่ใช้
+            df = pd.read_excel(master_path, engine=engine, usecols=lambda c: str(c).strip().lower() in want)
         except Exception as e:
             raise RuntimeError(f"เปิด Excel ไม่ได้: {e}")
         if df.empty: raise RuntimeError("MasterData ว่าง")
         cols = _norm_cols(df.columns)
         ccol = cols.get(code_col.lower()); mcol = cols.get(msrp_col.lower())
         if not ccol or not mcol: raise RuntimeError("ไม่พบคอลัมน์ที่ต้องใช้ (code/msrp)")
-        out = {}
-        for _, row in df.iterrows():
-            code = str(row.get(ccol) or "").strip().upper()
-            msrp = parse_float(row.get(mcol))
-            if code and msrp is not None: out[code] = msrp
+        out = msrp_map_from_frame(df, ccol, mcol)
         if not out: raise RuntimeError("อ่าน Excel ได้แต่ msrp_map ว่าง")
         return out
 
@@ -334,34 +266,25 @@ def build_get_headers():
 def api_export(from_date, to_date):
     url = urljoin(BASE_URL + "/", EXPORT_PATH.lstrip("/"))
     payload = {"fromDate": from_date, "toDate": to_date}
-    for attempt in range(6):
-        try:
-            r = SESSION.post(url, headers=build_post_headers(), data=payload,
-                             timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True)
-            if r.status_code in (429,502,503,504):
-                time.sleep(min(30, 2**attempt)); continue
-            if not (200 <= r.status_code < 300): r.raise_for_status()
-            try: return r.json()
-            except Exception: raise RuntimeError("API did not return JSON")
-        except requests.RequestException:
-            if attempt == 5: raise
-            time.sleep(min(30, 2**attempt))
-
-def download(url, dest):
+    # retry 429/502/503/504 + network error อยู่ใน http_client (สั่ง export ซ้ำได้ผลเหมือนเดิม -> retry_errors=True)
+    r = HTTP.post(url, headers=build_post_headers(), data=payload,
+                  timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True, retry_errors=True)
+    if not (200 <= r.status_code < 300): r.raise_for_status()
+    try: return r.json()
+    except Exception: raise RuntimeError("API did not return JSON")
+
+def download(url, dest) -> int:
     if not (url.startswith("http://") or url.startswith("https://")):
         url = urljoin(BASE_URL + "/", url.lstrip("/"))
-    with SESSION.get(url, headers=build_get_headers(), stream=True,
-                     timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True) as r:
-        r.raise_for_status()
-        with open(dest, "wb") as f:
-            for chunk in r.iter_content(262144):
-                if chunk: f.write(chunk)
+    # .part + Range resume + ตรวจขนาด/ETag/hash -> ไฟล์ครึ่ง ๆ จะไม่โผล่เป็น sap1*.txt / sap2*.txt
+    return fetch_resumable(HTTP, url, dest, headers=build_get_headers(),
+                           timeout=TIMEOUT, verify=VERIFY_TLS)
 
 def have_required_files(folder: Path) -> bool:
     return any(folder.glob("sap1*.txt")) and any(folder.glob("sap2*.txt"))
 
 # ---------- ขั้นตอนหลัก ----------
-def split_sap1_and_collect_docnums(folder: Path, header_rows: int, keyword: str):
+def split_sap1_and_collect_docnums(folder: Path, header_rows: int, keyword: str, workers: int = 1):
     def pick(patterns):
         for pat in patterns:
             for p in sorted(folder.glob(pat)): return p
@@ -369,31 +292,13 @@ def split_sap1_and_collect_docnums(folder: Path, header_rows: int, keyword: str)
     sap1 = pick(("sap1*.txt","sap1.txt"))
     if not sap1: raise RuntimeError("⚠️ ไม่พบไฟล์ sap1_*.txt")
 
-    text = read_text(sap1)
-    head, body = iter_rows(text, header_rows=header_rows)
-    sample = "".join(head[-1:]) or "".join(body[:1])
-    dialect = detect_dialect(sample)
-    doc_idx = find_index_ci(head[-1], dialect, ["docnum"])
-
-    with_kw, without_kw, docnums, cnt = [], [], {}, 0
-    kw = keyword.lower() if CASE_INSENSITIVE else keyword
-    for line in body:
-        tgt = line.lower() if CASE_INSENSITIVE else line
-        occ = tgt.count(kw)
-        if occ > 0:
-            with_kw.append(line); cnt += occ
-            dv = get_field(line, doc_idx, dialect)
-            dv = (dv or "").strip()
-            if dv: docnums[dv] = True
-        else:
-            without_kw.append(line)
-
+    # อ่าน sap1 ทีละบรรทัด เขียนสองไฟล์ไปพร้อมกัน (ไม่โหลดทั้งไฟล์)
     out_dir = folder / "minus_0"; out_dir.mkdir(exist_ok=True)
-    (out_dir/"sap1_only_negative.txt").write_text("".join(head)+"".join(with_kw), encoding="utf-8")
-    (out_dir/"sap1_without_negative.txt").write_text("".join(head)+"".join(without_kw), encoding="utf-8")
-    return {"docnums": set(docnums.keys()), "count_keyword": cnt}
+    res = split_keyword_file(sap1, header_rows, out_dir/"sap1_only_negative.txt", out_dir/"sap1_without_negative.txt",
+                             keyword=keyword, case_insensitive=CASE_INSENSITIVE, workers=workers)
+    return {"docnums": set(res["docnums"]), "count_keyword": res["count_keyword"]}
 
-def build_sap2_match(folder: Path, header_rows: int, docnums):
+def build_sap2_match(folder: Path, header_rows: int, docnums, workers: int = 1):
     def pick(patterns):
         for pat in patterns:
             for p in sorted(folder.glob(pat)): return p
@@ -401,83 +306,151 @@ def build_sap2_match(folder: Path, header_rows: int, docnums):
     sap2 = pick(("sap2*.txt","sap2.txt"))
     if not sap2: raise RuntimeError("⚠️ ไม่พบไฟล์ sap2_*.txt")
 
-    text = read_text(sap2)
-    head, body = iter_rows(text, header_rows=header_rows)
-    sample = "".join(head[-1:]) or "".join(body[:1])
-    dialect = detect_dialect(sample)
-    doc_idx = find_index_ci(head[-1], dialect, ["docnum"])
-
-    matches, others = [], []
-    tg = set(docnums)
-    if doc_idx is None:
-        print("⚠️ ไม่พบคอลัมน์ DocNum ใน sap2")
-    for line in body:
-        dv = get_field(line, doc_idx, dialect) if doc_idx is not None else None
-        dv = (dv or "").strip()
-        (matches if dv in tg else others).append(line)
-
     out_dir = folder / "minus_0"
     p_match = out_dir/"sap2_match_negative_docnums.txt"
     p_other = out_dir/"sap2_without_negative_docnums.txt"
-    p_match.write_text("".join(head)+"".join(matches), encoding="utf-8")
-    p_other.write_text("".join(head)+"".join(others), encoding="utf-8")
+    match_docnums_file(sap2, header_rows, p_match, p_other, docnums, workers=workers)
     return p_match
 
-def apply_msrp_to_sap2_match(sap2_match_path: Path, master_csv: Path, header_rows: int):
-    msrp_map = load_msrp_map(master_csv, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
+# ---------- MSRP rewrite (ใช้ร่วมกันทั้งไฟล์ match และไฟล์หลัก) ----------
+FREE_RX  = re.compile(r"\s*\(แถม\)\s*")
+SPACE_RX = re.compile(r"\s{2,}")
+
+def msrp_columns(rd: SapReader):
+    """หา index คอลัมน์ที่ใช้แทนค่า MSRP จากหัวตาราง"""
+    return {
+        "doc":   rd.index("docnum"),
+        "item":  rd.index("itemcode") or rd.index("code"),
+        "gp":    rd.index("gpbefdisc"),
+        "price": rd.index("priceafvat") or rd.index("price_after_vat"),
+        "total": rd.index("gtotal"),
+        "qty":   rd.index("quantity"),
+        "desc":  rd.index("itemdescription") or rd.index("item description") or rd.index("description") or rd.index("dscription") or rd.index("itemname"),
+    }
+
+def apply_msrp_row(row, ix, msrp_map) -> bool:
+    """
+    แก้ row ในที่: ลบ "(แถม)" ในคำอธิบาย แล้ว map MSRP ตาม ItemCode
+    -> GPBefDisc, PriceAfVAT = msrp และ GTotal = msrp * Quantity
+    return: True ถ้าแทนค่า MSRP
+    """
+    idx_desc = ix["desc"]
+    if idx_desc is not None and idx_desc < len(row):
+        desc = row[idx_desc]
+        if desc:
+            desc = FREE_RX.sub(" ", str(desc))
+            desc = SPACE_RX.sub(" ", desc).strip()
+            row[idx_desc] = desc
+
+    idx_item = ix["item"]
+    code = (row[idx_item] if idx_item < len(row) else "").strip().upper()
+    if not code:
+        return False
+    msrp = msrp_map.get(code)
+    if msrp is None:
+        return False
+    idx_qty = ix["qty"]
+    q = parse_float(row[idx_qty] if idx_qty < len(row) else "")
+    if q is None: q = 0.0
+    if ix["gp"]    < len(row): row[ix["gp"]]    = fmt2(msrp)
+    if ix["price"] < len(row): row[ix["price"]] = fmt2(msrp)
+    if ix["total"] < len(row): row[ix["total"]] = fmt2(msrp * q)
+    return True
+
+# ---------- columnar engine (numpy) ----------
+def fmt2_bulk(values) -> list:
+    """fmt2 ทั้งก้อนด้วยการ format ครั้งเดียว (ผลเท่ากับ [fmt2(x) for x in values])"""
+    if not len(values): return []
+    return ("%.2f\x00" * len(values) % tuple(values)).split("\x00")[:-1]
+
+def apply_msrp_rows(rows, ix, msrp_map) -> int:
+    """
+    apply_msrp_row แบบทั้ง batch: ดึงคอลัมน์ ItemCode/Quantity ออกมาเป็น array,
+    join กับ msrp_map แล้วคำนวณ GTotal + format ทศนิยม 2 ตำแหน่งทีเดียว
+    แก้ rows ในที่ ผลลัพธ์เหมือนเรียก apply_msrp_row ทีละแถว
+    return: จำนวนแถวที่แทนค่า MSRP
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("ต้องติดตั้ง numpy สำหรับ MSRP_ENGINE=columnar")
+
+    idx_desc = ix["desc"]
+    if idx_desc is not None:
+        for row in rows:
+            if idx_desc < len(row) and row[idx_desc]:
+                row[idx_desc] = SPACE_RX.sub(" ", FREE_RX.sub(" ", row[idx_desc])).strip()
+
+    idx_item, idx_qty = ix["item"], ix["qty"]
+    get = msrp_map.get
+    codes = [(row[idx_item] if idx_item < len(row) else "").strip().upper() for row in rows]
+    prices = [get(c) if c else None for c in codes]
+    hit = [i for i, m in enumerate(prices) if m is not None]
+    if not hit:
+        return 0
+
+    msrp = np.fromiter((prices[i] for i in hit), dtype=float, count=len(hit))
+    qraw = [rows[i][idx_qty] if idx_qty < len(rows[i]) else "" for i in hit]
+    try:
+        qty = np.fromiter(map(float, qraw), dtype=float, count=len(qraw))
+    except ValueError:
+        qty = np.array([q if q is not None else 0.0 for q in map(parse_float, qraw)], dtype=float)
+    msrp_s  = fmt2_bulk(msrp.tolist())
+    total_s = fmt2_bulk((msrp * qty).tolist())
+
+    gp, price, total = ix["gp"], ix["price"], ix["total"]
+    for i, m, t in zip(hit, msrp_s, total_s):
+        row = rows[i]
+        n = len(row)
+        if gp    < n: row[gp]    = m
+        if price < n: row[price] = m
+        if total < n: row[total] = t
+    return len(hit)
+
+def iter_batches(records, size: int):
+    """รวม (line, row) เป็นก้อนละ size รายการ"""
+    batch = []
+    for rec in records:
+        batch.append(rec)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def apply_msrp_to_sap2_match(sap2_match_path: Path, master_csv: Path, header_rows: int, msrp_map=None, engine=None):
+    if msrp_map is None:
+        msrp_map = load_msrp_map(master_csv, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
     print(f"[info] msrp items loaded: {len(msrp_map)}")
 
-    text = read_text(sap2_match_path)
-    head, body = iter_rows(text, header_rows=header_rows)
-    sample = "".join(head[-1:]) or "".join(body[:1])
-    dialect = detect_dialect(sample)
-
-    cols = next(csv.reader(StringIO(head[-1]), dialect=dialect))
-    colmap = {c.strip().lower(): i for i, c in enumerate(cols)}
-    def gi(nm): return colmap.get(nm.lower())
-
-    idx_item  = gi("itemcode") or colmap.get("code")
-    idx_gp    = gi("gpbefdisc")
-    idx_price = gi("priceafvat") or colmap.get("price_after_vat")
-    idx_total = gi("gtotal")
-    idx_qty   = gi("quantity")
-    idx_desc  = gi("itemdescription") or gi("item description") or gi("description") or gi("dscription") or gi("itemname")
-
-    need = [("ItemCode", idx_item), ("GPBefDisc", idx_gp), ("PriceAfVAT", idx_price), ("GTotal", idx_total), ("Quantity", idx_qty)]
-    miss = [n for n,i in need if i is None]
-    if miss:
-        raise RuntimeError("⚠️ หา column ไม่ครบใน sap2_match: %s\ncolumns: %s" % (miss, cols))
-
-    updated, out_lines = 0, []
-    for line in body:
-        row = list(next(csv.reader(StringIO(line), dialect=dialect)))
-
-        # ลบ "(แถม)" ในคำอธิบายสินค้า
-        if idx_desc is not None and idx_desc < len(row):
-            desc = row[idx_desc]
-            if desc:
-                desc = re.sub(r"\s*\(แถม\)\s*", " ", str(desc))
-                desc = re.sub(r"\s{2,}", " ", desc).strip()
-                row[idx_desc] = desc
-
-        code = (row[idx_item] if idx_item < len(row) else "").strip().upper()
-        if code:
-            msrp = msrp_map.get(code)
-            if msrp is not None:
-                q = parse_float(row[idx_qty] if idx_qty < len(row) else "")
-                if q is None: q = 0.0
-                if idx_gp    < len(row): row[idx_gp]    = fmt2(msrp)
-                if idx_price < len(row): row[idx_price] = fmt2(msrp)
-                if idx_total < len(row): row[idx_total] = fmt2(msrp * q)
-                updated += 1
-
-        sio = StringIO(); csv.writer(sio, dialect=dialect).writerow(row)
-        out_lines.append(sio.getvalue())
-
-    sap2_match_path.write_text("".join(head) + "".join(out_lines), encoding="utf-8")
-    print(f"[done] apply msrp + clean '(แถม)' -> updated {updated}/{len(body)} rows")
+    updated = total = 0
+    tmp = sap2_match_path.with_suffix(sap2_match_path.suffix + ".tmp")
+    with SapReader(sap2_match_path, header_rows=header_rows) as rd:
+        ix = msrp_columns(rd)
+        need = [("ItemCode", ix["item"]), ("GPBefDisc", ix["gp"]), ("PriceAfVAT", ix["price"]), ("GTotal", ix["total"]), ("Quantity", ix["qty"])]
+        miss = [n for n,i in need if i is None]
+        if miss:
+            raise RuntimeError("⚠️ หา column ไม่ครบใน sap2_match: %s\ncolumns: %s" % (miss, rd.columns))
+
+        with open_out(tmp) as f:
+            f.writelines(rd.header)
+            w = csv.writer(f, dialect=rd.dialect)
+            if (engine or MSRP_ENGINE) == "columnar":
+                for batch in iter_batches(rd.records(), MSRP_BATCH_ROWS):
+                    rows = [row for _, row in batch]
+                    updated += apply_msrp_rows(rows, ix, msrp_map)
+                    w.writerows(rows)
+                    total += len(rows)
+            else:
+                for _, row in rd.records():
+                    if apply_msrp_row(row, ix, msrp_map): updated += 1
+                    w.writerow(row)
+                    total += 1
+    os.replace(tmp, sap2_match_path)
+
+    print(f"[done] apply msrp + clean '(แถม)' -> updated {updated}/{total} rows")
     return updated
-def apply_msrp_to_sap2_main(folder: Path, master_csv: Path, header_rows: int, docnums: set, overwrite: bool = True):
+def apply_msrp_to_sap2_main(folder: Path, master_csv: Path, header_rows: int, docnums: set, overwrite: bool = True, msrp_map=None, engine=None):
     """
     อัปเดตไฟล์ sap2_* ตัวหลัก:
       - เฉพาะแถวที่ DocNum อยู่ใน 'docnums'
@@ -496,84 +469,152 @@ def apply_msrp_to_sap2_main(folder: Path, master_csv: Path, header_rows: int, do
     if not sap2_path:
         raise RuntimeError("⚠️ ไม่พบไฟล์ sap2_*.txt สำหรับอัปเดตไฟล์หลัก")
 
-    # โหลด msrp map
-    msrp_map = load_msrp_map(master_csv, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
+    # โหลด msrp map (ถ้ายังไม่ได้ส่งมา)
+    if msrp_map is None:
+        msrp_map = load_msrp_map(master_csv, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
+
+    if overwrite:
+        out_path = sap2_path
+        write_path = sap2_path.with_suffix(sap2_path.suffix + ".tmp")
+    else:
+        # ไม่ overwrite: เขียนเป็นไฟล์ใหม่ใน minus_0
+        out_dir = folder / "minus_0"
+        out_dir.mkdir(exist_ok=True)
+        out_path = write_path = out_dir / "sap2_main_updated.txt"
 
-    text = read_text(sap2_path)
-    head, body = iter_rows(text, header_rows=header_rows)
-    sample = "".join(head[-1:]) or "".join(body[:1])
-    dialect = detect_dialect(sample)
+    targets = set(docnums or [])
+    updated = total = 0
+    with SapReader(sap2_path, header_rows=header_rows) as rd:
+        ix = msrp_columns(rd)
+        need = [("DocNum", ix["doc"]), ("ItemCode", ix["item"]), ("GPBefDisc", ix["gp"]), ("PriceAfVAT", ix["price"]), ("GTotal", ix["total"]), ("Quantity", ix["qty"])]
+        miss = [n for n,i in need if i is None]
+        if miss:
+            raise RuntimeError(f"⚠️ หา column ไม่ครบใน sap2 หลัก: {miss}\ncolumns: {rd.columns}")
+
+        idx_doc = ix["doc"]
+        with open_out(write_path) as f:
+            f.writelines(rd.header)
+            w = csv.writer(f, dialect=rd.dialect)
+            if (engine or MSRP_ENGINE) == "columnar":
+                for batch in iter_batches(rd.records(), MSRP_BATCH_ROWS):
+                    rows = [row for _, row in batch]
+                    sel = [row for row in rows if (row[idx_doc] if idx_doc < len(row) else "").strip() in targets]
+                    if sel: updated += apply_msrp_rows(sel, ix, msrp_map)
+                    w.writerows(rows)
+                    total += len(rows)
+            else:
+                for _, row in rd.records():
+                    docv = (row[idx_doc] if idx_doc < len(row) else "").strip()
+                    if docv in targets and apply_msrp_row(row, ix, msrp_map):
+                        updated += 1
+                    # เขียนคืนทุกแถว
+                    w.writerow(row)
+                    total += 1
 
-    cols = next(csv.reader(StringIO(head[-1]), dialect=dialect))
-    colmap = {c.strip().lower(): i for i, c in enumerate(cols)}
-    def gi(nm): return colmap.get(nm.lower())
+    if overwrite:
+        # สำรองไฟล์เก่า แล้วเขียนทับแบบ atomic
+        bak = sap2_path.with_suffix(sap2_path.suffix + ".bak")
+        try:
+            shutil.copyfile(sap2_path, bak)
+        except Exception as e:
+            print(f"⚠️ backup ไม่สำเร็จ: {e}")
+        os.replace(write_path, sap2_path)
 
-    idx_doc  = gi("docnum")
-    idx_item = gi("itemcode") or colmap.get("code")
-    idx_gp   = gi("gpbefdisc")
-    idx_price= gi("priceafvat") or colmap.get("price_after_vat")
-    idx_total= gi("gtotal")
-    idx_qty  = gi("quantity")
-    idx_desc = gi("itemdescription") or gi("item description") or gi("description") or gi("dscription") or gi("itemname")
+    print(f"[done] update sap2 main -> updated {updated}/{total} rows | out: {out_path}")
+    return updated, out_path
 
-    need = [("DocNum", idx_doc), ("ItemCode", idx_item), ("GPBefDisc", idx_gp), ("PriceAfVAT", idx_price), ("GTotal", idx_total), ("Quantity", idx_qty)]
-    miss = [n for n,i in need if i is None]
-    if miss:
-        raise RuntimeError(f"⚠️ หา column ไม่ครบใน sap2 หลัก: {miss}\ncolumns: {cols}")
+class _LastWrite:
+    """file-like ที่จำข้อความล่าสุดที่ csv.writer เขียน (serialize แถวครั้งเดียวแล้วใช้ซ้ำได้หลายไฟล์)"""
+    value = ""
+    def write(self, s):
+        self.value = s
+
+def fused_stream(rd: SapReader, p_match, p_other, p_main, targets: set, msrp_map, engine=None):
+    """
+    วน body ของ rd รอบเดียว เขียน match / others / ไฟล์หลัก (แทน MSRP แล้ว) ไปพร้อมกัน
+    return: {"matched", "others", "updated"}
+    """
+    ix = msrp_columns(rd)
+    idx_doc = ix["doc"]
+    matched = others = updated = 0
+    cap = _LastWrite()
+    w = csv.writer(cap, dialect=rd.dialect)
+    with open_out(p_match) as fm, open_out(p_other) as fo, open_out(p_main) as fmain:
+        for f in (fm, fo, fmain): f.writelines(rd.header)
+        columnar = (engine or MSRP_ENGINE) == "columnar"
+        for batch in iter_batches(rd.records(), MSRP_BATCH_ROWS if columnar else 1):
+            hits = [(row[idx_doc] if idx_doc < len(row) else "").strip() in targets for _, row in batch]
+            if columnar:
+                sel = [row for (_, row), h in zip(batch, hits) if h]
+                if sel: updated += apply_msrp_rows(sel, ix, msrp_map)
+            for (line, row), h in zip(batch, hits):
+                if h:
+                    if not columnar and apply_msrp_row(row, ix, msrp_map): updated += 1
+                    w.writerow(row)
+                    fm.write(cap.value); matched += 1
+                else:
+                    fo.write(line); others += 1
+                    w.writerow(row)
+                fmain.write(cap.value)
+    return {"matched": matched, "others": others, "updated": updated}
+
+def _fused_task(rd, parts, targets, msrp_map, engine):
+    return fused_stream(rd, parts[0], parts[1], parts[2], targets, msrp_map, engine)
+
+def process_sap2_fused(folder: Path, master_csv: Path, header_rows: int, docnums: set,
+                       overwrite: bool = True, msrp_map=None, engine=None, workers: int = 1):
+    """
+    รวมขั้น 2-4 (build_sap2_match + apply_msrp_to_sap2_match + apply_msrp_to_sap2_main) ให้อ่าน sap2 รอบเดียว:
+      - แถวที่ DocNum อยู่ใน docnums: ลบ "(แถม)" + แทน MSRP แล้วเขียนลงทั้ง sap2_match_negative_docnums และไฟล์หลัก
+      - แถวอื่น: เขียนบรรทัดดิบลง sap2_without_negative_docnums และเขียนคืนไฟล์หลัก
+    ผลลัพธ์ทุกไฟล์เหมือนการรัน 3 ขั้นตอนแยกกัน
+    return: {"matched", "others", "updated", "main_path", "match_path"}
+    """
+    def pick(patterns):
+        for pat in patterns:
+            for p in sorted(folder.glob(pat)): return p
+        return None
+    sap2_path = pick(("sap2*.txt","sap2.txt"))
+    if not sap2_path: raise RuntimeError("⚠️ ไม่พบไฟล์ sap2_*.txt")
+
+    if msrp_map is None:
+        msrp_map = load_msrp_map(master_csv, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
+    print(f"[info] msrp items loaded: {len(msrp_map)}")
+
+    out_dir = folder / "minus_0"; out_dir.mkdir(exist_ok=True)
+    p_match = out_dir/"sap2_match_negative_docnums.txt"
+    p_other = out_dir/"sap2_without_negative_docnums.txt"
+    if overwrite:
+        main_path = sap2_path
+        write_path = sap2_path.with_suffix(sap2_path.suffix + ".tmp")
+    else:
+        main_path = write_path = out_dir / "sap2_main_updated.txt"
 
     targets = set(docnums or [])
-    updated, out_lines = 0, []
-
-    for line in body:
-        row = list(next(csv.reader(StringIO(line), dialect=dialect)))
-        docv = (row[idx_doc] if idx_doc < len(row) else "").strip()
-        if docv in targets:
-            # ลบ "(แถม)" ถ้ามีคอลัมน์คำอธิบาย
-            if idx_desc is not None and idx_desc < len(row):
-                desc = row[idx_desc]
-                if desc:
-                    desc = re.sub(r"\s*\(แถม\)\s*", " ", str(desc))
-                    desc = re.sub(r"\s{2,}", " ", desc).strip()
-                    row[idx_desc] = desc
-
-            code = (row[idx_item] if idx_item < len(row) else "").strip().upper()
-            if code:
-                msrp = msrp_map.get(code)
-                if msrp is not None:
-                    q = parse_float(row[idx_qty] if idx_qty < len(row) else "")
-                    if q is None: q = 0.0
-                    if idx_gp    < len(row): row[idx_gp]    = fmt2(msrp)
-                    if idx_price < len(row): row[idx_price] = fmt2(msrp)
-                    if idx_total < len(row): row[idx_total] = fmt2(msrp * q)
-                    updated += 1
-
-        # เขียนคืนทุกแถว
-        sio = StringIO(); csv.writer(sio, dialect=dialect).writerow(row)
-        out_lines.append(sio.getvalue())
-
-    # เขียนผลลัพธ์
-    new_text = "".join(head) + "".join(out_lines)
-    out_path = sap2_path
+    with SapReader(sap2_path, header_rows=header_rows) as rd:
+        ix = msrp_columns(rd)
+        need = [("DocNum", ix["doc"]), ("ItemCode", ix["item"]), ("GPBefDisc", ix["gp"]), ("PriceAfVAT", ix["price"]), ("GTotal", ix["total"]), ("Quantity", ix["qty"])]
+        miss = [n for n,i in need if i is None]
+        if miss:
+            raise RuntimeError(f"⚠️ หา column ไม่ครบใน sap2: {miss}\ncolumns: {rd.columns}")
+        if workers <= 1:
+            res = fused_stream(rd, p_match, p_other, write_path, targets, msrp_map, engine)
+    if workers > 1:
+        parts = run_chunks(sap2_path, header_rows, [p_match, p_other, write_path], _fused_task, workers,
+                           targets=targets, msrp_map=msrp_map, engine=engine)
+        res = {k: sum(r[k] for r in parts) for k in ("matched", "others", "updated")}
+    matched, others, updated = res["matched"], res["others"], res["updated"]
+
     if overwrite:
-        # สำรองไฟล์เก่า
         bak = sap2_path.with_suffix(sap2_path.suffix + ".bak")
         try:
             shutil.copyfile(sap2_path, bak)
         except Exception as e:
             print(f"⚠️ backup ไม่สำเร็จ: {e}")
-        # เขียนทับ
-        tmp = sap2_path.with_suffix(sap2_path.suffix + ".tmp")
-        tmp.write_text(new_text, encoding="utf-8")
-        os.replace(tmp, sap2_path)  # atomic replace
-    else:
-        # ไม่ overwrite: เขียนเป็นไฟล์ใหม่ใน minus_0
-        out_dir = folder / "minus_0"
-        out_dir.mkdir(exist_ok=True)
-        out_path = out_dir / "sap2_main_updated.txt"
-        out_path.write_text(new_text, encoding="utf-8")
+        os.replace(write_path, sap2_path)
 
-    print(f"[done] update sap2 main -> updated {updated}/{len(body)} rows | out: {out_path}")
-    return updated, out_path
+    print(f"[done] sap2 fused -> match {matched} / others {others} | updated {updated} rows | out: {main_path}")
+    return {"matched": matched, "others": others, "updated": updated, "main_path": main_path, "match_path": p_match}
 
 # ---------- main ----------
 def main():
@@ -587,6 +628,10 @@ def main():
     p.add_argument("--header-rows", type=int, default=DEFAULT_HEADER_ROWS)
     p.add_argument("--keyword", default=DEFAULT_KEYWORD)
     p.add_argument("--no-download", action="store_true", help="ปิด auto-download")
+    p.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS, help="จำนวนไฟล์ที่ดาวน์โหลดพร้อมกัน (ดีฟอลต์ DOWNLOAD_WORKERS ใน .env)")
+    p.add_argument("--no-fused", action="store_true", help="ประมวลผล sap2 แบบแยกขั้นตอนเดิม (อ่าน sap2 สองรอบ)")
+    p.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="จำนวน process ที่ใช้แบ่ง chunk ประมวลผล sap1/sap2 (ดีฟอลต์ 1)")
+    p.add_argument("--engine", choices=["row", "columnar"], default=MSRP_ENGINE, help="วิธีแทนค่า MSRP: row (ทีละแถว) หรือ columnar (numpy ทีละ batch)")
     # LINE options
     p.add_argument("--notify-test", action="store_true", help="ส่งข้อความทดสอบ LINE ทันที แล้วรันงานต่อ")
     p.add_argument("--notify-always", action="store_true", help="บังคับส่งสรุป LINE แม้ไม่พบบรรทัดคีย์เวิร์ด")
@@ -634,12 +679,14 @@ def main():
                 line_push(f"❌ ERROR: API status != success ({from_date}→{to_date})")
                 sys.exit("API status != success")
             date_suffix = from_date if from_date == to_date else f"{from_date}_to_{to_date}"
+            jobs = []
             for key, link in files.items():
                 if not link: continue
                 dest = folder_p / sanitize(f"{key}_{date_suffix}.txt")
                 print(f"[dl] {key} -> {dest}")
-                try: download(link, str(dest))
-                except Exception as e: print(f"[err] download {key}: {e}")
+                jobs.append((key, link, str(dest)))
+            for r in download_all(jobs, download, workers=args.download_workers, retries=DOWNLOAD_RETRIES):
+                if not r["ok"]: print(f"[err] download {r['key']}: {r['error']}")
         except Exception as e:
             line_push(f"❌ ERROR: ดึงไฟล์ช่วง {from_date}→{to_date} ล้มเหลว\n{e}")
             sys.exit(f"ดึง API ล้มเหลว: {e}")
@@ -650,13 +697,20 @@ def main():
         sys.exit("ไม่พบไฟล์ MasterData: %s" % master_p)
 
     # 1) sap1 split
-    info = split_sap1_and_collect_docnums(folder_p, header_rows=args.header_rows, keyword=args.keyword)
-    # 2) sap2 match
-    p_match = build_sap2_match(folder_p, header_rows=args.header_rows, docnums=info["docnums"])
-    # 3) apply msrp + clean "(แถม)"
-    upd = apply_msrp_to_sap2_match(Path(p_match), master_p, header_rows=args.header_rows)
-    # 4) apply msrp main
-    upd_main, sap2_out = apply_msrp_to_sap2_main(folder_p, master_p, args.header_rows, info["docnums"], overwrite=True)
+    info = split_sap1_and_collect_docnums(folder_p, header_rows=args.header_rows, keyword=args.keyword, workers=args.workers)
+    msrp_map = load_msrp_map(master_p, code_col=MASTER_CODE_COL, msrp_col=MASTER_MSRP_COL)
+    if args.no_fused:
+        # 2) sap2 match
+        p_match = build_sap2_match(folder_p, header_rows=args.header_rows, docnums=info["docnums"], workers=args.workers)
+        # 3) apply msrp + clean "(แถม)"
+        upd = apply_msrp_to_sap2_match(Path(p_match), master_p, header_rows=args.header_rows, msrp_map=msrp_map, engine=args.engine)
+        # 4) apply msrp main
+        upd_main, sap2_out = apply_msrp_to_sap2_main(folder_p, master_p, args.header_rows, info["docnums"], overwrite=True, msrp_map=msrp_map, engine=args.engine)
+    else:
+        # 2-4) sap2 รอบเดียว: match / not match / แทน MSRP ไฟล์หลัก
+        res = process_sap2_fused(folder_p, master_p, args.header_rows, info["docnums"], overwrite=True, msrp_map=msrp_map, engine=args.engine, workers=args.workers)
+        upd = upd_main = res["updated"]
+        sap2_out = res["main_path"]
 
     # สรุป + แจ้ง LINE
     summary = []
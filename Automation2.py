@@ -5,14 +5,18 @@ import sys
 import json
 import time
 import re
-import csv
-from io import StringIO
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
 import requests
 from dotenv import load_dotenv
 import paramiko
 
+from sap_stream import split_keyword_file, match_docnums_file
+from http_client import get_client
+from line_notifier import notify, all_ok
+from sftp_sync import remote_listing, needs_upload, mark_uploaded
+from export_client import fetch_resumable, export_settings, add_export_args, fetch_range
+
 # ---------- env & config ----------
 load_dotenv()
 
@@ -22,12 +26,14 @@ VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() == "true"
 TIMEOUT = int(os.getenv("TIMEOUT_SECONDS", "60"))
 AUTH_HEADER_NAME = os.getenv("AUTH_HEADER_NAME") or None
 AUTH_HEADER_VALUE = os.getenv("AUTH_HEADER_VALUE") or None
+EXPORT = export_settings()   # DOWNLOAD_* / EXPORT_* จาก .env (ดู export_client.export_settings)
 
 FIXED_OUT_DIR = os.getenv("FIXED_OUT_DIR", r"C:\Users\kornkanok\Documents\Automation_api\Mizerp_api")
 
 HEADER_ROWS = int(os.getenv("HEADER_ROWS", "2"))
 KEYWORD = os.getenv("KEYWORD", "ส่วนลดติดลบ")
 CASE_INSENSITIVE = os.getenv("CASE_INSENSITIVE", "true").lower() == "true"
+WORKERS = int(os.getenv("WORKERS", "1"))  # >1 = แบ่ง sap1/sap2 เป็น chunk ประมวลผลหลาย process
 
 LINE_CHANNEL_ACCESS_TOKEN = (os.getenv("LINE_CHANNEL_ACCESS_TOKEN") or "").strip()
 LINE_TO_ID = (os.getenv("LINE_TO_ID") or "").strip()
@@ -41,8 +47,11 @@ SFTP_KEY_PATH = os.getenv("SFTP_KEY_PATH") or ""
 SFTP_KEY_PASS = os.getenv("SFTP_KEY_PASS") or ""
 SFTP_REMOTE_DIR = os.getenv("SFTP_REMOTE_DIR") or ""
 SFTP_SUBFOLDER_BY_DATE = (os.getenv("SFTP_SUBFOLDER_BY_DATE", "true").lower() == "true")
+# sync mode: list ปลายทางครั้งเดียว แล้วอัปโหลดเฉพาะไฟล์ที่ขนาด/mtime (หรือ sha256 ใน sidecar) ต่างกัน
+SFTP_SYNC = (os.getenv("SFTP_SYNC", "false").lower() == "true")
+SFTP_SYNC_HASH = (os.getenv("SFTP_SYNC_HASH", "false").lower() == "true")
 
-SESSION = requests.Session()
+HTTP = get_client()  # session + pool กลาง (export / ดาวน์โหลด / LINE)
 
 # ---------- helpers ----------
 def iso_date(s: str) -> str:
@@ -77,9 +86,6 @@ def sanitize_filename(name: str) -> str:
         name = name.replace(ch, "_")
     return name
 
-def backoff_sleep(attempt: int):
-    time.sleep(min(30, 2 ** attempt))  # 1,2,4,8,16,30
-
 def _dump_response(resp):
     os.makedirs("debug", exist_ok=True)
     ts = time.strftime("%Y%m%d_%H%M%S")
@@ -116,38 +122,24 @@ def post_export(from_date: str, to_date: str) -> dict:
     payload = {"fromDate": from_date, "toDate": to_date}
     headers = build_post_headers()
 
-    for attempt in range(6):
-        try:
-            resp = SESSION.post(url, headers=headers, data=payload,
-                                timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True)
-            print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
-
-            if resp.status_code in (429, 502, 503, 504):
-                backoff_sleep(attempt); continue
+    # retry 429/502/503/504 + network error อยู่ใน http_client (backoff 1,2,4,..,30s หรือ Retry-After)
+    # สั่ง export ซ้ำได้ผลเหมือนเดิม -> ขอ retry network error ของ POST นี้ด้วย
+    resp = HTTP.post(url, headers=headers, data=payload,
+                     timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True, retry_errors=True)
+    print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
 
-            if not (200 <= resp.status_code < 300):
-                dump_path = _dump_response(resp)
-                resp.raise_for_status()
-                raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
-
-            return safe_json(resp)
+    if not (200 <= resp.status_code < 300):
+        dump_path = _dump_response(resp)
+        resp.raise_for_status()
+        raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
 
-        except requests.RequestException as e:
-            if attempt == 5:
-                raise
-            print(f"[warn] request failed: {e}; retry...", flush=True)
-            backoff_sleep(attempt)
+    return safe_json(resp)
 
-def download_file(file_url: str, dest_path: str):
+def download_file(file_url: str, dest_path: str) -> int:
+    # โหลดลง .part (ต่อจากเดิมได้) ตรวจครบแล้วค่อย rename เป็น dest_path
     url = normalize_url(file_url)
-    headers = build_get_headers()
-    with SESSION.get(url, stream=True, timeout=TIMEOUT,
-                     verify=VERIFY_TLS, headers=headers, allow_redirects=True) as r:
-        r.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    f.write(chunk)
+    return fetch_resumable(HTTP, url, dest_path, headers=build_get_headers(),
+                           timeout=TIMEOUT, verify=VERIFY_TLS)
 
 # ---------- date extraction from content / url ----------
 DATE_PATTERNS = [
@@ -194,44 +186,6 @@ def detect_file_date(path: str, url: str, max_bytes: int = 256 * 1024) -> str:
     except Exception:
         return ""
 
-# ---------- CSV helpers ----------
-def detect_dialect(sample_text: str):
-    sniffer = csv.Sniffer()
-    try:
-        return sniffer.sniff(sample_text, delimiters=[",", "\t", "|", ";"])
-    except Exception:
-        class Fallback(csv.Dialect):
-            delimiter = "\t"
-            quotechar = '"'
-            doublequote = True
-            skipinitialspace = False
-            lineterminator = "\n"
-            quoting = csv.QUOTE_MINIMAL
-        return Fallback
-
-def iter_rows(text: str, header_rows: int = 1):
-    lines = text.splitlines(keepends=True)
-    return lines[:header_rows], lines[header_rows:]
-
-def find_docnum_index(header_line: str, dialect):
-    reader = csv.reader(StringIO(header_line), dialect=dialect)
-    cols = next(reader)
-    lowered = [c.strip().lower() for c in cols]
-    for i, name in enumerate(lowered):
-        if name == "docnum":
-            return i
-    return None
-
-def get_field(line: str, idx, dialect):
-    reader = csv.reader(StringIO(line), dialect=dialect)
-    try:
-        row = next(reader)
-        if idx is None or idx >= len(row):
-            return None
-        return row[idx]
-    except Exception:
-        return None
-
 # ---------- LINE ----------
 LINE_CHANNEL_ACCESS_TOKEN = (os.getenv("LINE_CHANNEL_ACCESS_TOKEN") or "").strip()
 
@@ -243,53 +197,12 @@ LINE_USER_IDS  = _split_ids(os.getenv("LINE_USER_IDS") or "")
 LINE_GROUP_IDS = _split_ids(os.getenv("LINE_GROUP_IDS") or "")
 
 def line_notify(text: str) -> bool:
-    """ส่งข้อความไปได้ทั้ง: LINE_TO_ID (เดี่ยว), หลาย userIds (multicast), หลาย groupIds (push ทีละกลุ่ม)"""
+    """ส่งข้อความไปได้ทั้ง: LINE_TO_ID (เดี่ยว), หลาย userIds (multicast), หลาย groupIds (push ทีละกลุ่ม) พร้อมกัน"""
     if not LINE_CHANNEL_ACCESS_TOKEN:
         print("⚠️ ไม่มี LINE_CHANNEL_ACCESS_TOKEN"); return False
-
-    headers = {"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-               "Content-Type": "application/json"}
-    messages = [{"type": "text", "text": text}]
-    ok = True
-
-    # 0) ส่งตาม LINE_TO_ID เดิม (ถ้ากำหนดไว้)
-    if LINE_TO_ID:
-        r = requests.post("https://api.line.me/v2/bot/message/push",
-                          headers=headers, json={"to": LINE_TO_ID, "messages": messages}, timeout=20)
-        ok &= (r.status_code == 200)
-        if not ok: print("push LINE_TO_ID:", r.status_code, r.text)
-
-    # 1) ส่งเข้ากลุ่มทั้งหมด (ต้องใช้ push ต่อกลุ่ม)
-    for gid in LINE_GROUP_IDS:
-        r = requests.post("https://api.line.me/v2/bot/message/push",
-                          headers=headers, json={"to": gid, "messages": messages}, timeout=20)
-        ok &= (r.status_code == 200)
-        if r.status_code != 200:
-            print(f"push group {gid}:", r.status_code, r.text)
-
-    # 2) ส่งเข้าผู้ใช้ทั้งหมด
-    if len(LINE_USER_IDS) == 1:
-        uid = LINE_USER_IDS[0]
-        r = requests.post("https://api.line.me/v2/bot/message/push",
-                          headers=headers, json={"to": uid, "messages": messages}, timeout=20)
-        ok &= (r.status_code == 200)
-        if r.status_code != 200:
-            print(f"push user {uid}:", r.status_code, r.text)
-
-    elif len(LINE_USER_IDS) > 1:
-        # multicast ส่งได้เฉพาะ "ผู้ใช้" ไม่รองรับ group/room
-        # สูงสุด 500 user ต่อครั้ง (ถ้ามากกว่านั้นให้ chunk เป็นก้อน ๆ)
-        users = LINE_USER_IDS
-        CHUNK = 500
-        for i in range(0, len(users), CHUNK):
-            batch = users[i:i+CHUNK]
-            r = requests.post("https://api.line.me/v2/bot/message/multicast",
-                              headers=headers, json={"to": batch, "messages": messages}, timeout=30)
-            ok &= (r.status_code == 200)
-            if r.status_code != 200:
-                print(f"multicast users {i}-{i+len(batch)-1}:", r.status_code, r.text)
-
-    return ok
+    report = notify(text, LINE_CHANNEL_ACCESS_TOKEN, user_ids=LINE_USER_IDS,
+                    group_ids=LINE_GROUP_IDS, to_ids=[LINE_TO_ID])
+    return all_ok(report)
 
 # ---------- SFTP ----------
 def _sftp_connect():
@@ -310,17 +223,37 @@ def _sftp_connect():
     )
     return client
 
-def _sftp_ensure_dir(sftp, remote_dir: str):
-    parts = [p for p in remote_dir.strip("/").split("/") if p]
+def _sftp_ensure_dir(sftp, remote_dir: str, known: set = None):
+    """
+    สร้างโฟลเดอร์ปลายทางที่ยังไม่มี
+    known = set ของโฟลเดอร์ที่รู้แล้วว่ามี (หนึ่ง set ต่อ connection) -> ไม่ stat ซ้ำ
+    """
+    known = set() if known is None else known
+    chain = []
     cur = ""
-    for seg in parts:
+    for seg in [p for p in remote_dir.strip("/").split("/") if p]:
         cur = cur + "/" + seg
+        chain.append(cur)
+    if not chain or chain[-1] in known:
+        return
+    # ปกติโฟลเดอร์มีอยู่แล้ว: stat ชั้นล่างสุดครั้งเดียวแทนทีละชั้น
+    try:
+        sftp.stat(chain[-1])
+        known.update(chain)
+        return
+    except IOError:
+        pass
+    for cur in chain:
+        if cur in known:
+            continue
         try:
             sftp.stat(cur)
         except IOError:
             sftp.mkdir(cur)
+        known.add(cur)
 
-def sftp_upload_files(local_paths, base_remote_dir: str, subdir: str = None):
+def sftp_upload_files(local_paths, base_remote_dir: str, subdir: str = None,
+                      sync: bool = SFTP_SYNC, use_hash: bool = SFTP_SYNC_HASH):
     if not ENABLE_SFTP:
         print("SFTP disabled; ข้ามการอัปโหลด"); return
     if not SFTP_HOST or not SFTP_USER or not base_remote_dir:
@@ -332,7 +265,9 @@ def sftp_upload_files(local_paths, base_remote_dir: str, subdir: str = None):
         remote_dir = base_remote_dir
         if subdir:
             remote_dir = base_remote_dir.rstrip("/") + "/" + subdir
-        _sftp_ensure_dir(sftp, remote_dir)
+        known_dirs = set()  # cache โฟลเดอร์ที่มีอยู่ของ connection นี้
+        _sftp_ensure_dir(sftp, remote_dir, known_dirs)
+        listing = remote_listing(sftp, remote_dir) if sync else {}
 
         for p in local_paths:
             if not p:
@@ -340,8 +275,14 @@ def sftp_upload_files(local_paths, base_remote_dir: str, subdir: str = None):
             if not os.path.exists(p):
                 print(f"⚠️ ไฟล์ไม่พบ: {p} -> ข้าม"); continue
             remote_path = remote_dir.rstrip("/") + "/" + os.path.basename(p)
+            if sync:
+                todo, why = needs_upload(sftp, p, remote_path, listing, use_hash=use_hash)
+                if not todo:
+                    print(f"skip {p} (ปลายทางเหมือนกัน: {why})"); continue
             print(f"put {p} -> {remote_path}")
             sftp.put(p, remote_path)
+            if sync:
+                mark_uploaded(sftp, p, remote_path, use_hash=use_hash)
 
         sftp.close()
         client.close()
@@ -353,7 +294,7 @@ def sftp_upload_files(local_paths, base_remote_dir: str, subdir: str = None):
         print(f"❌ SFTP error: {e}")
 
 # ---------- processing ----------
-def process_negative_and_match(folder: str):
+def process_negative_and_match(folder: str, workers: int = 1):
     folder_p = os.path.abspath(folder)
     names = os.listdir(folder_p)
 
@@ -372,72 +313,21 @@ def process_negative_and_match(folder: str):
         print("⚠️ ไม่พบไฟล์ sap1 หรือ sap2 สำหรับประมวลผล")
         return {"keyword_count": 0, "docnum_count": 0, "path_without_negative": None, "notes": "missing sap1/sap2"}
 
-    with open(sap1_path, "r", encoding="utf-8-sig") as f:
-        src_text = f.read()
-    src_header, src_body = iter_rows(src_text, header_rows=HEADER_ROWS)
-
-    sample_for_sniff = "".join(src_header[-1:]) or "".join(src_body[:1])
-    src_dialect = detect_dialect(sample_for_sniff)
-    docnum_idx_src = find_docnum_index(src_header[-1], src_dialect)
-
-    lines_with_keyword = []
-    lines_without_keyword = []
-    docnums_found = {}
-    count_keyword = 0
-
-    for line in src_body:
-        target_line = line.lower() if CASE_INSENSITIVE else line
-        target_kw = KEYWORD.lower() if CASE_INSENSITIVE else KEYWORD
-        occ = target_line.count(target_kw)
-        if occ > 0:
-            lines_with_keyword.append(line)
-            count_keyword += occ
-            dv = get_field(line, docnum_idx_src, src_dialect)
-            dv = (dv or "").strip()
-            if dv:
-                docnums_found[dv] = True
-        else:
-            lines_without_keyword.append(line)
-
     minus_dir = os.path.join(folder_p, "minus_0")
     ensure_dir(minus_dir)
     out_with_keyword    = os.path.join(minus_dir, "sap1_only_negative.txt")
     out_without_negative = os.path.join(minus_dir, "sap1_without_negative.txt")
 
-    with open(out_with_keyword, "w", encoding="utf-8") as f:
-        f.write("".join(src_header) + "".join(lines_with_keyword))
-    with open(out_without_negative, "w", encoding="utf-8") as f:
-        f.write("".join(src_header) + "".join(lines_without_keyword))
-
-    # sap2 matching
-    with open(sap2_path, "r", encoding="utf-8-sig") as f:
-        lookup_text = f.read()
-    lookup_header, lookup_body = iter_rows(lookup_text, header_rows=HEADER_ROWS)
-    sample_for_sniff2 = "".join(lookup_header[-1:]) or "".join(lookup_body[:1])
-    lookup_dialect = detect_dialect(sample_for_sniff2)
-    docnum_idx_lookup = find_docnum_index(lookup_header[-1], lookup_dialect)
-
-    lookup_matches = []
-    lookup_without_matches = []
-
-    if docnum_idx_lookup is None:
-        print("⚠️ ไม่พบคอลัมน์ DocNum ในไฟล์ sap2")
-    else:
-        targets = set(docnums_found.keys())
-        for line in lookup_body:
-            dv = get_field(line, docnum_idx_lookup, lookup_dialect)
-            dv = (dv or "").strip()
-            if dv in targets:
-                lookup_matches.append(line)
-            else:
-                lookup_without_matches.append(line)
+    # อ่าน sap1 ทีละบรรทัด แยก keyword และเก็บ DocNum ไปพร้อมกัน
+    res = split_keyword_file(sap1_path, HEADER_ROWS, out_with_keyword, out_without_negative,
+                             keyword=KEYWORD, case_insensitive=CASE_INSENSITIVE, workers=workers)
+    docnums_found = res["docnums"]
+    count_keyword = res["count_keyword"]
 
+    # sap2 matching (อ่านทีละ record)
     out_lookup_matches = os.path.join(minus_dir, "sap2_match_negative_docnums.txt")
     out_lookup_without = os.path.join(minus_dir, "sap2_without_negative_docnums.txt")
-    with open(out_lookup_matches, "w", encoding="utf-8") as f:
-        f.write("".join(lookup_header) + "".join(lookup_matches))
-    with open(out_lookup_without, "w", encoding="utf-8") as f:
-        f.write("".join(lookup_header) + "".join(lookup_without_matches))
+    match_docnums_file(sap2_path, HEADER_ROWS, out_lookup_matches, out_lookup_without, docnums_found, workers=workers)
 
     # สรุป / LINE
     summary = (f"สรุปประมวลผล\n"
@@ -469,6 +359,8 @@ def main():
     parser.add_argument("--out-dir", dest="out_dir", default=FIXED_OUT_DIR, help="โฟลเดอร์ปลายทางหลัก")
     parser.add_argument("--use-file-date", action="store_true", help="รีเนมไฟล์ตามวันที่ที่พบในไฟล์/URL")
     parser.add_argument("--skip-process", action="store_true", help="ดึงไฟล์อย่างเดียว (ไม่ประมวลผล/ไม่อัปโหลด/ไม่ส่ง LINE)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="จำนวน process ที่ใช้แบ่ง chunk ประมวลผล sap1/sap2 (ดีฟอลต์ 1)")
+    add_export_args(parser, EXPORT)
     args = parser.parse_args()
 
     # เลือกช่วงเวลา
@@ -480,37 +372,30 @@ def main():
 
     date_suffix = from_date if from_date == to_date else f"{from_date}_to_{to_date}"
     print(f"[info] Requesting export {from_date} → {to_date}", flush=True)
-    data = post_export(from_date, to_date)
-
-    status = str(data.get("status", "")).lower()
-    message = data.get("message", "")
-    files = data.get("files", {}) or {}
-
-    print(f"[info] status={status} message={message}", flush=True)
-    if status != "success":
-        print("[error] API did not return success status.", flush=True)
-        print(json.dumps(data, indent=2, ensure_ascii=False), flush=True)
-        sys.exit(1)
 
     # โฟลเดอร์ปลายทางตามช่วงวันที่
     out_root = args.out_dir
     folder_name = f"{from_date}_to_{to_date}"
     out_dir = os.path.join(out_root, folder_name)
-    ensure_dir(out_dir)
 
     # ดาวน์โหลด & เก็บ mapping key->path
     saved_paths = {}  # key (lower) -> path
-    for key, link in files.items():
-        if not link:
-            print(f"[warn] missing link for key={key}, skip", flush=True)
-            continue
-        fname = sanitize_filename(f"{key}_{date_suffix}.txt")
-        dest  = os.path.join(out_dir, fname)
-        print(f"[info] downloading {key} -> {dest}", flush=True)
-        try:
-            download_file(link, dest)
-        except requests.RequestException as e:
-            print(f"[error] download failed for {key}: {e}", flush=True)
+    try:
+        results = fetch_range(from_date, to_date, out_dir,
+                              lambda key: sanitize_filename(f"{key}_{date_suffix}.txt"),
+                              post_export, download_file, HEADER_ROWS,
+                              workers=args.download_workers, retries=EXPORT["download_retries"],
+                              span_days=args.split_days, concurrency=args.export_concurrency,
+                              cache=args.export_cache, cache_dir=EXPORT["cache_dir"],
+                              cache_ttl_hours=EXPORT["cache_ttl_hours"])
+    except (RuntimeError, requests.RequestException) as e:
+        print(f"[error] export failed: {e}", flush=True)
+        sys.exit(1)
+
+    for r in results:
+        key, link, dest = r["key"], r["url"], r["dest"]
+        if not r["ok"]:
+            print(f"[error] download failed for {key}: {r['error']}", flush=True)
             continue
 
         if args.use_file_date:
@@ -545,7 +430,7 @@ def main():
     # ประมวลผล & เตรียมอัปโหลด
     # ขั้นตอนประมวลผล & เตรียมอัปโหลด
     if not args.skip_process:
-        result = process_negative_and_match(out_dir)
+        result = process_negative_and_match(out_dir, workers=args.workers)
         print(f"[info] Process result: found={result['keyword_count']} docnums={result['docnum_count']}")
 
          #เลือกไฟล์ sap3 และ dl0 จาก saved_paths
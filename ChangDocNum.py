@@ -3,6 +3,8 @@ import csv
 from io import StringIO
 from collections import defaultdict
 
+from sap_stream import iter_records
+
 # ====== ตั้งค่า ======
 target_file = r"C:\Users\kornkanok\Documents\Automation_api\minus_0\Edit_sap1.txt"
 output_file = r"C:\Users\kornkanok\Documents\Automation_api\Check_Docnum\ChangDocNum.txt"
@@ -46,9 +48,6 @@ def find_col_index(header_line, col_name, dialect):
             return i
     return None
 
-def parse_row(line, dialect):
-    return next(csv.reader(StringIO(line), dialect=dialect))
-
 def make_line(fields, dialect):
     output = StringIO()
     # กำหนด lineterminator="" ป้องกันการเว้นบรรทัด
@@ -71,8 +70,7 @@ if docnum_idx is None:
 seen = defaultdict(int)
 fixed_lines = []
 
-for line in body_lines:
-    row = parse_row(line, dialect)
+for _, row in iter_records(body_lines, dialect):
     docnum_val = row[docnum_idx].strip()
 
     # แปลงเป็นตัวเลขถ้าทำได้
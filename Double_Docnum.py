@@ -3,6 +3,8 @@ import os, csv
 from io import StringIO
 from collections import Counter
 
+from sap_stream import iter_records
+
 # ====== ตั้งค่า ======
 # เปลี่ยน path ให้ตรงกับไฟล์ Edit_sap1.txt ของคุณ
 target_file = r"C:\Users\kornkanok\Documents\Automation_api\minus_0\Edit_sap1.txt"
@@ -50,59 +52,61 @@ def find_col_index(header_line, col_name, dialect):
             return i
     return None
 
-def get_field(line, idx, dialect):
-    reader = csv.reader(StringIO(line), dialect=dialect)
-    try:
-        row = next(reader)
-        if idx is None or idx >= len(row):
-            return None
-        return row[idx]
-    except Exception:
-        return None
-
-# ====== อ่านไฟล์เป้าหมาย ======
-text = read_text(target_file)
-header_lines, body_lines = iter_rows(text, header_rows=header_rows)
-
-# เดา delimiter จากหัวแถวสุดท้ายหรือบรรทัดข้อมูล
-sample_for_sniff = "".join(header_lines[-1:]) or "".join(body_lines[:1])
-dialect = detect_dialect(sample_for_sniff)
-
-# หา index ของคอลัมน์ DocNum
-docnum_idx = find_col_index(header_lines[-1], "DocNum", dialect)
-if docnum_idx is None:
-    raise RuntimeError("ไม่พบคอลัมน์ชื่อ 'DocNum' ในไฟล์ Edit_sap1.txt (ตรวจหัวตารางอีกครั้ง)")
-
-# ====== นับ DocNum ======
-cnt = Counter()
-for line in body_lines:
-    dv = get_field(line, docnum_idx, dialect)
-    if dv is not None and dv != "":
-        cnt[dv] += 1
-
-# DocNum ที่ซ้ำ (จำนวน > 1)
-duplicate_docnums = {k for k, v in cnt.items() if v > 1}
-
-# ====== แยกบรรทัดที่ซ้ำ เขียนไฟล์ใหม่ ======
-dup_lines = []
-for lineno, line in enumerate(body_lines, start=header_rows+1):
-    dv = get_field(line, docnum_idx, dialect)
-    if dv in duplicate_docnums:
-        dup_lines.append(line)
-        # แสดงผลเพื่ออ้างอิง
-        print(f"[dup line {lineno}] DocNum={dv} | {line.strip()}")
-
-with open(out_duplicates, "w", encoding="utf-8") as f:
-    f.writelines(header_lines)
-    f.writelines(dup_lines)
-
-# ====== สรุป ======
-total_rows = len(body_lines)
-total_docnums = sum(1 for k in cnt.keys())
-total_dups = len(duplicate_docnums)
-print("\n========== สรุป ==========")
-print(f"แถวข้อมูลทั้งหมด (ไม่รวม header): {total_rows:,}")
-print(f"DocNum ทั้งหมด (นับชนิด): {total_docnums:,}")
-print(f"DocNum ที่ซ้ำ (ชนิด): {total_dups:,}")
-print(f"จำนวนแถวที่ถูกดึงออก (ซ้ำ): {len(dup_lines):,}")
-print(f"ไฟล์ที่บันทึกบรรทัด DocNum ซ้ำ: {out_duplicates}")
+# ====== หา DocNum ซ้ำ ======
+def find_duplicate_docnums(target_file, out_duplicates, header_rows=2, verbose=True):
+    """ดึงบรรทัดที่ DocNum ซ้ำจาก target_file ไปเขียนที่ out_duplicates แล้วคืนสรุปจำนวน"""
+    # ====== อ่านไฟล์เป้าหมาย ======
+    text = read_text(target_file)
+    header_lines, body_lines = iter_rows(text, header_rows=header_rows)
+
+    # เดา delimiter จากหัวแถวสุดท้ายหรือบรรทัดข้อมูล
+    sample_for_sniff = "".join(header_lines[-1:]) or "".join(body_lines[:1])
+    dialect = detect_dialect(sample_for_sniff)
+
+    # หา index ของคอลัมน์ DocNum
+    docnum_idx = find_col_index(header_lines[-1], "DocNum", dialect)
+    if docnum_idx is None:
+        raise RuntimeError("ไม่พบคอลัมน์ชื่อ 'DocNum' ในไฟล์ Edit_sap1.txt (ตรวจหัวตารางอีกครั้ง)")
+
+    # ====== parse ทุกแถวครั้งเดียว (csv.reader ตัวเดียวทั้งไฟล์) ======
+    records = []
+    for line, row in iter_records(body_lines, dialect):
+        dv = row[docnum_idx] if docnum_idx < len(row) else None
+        records.append((line, dv))
+
+    # ====== นับ DocNum ======
+    cnt = Counter()
+    for _, dv in records:
+        if dv is not None and dv != "":
+            cnt[dv] += 1
+
+    # DocNum ที่ซ้ำ (จำนวน > 1)
+    duplicate_docnums = {k for k, v in cnt.items() if v > 1}
+
+    # ====== แยกบรรทัดที่ซ้ำ เขียนไฟล์ใหม่ ======
+    dup_lines = []
+    for lineno, (line, dv) in enumerate(records, start=header_rows+1):
+        if dv in duplicate_docnums:
+            dup_lines.append(line)
+            # แสดงผลเพื่ออ้างอิง
+            if verbose:
+                print(f"[dup line {lineno}] DocNum={dv} | {line.strip()}")
+
+    with open(out_duplicates, "w", encoding="utf-8") as f:
+        f.writelines(header_lines)
+        f.writelines(dup_lines)
+
+    # ====== สรุป ======
+    total_rows = len(records)
+    total_docnums = sum(1 for k in cnt.keys())
+    total_dups = len(duplicate_docnums)
+    print("\n========== สรุป ==========")
+    print(f"แถวข้อมูลทั้งหมด (ไม่รวม header): {total_rows:,}")
+    print(f"DocNum ทั้งหมด (นับชนิด): {total_docnums:,}")
+    print(f"DocNum ที่ซ้ำ (ชนิด): {total_dups:,}")
+    print(f"จำนวนแถวที่ถูกดึงออก (ซ้ำ): {len(dup_lines):,}")
+    print(f"ไฟล์ที่บันทึกบรรทัด DocNum ซ้ำ: {out_duplicates}")
+    return {"rows": total_rows, "docnums": total_docnums, "duplicates": total_dups, "dup_rows": len(dup_lines)}
+
+if __name__ == "__main__":
+    find_duplicate_docnums(target_file, out_duplicates, header_rows=header_rows)
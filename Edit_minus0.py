@@ -3,9 +3,12 @@ import re
 import csv
 import argparse
 from io import StringIO
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Callable
 from pathlib import Path
 
+from sap_stream import SapReader, split_keyword_stream, match_docnums_stream
+from msrp_cache import cached_msrp_map
+
 # -------------------- ค่าดีฟอลต์ --------------------
 DEFAULT_KEYWORD = "ส่วนลดติดลบ"
 DEFAULT_HEADER_ROWS = 2
@@ -14,50 +17,7 @@ CASE_INSENSITIVE = True  # ปรับได้
 # คอลัมน์ใน master
 MASTER_CODE_COL_DEFAULT = "Code"
 MASTER_MSRP_COL_DEFAULT = "msrp"
-
-# -------------------- CSV helpers --------------------
-def detect_dialect(sample_text: str):
-    sniffer = csv.Sniffer()
-    try:
-        return sniffer.sniff(sample_text, delimiters=[",", "\t", "|", ";"])
-    except Exception:
-        class Fallback(csv.Dialect):
-            delimiter = "\t"
-            quotechar = '"'
-            doublequote = True
-            skipinitialspace = False
-            lineterminator = "\n"
-            quoting = csv.QUOTE_MINIMAL
-        return Fallback
-
-def iter_rows(text: str, header_rows: int = 1):
-    lines = text.splitlines(keepends=True)
-    return lines[:header_rows], lines[header_rows:]
-
-def find_docnum_index(header_line: str, dialect) -> Optional[int]:
-    reader = csv.reader(StringIO(header_line), dialect=dialect)
-    cols = next(reader)
-    lowered = [c.strip().lower() for c in cols]
-    for i, name in enumerate(lowered):
-        if name == "docnum":
-            return i
-    return None
-
-def get_field(line: str, idx: Optional[int], dialect) -> Optional[str]:
-    reader = csv.reader(StringIO(line), dialect=dialect)
-    try:
-        row = next(reader)
-        if idx is None or idx >= len(row):
-            return None
-        return row[idx]
-    except Exception:
-        return None
-
-def read_text(path: Path) -> str:
-    try:
-        return path.read_text(encoding="utf-8-sig")
-    except UnicodeError:
-        return path.read_text(encoding="utf-8")
+MSRP_LOADER_VERSION = 1   # เพิ่มเมื่อ read_msrp_map ให้ผลต่างจากเดิม (cache เก่าจะถูกสร้างใหม่)
 
 # -------------------- ตัวช่วยตัวเลข --------------------
 def parse_float(s: Optional[str]) -> Optional[float]:
@@ -83,6 +43,14 @@ def parse_float(s: Optional[str]) -> Optional[float]:
 def load_msrp_map(path: Path,
                   code_col: str = MASTER_CODE_COL_DEFAULT,
                   msrp_col: str = MASTER_MSRP_COL_DEFAULT) -> Dict[str, float]:
+    """โหลด msrp map ผ่าน cache (ไฟล์ .msrp.cache ข้าง MasterData)"""
+    return cached_msrp_map(path, code_col, msrp_col,
+                           lambda: read_msrp_map(path, code_col, msrp_col), tag="edit",
+                           version=MSRP_LOADER_VERSION)
+
+def read_msrp_map(path: Path,
+                  code_col: str = MASTER_CODE_COL_DEFAULT,
+                  msrp_col: str = MASTER_MSRP_COL_DEFAULT) -> Dict[str, float]:
     encodings = ["utf-8-sig", "cp874", "tis-620", "cp1252", "latin-1"]
     last_err = None
     for enc in encodings:
@@ -109,16 +77,16 @@ def load_msrp_map(path: Path,
     raise RuntimeError(f"เปิด/อ่าน MasterData ล้มเหลว: {last_err}")
 
 # -------------------- เขียนทับค่าด้วย MSRP ใน sap1 --------------------
-def rewrite_rows_with_msrp(header_line: str,
-                           body_lines: List[str],
-                           dialect,
-                           msrp_map: Dict[str, float]) -> List[str]:
+def make_msrp_rewriter(header_line: str,
+                       dialect,
+                       msrp_map: Dict[str, float]) -> Optional[Callable[[str, List[str]], str]]:
     """
     - หา index ของคอลัมน์: ProductCode, GPBefDisc, PriceAfVAT, GTotal, Quantity (รองรับ alias)
-    - ถ้าหา msrp ของสินค้าพบนำไปแทน:
+    - คืนฟังก์ชันแปลงทีละบรรทัด (รับ line ดิบ + row ที่ parse แล้ว) ถ้าหา msrp ของสินค้าพบนำไปแทน:
         GPBefDisc = msrp
         PriceAfVAT = msrp
         GTotal = msrp * Quantity
+    - ถ้าคอลัมน์สำคัญหาไม่ครบ คืน None (ไม่ต้องแปลง)
     """
     reader = csv.reader(StringIO(header_line), dialect=dialect)
     cols = next(reader)
@@ -137,31 +105,29 @@ def rewrite_rows_with_msrp(header_line: str,
     gtot_idx  = find_col("gtotal", "grandtotal", "total")
     qty_idx   = find_col("quantity", "qty", "qty1")
 
-    # ถ้าคอลัมน์สำคัญหาไม่ครบ ให้คืนค่าตามเดิม
     if None in (prod_idx, gpbef_idx, price_idx, gtot_idx, qty_idx):
-        return body_lines
+        return None
+
+    def fmt(x: float) -> str:
+        return f"{x:.2f}"
 
-    out: List[str] = []
-    for line in body_lines:
-        row = list(next(csv.reader(StringIO(line), dialect=dialect)))
+    def rewrite(line: str, row: List[str]) -> str:
+        row = list(row)
         if prod_idx >= len(row):
-            out.append(line); continue
+            return line
 
         code = (row[prod_idx] or "").strip().upper()
         if not code:
-            out.append(line); continue
+            return line
 
         msrp = msrp_map.get(code)
         if msrp is None:
-            out.append(line); continue
+            return line
 
         q = parse_float(row[qty_idx] if qty_idx < len(row) else "")
         if q is None:
             q = 0.0
 
-        def fmt(x: float) -> str:
-            return f"{x:.2f}"
-
         if gpbef_idx < len(row): row[gpbef_idx] = fmt(msrp)
         if price_idx < len(row): row[price_idx] = fmt(msrp)
         if gtot_idx  < len(row): row[gtot_idx]  = fmt(msrp * q)
@@ -169,9 +135,9 @@ def rewrite_rows_with_msrp(header_line: str,
         sio = StringIO()
         w = csv.writer(sio, dialect=dialect)
         w.writerow(row)
-        out.append(sio.getvalue())
+        return sio.getvalue()
 
-    return out
+    return rewrite
 
 # -------------------- งานหลัก --------------------
 def process_folder(folder: Path,
@@ -197,73 +163,25 @@ def process_folder(folder: Path,
     msrp_map = load_msrp_map(master_csv)
     print(f"[info] โหลด msrp ได้ {len(msrp_map)} รายการ")
 
-    # อ่าน sap1
-    src_text = read_text(sap1)
-    src_header, src_body = iter_rows(src_text, header_rows=header_rows)
-
-    sample_for_sniff = "".join(src_header[-1:]) or "".join(src_body[:1])
-    src_dialect = detect_dialect(sample_for_sniff)
-    docnum_idx_src = find_docnum_index(src_header[-1], src_dialect)
-
-    # แยกบรรทัดที่มี/ไม่มี keyword
-    lines_with_keyword: List[str] = []
-    lines_without_keyword: List[str] = []
-    docnums_found = {}
-    count_keyword = 0
-
-    for line in src_body:
-        tgt_line = line.lower() if CASE_INSENSITIVE else line
-        tgt_kw = keyword.lower() if CASE_INSENSITIVE else keyword
-        occ = tgt_line.count(tgt_kw)
-        if occ > 0:
-            lines_with_keyword.append(line)
-            count_keyword += occ
-            dv = get_field(line, docnum_idx_src, src_dialect)
-            dv = (dv or "").strip()
-            if dv:
-                docnums_found[dv] = True
-        else:
-            lines_without_keyword.append(line)
-
-    # แทนค่าด้วย msrp ทั้งสองชุด
-    lines_with_keyword    = rewrite_rows_with_msrp(src_header[-1], lines_with_keyword,    src_dialect, msrp_map)
-    lines_without_keyword = rewrite_rows_with_msrp(src_header[-1], lines_without_keyword, src_dialect, msrp_map)
-
-    # เขียน sap1 ออก
+    # อ่าน sap1 ทีละบรรทัด: แยกบรรทัดที่มี/ไม่มี keyword + แทนค่าด้วย msrp แล้วเขียนออกไปพร้อมกัน
     out_dir = folder / "minus_0"
     out_dir.mkdir(exist_ok=True)
     out_sap1_onlyneg = out_dir / "sap1_only_negative.txt"
     out_sap1_wo      = out_dir / "sap1_without_negative.txt"
-    out_sap1_onlyneg.write_text("".join(src_header) + "".join(lines_with_keyword), encoding="utf-8")
-    out_sap1_wo.write_text("".join(src_header) + "".join(lines_without_keyword), encoding="utf-8")
+    with SapReader(sap1, header_rows=header_rows) as rd:
+        rewrite = make_msrp_rewriter(rd.header[-1], rd.dialect, msrp_map) if rd.header else None
+        res = split_keyword_stream(rd, out_sap1_onlyneg, out_sap1_wo,
+                                   keyword=keyword, case_insensitive=CASE_INSENSITIVE,
+                                   transform=rewrite)
+    docnums_found = res["docnums"]
+    count_keyword = res["count_keyword"]
 
     # อ่าน sap2 และทำไฟล์ focus: sap2_match_negative_docnums.txt
-    lookup_text = read_text(sap2)
-    lookup_header, lookup_body = iter_rows(lookup_text, header_rows=header_rows)
-    sample_for_sniff2 = "".join(lookup_header[-1:]) or "".join(lookup_body[:1])
-    lookup_dialect = detect_dialect(sample_for_sniff2)
-    docnum_idx_lookup = find_docnum_index(lookup_header[-1], lookup_dialect)
-
-    lookup_matches: List[str] = []
-    lookup_without_matches: List[str] = []
-
-    if docnum_idx_lookup is None:
-        print("⚠️ ไม่พบคอลัมน์ DocNum ในไฟล์ sap2 (จะเขียนไฟล์ matches ว่าง)")
-    else:
-        targets = set(docnums_found.keys())
-        for line in lookup_body:
-            dv = get_field(line, docnum_idx_lookup, lookup_dialect)
-            dv = (dv or "").strip()
-            if dv in targets:
-                lookup_matches.append(line)
-            else:
-                lookup_without_matches.append(line)
-
     out_lookup_matches = out_dir / "sap2_match_negative_docnums.txt"      # << โฟกัส
     out_lookup_without = out_dir / "sap2_without_negative_docnums.txt"
 
-    out_lookup_matches.write_text("".join(lookup_header) + "".join(lookup_matches), encoding="utf-8")
-    out_lookup_without.write_text("".join(lookup_header) + "".join(lookup_without_matches), encoding="utf-8")
+    with SapReader(sap2, header_rows=header_rows) as rd:
+        match_docnums_stream(rd, out_lookup_matches, out_lookup_without, docnums_found)
 
     # สรุป
     print("\n========== สรุป ==========")
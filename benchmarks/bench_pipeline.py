@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+วัดความเร็วขั้นตอนหลักของ pipeline minus_0 บนข้อมูลจำลองจาก gen_sap.py
+แต่ละขั้นตอนรันใน process ใหม่ เพื่อให้ peak RSS เป็นของขั้นตอนนั้นจริง ๆ
+
+ตัวอย่าง:
+    python benchmarks/bench_pipeline.py --data bench_data --gen --sap1-rows 200000
+    python benchmarks/bench_pipeline.py --data bench_data --cases split,sap2_match --json result.json
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+HEADER_ROWS = 2
+CASES = ["split", "sap2_match", "apply_match", "apply_main", "fused", "load_msrp", "load_msrp_warm", "double_docnum"]
+RESULT_TAG = "BENCH_RESULT "
+
+# ---------- helpers ----------
+def peak_rss_mb():
+    """peak RSS ของ process ปัจจุบัน (MB) หรือ None ถ้าวัดไม่ได้"""
+    try:
+        import resource
+        v = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return v / (1024 * 1024) if sys.platform == "darwin" else v / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except Exception:
+        return None
+
+def count_body(path: Path) -> int:
+    with open(path, "rb") as f:
+        n = sum(1 for _ in f)
+    return max(0, n - HEADER_ROWS)
+
+def find_master(data: Path) -> Path:
+    for name in ("MasterData.csv", "MasterData.xlsx", "MasterData.xls"):
+        if (data / name).exists():
+            return data / name
+    raise SystemExit(f"ไม่พบ MasterData ใน {data} (รัน gen_sap.py ก่อน)")
+
+def load_docnums(data: Path):
+    """อ่าน DocNum จาก minus_0/sap1_only_negative.txt (ผลของขั้น split)"""
+    from sap_stream import SapReader
+    p = data / "minus_0" / "sap1_only_negative.txt"
+    if not p.exists():
+        raise SystemExit("ต้องรันขั้น split ก่อน")
+    with SapReader(p, header_rows=HEADER_ROWS) as rd:
+        return {dv for _, dv in rd.iter_field(rd.index("docnum")) if dv}
+
+# ---------- cases (รันใน child process) ----------
+def run_case(name: str, data: Path, workers: int = 1) -> dict:
+    import Automation
+    minus = data / "minus_0"
+
+    if name == "split":
+        rows = count_body(data / "sap1_bench.txt")
+        t0 = time.perf_counter()
+        Automation.split_sap1_and_collect_docnums(data, header_rows=HEADER_ROWS, keyword=Automation.DEFAULT_KEYWORD, workers=workers)
+    elif name == "sap2_match":
+        docnums = load_docnums(data)
+        rows = count_body(data / "sap2_bench.txt")
+        t0 = time.perf_counter()
+        Automation.build_sap2_match(data, header_rows=HEADER_ROWS, docnums=docnums, workers=workers)
+    elif name == "apply_match":
+        p_match = minus / "sap2_match_negative_docnums.txt"
+        rows = count_body(p_match)
+        t0 = time.perf_counter()
+        Automation.apply_msrp_to_sap2_match(p_match, find_master(data), header_rows=HEADER_ROWS)
+    elif name == "apply_main":
+        docnums = load_docnums(data)
+        rows = count_body(data / "sap2_bench.txt")
+        t0 = time.perf_counter()
+        Automation.apply_msrp_to_sap2_main(data, find_master(data), HEADER_ROWS, docnums, overwrite=False)
+    elif name == "fused":
+        docnums = load_docnums(data)
+        rows = count_body(data / "sap2_bench.txt")
+        t0 = time.perf_counter()
+        Automation.process_sap2_fused(data, find_master(data), HEADER_ROWS, docnums, overwrite=False, workers=workers)
+    elif name in ("load_msrp", "load_msrp_warm"):
+        import msrp_cache
+        master = find_master(data)
+        if name == "load_msrp":
+            # cold: ลบ cache ก่อนเพื่อวัดการ parse MasterData จริง
+            msrp_cache.cache_path(master).unlink(missing_ok=True)
+        t0 = time.perf_counter()
+        rows = len(Automation.load_msrp_map(master, code_col=Automation.MASTER_CODE_COL, msrp_col=Automation.MASTER_MSRP_COL))
+    elif name == "double_docnum":
+        import Double_Docnum
+        src = minus / "sap1_without_negative.txt"
+        t0 = time.perf_counter()
+        rows = Double_Docnum.find_duplicate_docnums(str(src), str(minus / "Double_DocNum.txt"),
+                                                    header_rows=HEADER_ROWS, verbose=False)["rows"]
+    else:
+        raise SystemExit(f"ไม่รู้จัก case: {name}")
+
+    sec = time.perf_counter() - t0
+    return {"case": name, "rows": rows, "seconds": sec,
+            "rows_per_s": rows / sec if sec > 0 else None, "peak_rss_mb": peak_rss_mb()}
+
+def spawn_case(name: str, data: Path, workers: int = 1) -> dict:
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--data", str(data), "--workers", str(workers), "--child", name]
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_TAG):
+            return json.loads(line[len(RESULT_TAG):])
+    tail = (proc.stderr or proc.stdout).strip().splitlines()[-5:]
+    return {"case": name, "error": " | ".join(tail) or f"exit {proc.returncode}"}
+
+# ---------- main ----------
+def main():
+    p = argparse.ArgumentParser(description="Benchmark pipeline minus_0 (rows/s + peak RSS)")
+    p.add_argument("--data", required=True, help="โฟลเดอร์ข้อมูลจำลอง (จาก gen_sap.py)")
+    p.add_argument("--cases", default=",".join(CASES), help="เลือกขั้นตอน คั่นด้วย , (%s)" % ",".join(CASES))
+    p.add_argument("--gen", action="store_true", help="สร้างข้อมูลจำลองก่อนวัด")
+    p.add_argument("--sap1-rows", type=int, default=100000)
+    p.add_argument("--sap2-rows", type=int, default=None)
+    p.add_argument("--dialect", choices=["tab", "comma", "pipe"], default="tab")
+    p.add_argument("--skus", type=int, default=300000)
+    p.add_argument("--master-format", choices=["csv", "xlsx"], default="csv")
+    p.add_argument("--workers", type=int, default=1, help="จำนวน process สำหรับขั้น split / sap2_match / fused")
+    p.add_argument("--json", dest="json_out", help="บันทึกผลเป็นไฟล์ JSON (ไว้เทียบ regression)")
+    p.add_argument("--child", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    data = Path(args.data).resolve()
+
+    if args.child:
+        res = run_case(args.child, data, args.workers)
+        print(RESULT_TAG + json.dumps(res), flush=True)
+        return
+
+    if args.gen:
+        import gen_sap
+        sap2_rows = args.sap2_rows if args.sap2_rows is not None else args.sap1_rows * 3
+        print(f"[gen] sap1={args.sap1_rows:,} sap2={sap2_rows:,} dialect={args.dialect}", flush=True)
+        gen_sap.gen_sap(data, args.sap1_rows, sap2_rows, dialect=args.dialect, skus=args.skus)
+        gen_sap.gen_master(data, skus=args.skus, fmt=args.master_format)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    results = []
+    print(f"{'case':<14}{'rows':>12}{'sec':>10}{'rows/s':>14}{'peak MB':>10}")
+    for name in cases:
+        r = spawn_case(name, data, args.workers)
+        results.append(r)
+        if "error" in r:
+            print(f"{name:<14} ❌ {r['error']}", flush=True)
+            continue
+        rss = f"{r['peak_rss_mb']:.1f}" if r.get("peak_rss_mb") is not None else "-"
+        print(f"{name:<14}{r['rows']:>12,}{r['seconds']:>10.2f}{r['rows_per_s'] or 0:>14,.0f}{rss:>10}", flush=True)
+
+    if args.json_out:
+        meta = {"data": str(data), "python": sys.version.split()[0], "workers": args.workers, "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"[info] saved -> {args.json_out}")
+
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
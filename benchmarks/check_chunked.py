@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจว่า split_keyword_file / match_docnums_file แบบแบ่ง chunk (workers > 1) ให้ผลตรงกับ workers=1 byte-for-byte
+รันบนข้อมูลจำลองจาก gen_sap.py ทุก dialect และทุกแบบจบบรรทัด (LF, CRLF, CR อย่างเดียว)
+ลด MIN_CHUNK_BYTES / SCAN_BLOCK ให้ไฟล์เล็กถูกแบ่งหลาย chunk และมีจุดตัดคร่อม block
+
+ตัวอย่าง:
+    python benchmarks/check_chunked.py --work /tmp/chunk_check --rows 20000
+"""
+import sys
+import shutil
+import filecmp
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+HEADER_ROWS = 2
+EOLS = {"lf": b"\n", "crlf": b"\r\n", "cr": b"\r"}
+
+def with_eol(src: Path, dst: Path, eol: bytes):
+    """คัดลอกไฟล์ที่ gen_sap เขียน (จบบรรทัด "\\n") โดยเปลี่ยนจบบรรทัดเป็น eol"""
+    dst.write_bytes(src.read_bytes().replace(b"\n", eol))
+
+def run(path: Path, out: Path, workers: int, keyword: str) -> dict:
+    import sap_stream
+    out.mkdir(parents=True, exist_ok=True)
+    info = sap_stream.split_keyword_file(path, HEADER_ROWS, out / "with.txt", out / "without.txt",
+                                         keyword, workers=workers)
+    sap_stream.match_docnums_file(path, HEADER_ROWS, out / "match.txt", out / "other.txt",
+                                  info["docnums"], workers=workers)
+    return info
+
+def compare(a: Path, b: Path) -> int:
+    bad = 0
+    for fa in sorted(a.glob("*.txt")):
+        fb = b / fa.name
+        same = fb.exists() and filecmp.cmp(fa, fb, shallow=False)
+        print(f"  {'OK ' if same else 'DIFF'} {fa.name} ({fa.stat().st_size} bytes)")
+        bad += not same
+    return bad
+
+def main():
+    p = argparse.ArgumentParser(description="เทียบผล chunked (workers > 1) vs workers=1")
+    p.add_argument("--work", required=True, help="โฟลเดอร์ชั่วคราว (จะถูกล้าง)")
+    p.add_argument("--rows", type=int, default=20000)
+    p.add_argument("--workers", type=int, default=4)
+    args = p.parse_args()
+
+    import gen_sap
+    import sap_stream
+    sap_stream.MIN_CHUNK_BYTES = 64 * 1024
+    sap_stream.SCAN_BLOCK = 100003   # ไม่ลงตัวกับบรรทัด -> มี "\r" / "\r\n" คร่อมขอบ block
+    work = Path(args.work)
+    shutil.rmtree(work, ignore_errors=True)
+    bad = 0
+    for dialect in sorted(gen_sap.DIALECTS):
+        src = work / dialect / "src"
+        gen_sap.gen_sap(src, args.rows, args.rows * 3, dialect=dialect, skus=5000, negative_ratio=0.2)
+        for eol_name, eol in EOLS.items():
+            base = work / dialect / eol_name
+            base.mkdir(parents=True)
+            for name in ("sap1_bench.txt", "sap2_bench.txt"):
+                with_eol(src / name, base / name, eol)
+            print(f"[{dialect}/{eol_name}]")
+            for name in ("sap1_bench.txt", "sap2_bench.txt"):
+                single = run(base / name, base / "single" / name, 1, gen_sap.KEYWORD)
+                chunked = run(base / name, base / "chunked" / name, args.workers, gen_sap.KEYWORD)
+                if single != chunked:
+                    print(f"  DIFF {name} สรุปไม่ตรง: {single['rows_with']}/{single['rows_without']} "
+                          f"vs {chunked['rows_with']}/{chunked['rows_without']}")
+                    bad += 1
+                bad += compare(base / "single" / name, base / "chunked" / name)
+
+    print("ผลตรงกันทั้งหมด" if not bad else f"❌ ไม่ตรงกัน {bad} ไฟล์")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจว่า DocNum จาก fast path (sap_stream.iter_field) ตรงกับ csv.reader (iter_records + cell) ทุก record
+- ไฟล์จาก gen_sap.py ทุก dialect
+- ไฟล์ edge case ทุก dialect x (LF, CRLF): DocNum ใน quote, มี delimiter/quote/newline ใน field,
+  quote กลาง field ที่ไม่ได้ quote, แถวสั้น/บรรทัดว่าง, ช่องว่างรอบค่า
+ไม่ตรงแม้แต่ record เดียว -> exit 1
+
+ตัวอย่าง:
+    python benchmarks/check_docnum_fastpath.py --work /tmp/docnum_check --rows 20000
+"""
+import sys
+import csv
+import random
+import shutil
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+HEADER_ROWS = 2
+EDGE_COLS = ["CardCode", "Comments", "DocNum", "DocTotal"]
+EOLS = {"lf": "\n", "crlf": "\r\n"}
+
+def gen_edge(path: Path, delim: str, eol: str, rows: int, seed: int = 3):
+    """ไฟล์ที่ DocNum อยู่กลางแถว และทุก field มีโอกาสเจอ delimiter / quote / newline / แถวสั้น"""
+    rnd = random.Random(seed)
+    tricky = ["", " ", delim, '"', '""', "a" + delim + "b", 'x"y', "บรรทัด\nใหม่", "cr\r\nlf", "  ", "ส่วนลดติดลบ"]
+
+    def doc(i):
+        v = str(100000000 + i)
+        return rnd.choice([v, " " + v + " ", v + delim + "9", '"' + v, v + '"', "", v + "\n1"])
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter=delim, lineterminator=eol)
+        w.writerow(["รหัสลูกค้า", "หมายเหตุ", "เลขที่เอกสาร", "ยอดรวม"])
+        w.writerow(EDGE_COLS)
+        for i in range(rows):
+            kind = rnd.random()
+            if kind < 0.03:
+                f.write(eol)                                   # บรรทัดว่าง
+            elif kind < 0.08:
+                w.writerow(["C%05d" % i, rnd.choice(tricky)][:rnd.randint(1, 2)])   # แถวสั้นไม่ถึง DocNum
+            elif kind < 0.12:
+                # quote กลาง field ที่ไม่ได้ quote (csv อ่านเป็นอักขระธรรมดา)
+                f.write(delim.join(["C%05d" % i, 'ab"c', str(100000000 + i), "1.00"]) + eol)
+            elif kind < 0.16:
+                w.writerow(["C%05d" % i, rnd.choice(tricky), doc(i), "1.00", rnd.choice(tricky), "extra"])
+            else:
+                w.writerow(["C%05d" % i, rnd.choice(tricky), doc(i) if kind < 0.5 else str(100000000 + i),
+                            "%.2f" % rnd.uniform(0, 9999)])
+
+def check_file(path: Path) -> int:
+    """จำนวน record ที่ fast path ให้ผลต่างจาก csv.reader"""
+    from sap_stream import SapReader, cell
+    with SapReader(path, header_rows=HEADER_ROWS) as rd:
+        idx = rd.index("docnum")
+        fast = list(rd.iter_field(idx))
+    with SapReader(path, header_rows=HEADER_ROWS) as rd:
+        ref = [(raw, cell(row, idx)) for raw, row in rd.records()]
+    bad = sum(a != b for a, b in zip(fast, ref)) + abs(len(fast) - len(ref))
+    print(f"  {'OK ' if not bad else 'DIFF'} {path.parent.name}/{path.name}: {len(ref)} records"
+          + (f", ไม่ตรง {bad}" if bad else ""))
+    for a, b in [(a, b) for a, b in zip(fast, ref) if a != b][:3]:
+        print(f"       fast={a!r}\n       csv ={b!r}")
+    return bad
+
+def main():
+    p = argparse.ArgumentParser(description="เทียบ DocNum fast path vs csv.reader")
+    p.add_argument("--work", required=True, help="โฟลเดอร์ชั่วคราว (จะถูกล้าง)")
+    p.add_argument("--rows", type=int, default=20000)
+    args = p.parse_args()
+
+    import gen_sap
+    work = Path(args.work)
+    shutil.rmtree(work, ignore_errors=True)
+    bad = 0
+    for dialect, delim in sorted(gen_sap.DIALECTS.items()):
+        print(f"[{dialect}]")
+        out = work / dialect
+        gen_sap.gen_sap(out, args.rows, args.rows * 3, dialect=dialect, skus=5000)
+        for eol_name, eol in EOLS.items():
+            gen_edge(out / f"edge_{eol_name}.txt", delim, eol, args.rows)
+        for path in sorted(out.glob("*.txt")):
+            bad += check_file(path)
+
+    print("ผลตรงกันทั้งหมด" if not bad else f"❌ ไม่ตรงกัน {bad} records")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจ export_client.export_split กับ API จำลอง (ไม่ต่อเน็ต)
+- split_range: span 1, span ที่หารจำนวนวันลงตัว, span ที่มีเศษ, span ยาวกว่าช่วง -> ช่วงย่อยต่อกันครบไม่ซ้อน
+- ไฟล์ที่ export แบบแบ่งช่วงแล้วรวม ต้องตรงกับ export ช่วงเดียว byte-for-byte
+  (key ที่จบด้วย LF / CRLF / ไม่มี newline ท้ายไฟล์, มีวันที่ไม่มีข้อมูล, ไฟล์ย่อยใหญ่กว่า 1 MiB)
+ไม่ตรง -> exit 1
+
+ตัวอย่าง:
+    python benchmarks/check_export_split.py --work /tmp/split_check --rows-per-day 4000
+"""
+import sys
+import random
+import shutil
+import filecmp
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+HEADER_ROWS = 2
+FROM_DATE, TO_DATE = "2025-08-01", "2025-08-10"   # 10 วัน
+SPANS = (1, 5, 3, 30, 0)                            # 0 -> ถือเป็น 1
+KEYS = {"sap1": (b"\n", True), "sap2": (b"\r\n", True), "dl0": (b"\n", False)}   # key -> (eol, newline ท้ายไฟล์)
+EMPTY_DAYS = {"2025-08-03", "2025-08-10"}
+
+class FakeApi:
+    """post_export / fetch แบบ in-process: เนื้อไฟล์ขึ้นกับ key + ช่วงวันที่เท่านั้น"""
+    def __init__(self, rows_per_day: int):
+        self.rows = rows_per_day
+
+    def post_export(self, f: str, t: str):
+        return {"status": "success", "files": {k: f"fake://{k}/{f}/{t}" for k in KEYS}}
+
+    def day_records(self, key: str, day: str):
+        if day in EMPTY_DAYS:
+            return []
+        rnd = random.Random(f"{key}/{day}")
+        return [("%s\t%09d\tSKU%06d\t%s\t%.2f" % (day, i, rnd.randrange(10 ** 6), "ข" * rnd.randint(5, 30),
+                                                   rnd.uniform(1, 9999))).encode("utf-8")
+                for i in range(self.rows)]
+
+    def fetch(self, url: str, dest: str):
+        from export_client import split_days
+        key, f, t = url[len("fake://"):].split("/")
+        eol, trailing = KEYS[key]
+        recs = [r for d in split_days(f, t) for r in self.day_records(key, d)]
+        body = eol.join(recs) + (eol if trailing and recs else b"")
+        data = b"h1\th2\th3\th4\th5" + eol + b"Day\tDocNum\tItemCode\tName\tPrice" + eol + body
+        Path(dest).write_bytes(data)
+        return len(data)
+
+def check_ranges() -> int:
+    from export_client import split_days, split_range
+    days = split_days(FROM_DATE, TO_DATE)
+    bad = 0
+    for span in SPANS:
+        rs = split_range(FROM_DATE, TO_DATE, span)
+        covered = [d for f, t in rs for d in split_days(f, t)]
+        n = max(1, span)
+        ok = covered == days and all(len(split_days(f, t)) <= n for f, t in rs) \
+            and len(rs) == -(-len(days) // n)
+        print(f"  {'OK ' if ok else 'DIFF'} split_range span={span}: {len(rs)} ช่วง {rs[0]} .. {rs[-1]}")
+        bad += not ok
+    return bad
+
+def main():
+    p = argparse.ArgumentParser(description="เทียบ export_split กับ export ช่วงเดียว")
+    p.add_argument("--work", required=True, help="โฟลเดอร์ชั่วคราว (จะถูกล้าง)")
+    p.add_argument("--rows-per-day", type=int, default=4000)
+    args = p.parse_args()
+
+    import export_client
+    work = Path(args.work)
+    shutil.rmtree(work, ignore_errors=True)
+    api = FakeApi(args.rows_per_day)
+    bad = check_ranges()
+
+    single = work / "single"
+    export_client.export_files(FROM_DATE, TO_DATE, single, api.post_export, api.fetch, verbose=False)
+    for span in SPANS:
+        out = work / f"split_{span}"
+        export_client.export_split(FROM_DATE, TO_DATE, out, lambda k: f"{k}.txt", api.post_export, api.fetch,
+                                   HEADER_ROWS, span_days=span, concurrency=3)
+        print(f"[span={span}]")
+        for key in KEYS:
+            a, b = single / f"{key}.txt", out / f"{key}.txt"
+            same = b.exists() and filecmp.cmp(a, b, shallow=False)
+            print(f"  {'OK ' if same else 'DIFF'} {key}.txt ({a.stat().st_size:,} bytes)")
+            bad += not same
+        if (work / ".ranges").exists() and any((work / ".ranges").iterdir()):
+            print("  DIFF ไฟล์ย่อยใน .ranges ไม่ถูกลบ")
+            bad += 1
+
+    print("ผลตรงกันทั้งหมด" if not bad else f"❌ ไม่ตรงกัน {bad} กรณี")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจว่า export_client.merge_key_files รวมไฟล์ได้เท่ากับการต่อ record ตรง ๆ byte-for-byte
+- ไฟล์ย่อยใหญ่กว่า block ที่อ่าน (1 MiB) จุดตัด block ตกกลางบรรทัด
+- ทุกไฟล์มี / ไม่มี newline ท้ายไฟล์, LF / CRLF, มีไฟล์ว่างและไฟล์ที่มีแต่หัวตารางปน
+- รันทั้ง MERGE_BLOCK ปกติและ block เล็ก (จุดตัดเยอะ)
+ไม่ตรง -> exit 1
+
+ตัวอย่าง:
+    python benchmarks/check_merge.py --work /tmp/merge_check --rows 15000
+"""
+import sys
+import random
+import shutil
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+HEADER_ROWS = 2
+EOLS = {"lf": b"\n", "crlf": b"\r\n"}
+BLOCKS = (None, 4093)   # None = MERGE_BLOCK ของโมดูล
+
+def records(rnd: random.Random, n: int, start: int):
+    """record ยาวไม่เท่ากัน (ราว 60-130 byte) ให้จุดตัด block ตกกลางบรรทัดต่างที่กัน"""
+    return [("%09d\tSKU%06d\t%s\t%.2f" % (start + i, rnd.randrange(10 ** 6), "ก" * rnd.randint(10, 35),
+                                            rnd.uniform(1, 9999))).encode("utf-8") for i in range(n)]
+
+def build_case(base: Path, rnd: random.Random, eol: bytes, trailing: bool, rows: int):
+    """เขียนไฟล์ย่อย คืน (paths, ผลที่ต้องได้)"""
+    header = b"h1\th2\th3\th4" + eol + b"DocNum\tItemCode\tName\tPrice" + eol
+    paths, all_recs, n = [], [], 0
+    sizes = [0, rows, rows // 3, -1, rows, 7]   # 0 = ไฟล์ว่าง, -1 = มีแต่หัวตาราง
+    for i, size in enumerate(sizes):
+        p = base / f"part{i}.txt"
+        if size == 0:
+            p.write_bytes(b"")
+        elif size < 0:
+            p.write_bytes(header)
+        else:
+            recs = records(rnd, size, n)
+            n += size
+            all_recs += recs
+            p.write_bytes(header + eol.join(recs) + (eol if trailing else b""))
+        paths.append(p)
+    expected = header + eol.join(all_recs) + (eol if trailing else b"")
+    return paths, expected, len(all_recs)
+
+def main():
+    p = argparse.ArgumentParser(description="เทียบ merge_key_files กับการต่อ record ตรง ๆ")
+    p.add_argument("--work", required=True, help="โฟลเดอร์ชั่วคราว (จะถูกล้าง)")
+    p.add_argument("--rows", type=int, default=15000)
+    args = p.parse_args()
+
+    import export_client
+    default_block = export_client.MERGE_BLOCK
+    work = Path(args.work)
+    shutil.rmtree(work, ignore_errors=True)
+    bad = 0
+    for eol_name, eol in EOLS.items():
+        for trailing in (True, False):
+            name = f"{eol_name}_{'trailing' if trailing else 'no_trailing'}"
+            base = work / name
+            base.mkdir(parents=True)
+            parts, expected, n = build_case(base, random.Random(name), eol, trailing, args.rows)
+            big = max(q.stat().st_size for q in parts)
+            for block in BLOCKS:
+                export_client.MERGE_BLOCK = block or default_block
+                out = base / f"merged_{export_client.MERGE_BLOCK}.txt"
+                export_client.merge_key_files(parts, out, HEADER_ROWS)
+                got = out.read_bytes()
+                lines = got.count(eol) + (0 if trailing else 1)
+                same = got == expected and lines == HEADER_ROWS + n
+                print(f"  {'OK ' if same else 'DIFF'} {name} block={export_client.MERGE_BLOCK} "
+                      f"part สูงสุด {big:,} bytes: {lines} บรรทัด (ต้องได้ {HEADER_ROWS + n})")
+                bad += not same
+    export_client.MERGE_BLOCK = default_block
+
+    print("ผลตรงกันทั้งหมด" if not bad else f"❌ ไม่ตรงกัน {bad} กรณี")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
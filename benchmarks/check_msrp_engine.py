@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจว่า MSRP engine แบบ columnar (numpy) ให้ไฟล์ผลลัพธ์ตรงกับ engine ทีละแถว byte-for-byte
+รันบนข้อมูลจำลองจาก gen_sap.py ทุก dialect แล้วเทียบ sap2_match / sap2_main / fused
+
+ตัวอย่าง:
+    python benchmarks/check_msrp_engine.py --work /tmp/msrp_check --sap1-rows 20000
+"""
+import sys
+import shutil
+import filecmp
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+HEADER_ROWS = 2
+ENGINES = ("row", "columnar")
+
+def run_engine(src: Path, dst: Path, engine: str, master: Path, msrp_map: dict):
+    import Automation
+    shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(src, dst)
+    info = Automation.split_sap1_and_collect_docnums(dst, header_rows=HEADER_ROWS, keyword=Automation.DEFAULT_KEYWORD)
+    p_match = Automation.build_sap2_match(dst, header_rows=HEADER_ROWS, docnums=info["docnums"])
+    Automation.apply_msrp_to_sap2_match(Path(p_match), master, HEADER_ROWS, msrp_map=msrp_map, engine=engine)
+    Automation.apply_msrp_to_sap2_main(dst, master, HEADER_ROWS, info["docnums"], overwrite=False,
+                                       msrp_map=msrp_map, engine=engine)
+    fused = dst / "fused"
+    fused.mkdir()
+    shutil.copy(next(dst.glob("sap2*.txt")), fused)
+    Automation.process_sap2_fused(fused, master, HEADER_ROWS, info["docnums"], overwrite=True,
+                                  msrp_map=msrp_map, engine=engine)
+
+def compare(a: Path, b: Path) -> int:
+    bad = 0
+    for fa in sorted(p for p in a.rglob("*.txt") if p.is_file()):
+        fb = b / fa.relative_to(a)
+        same = fb.exists() and filecmp.cmp(fa, fb, shallow=False)
+        print(f"  {'OK ' if same else 'DIFF'} {fa.relative_to(a)}")
+        bad += not same
+    return bad
+
+def main():
+    p = argparse.ArgumentParser(description="เทียบผล MSRP engine row vs columnar")
+    p.add_argument("--work", required=True, help="โฟลเดอร์ชั่วคราว (จะถูกล้าง)")
+    p.add_argument("--sap1-rows", type=int, default=20000)
+    p.add_argument("--skus", type=int, default=5000)
+    args = p.parse_args()
+
+    import gen_sap
+    import Automation
+    work = Path(args.work)
+    bad = 0
+    for dialect in sorted(gen_sap.DIALECTS):
+        src = work / dialect / "src"
+        shutil.rmtree(work / dialect, ignore_errors=True)
+        gen_sap.gen_sap(src, args.sap1_rows, args.sap1_rows * 3, dialect=dialect, skus=args.skus)
+        master = gen_sap.gen_master(work / dialect, skus=args.skus)
+        msrp_map = Automation.read_msrp_map(master, code_col="code", msrp_col="msrp")
+        for eng in ENGINES:
+            run_engine(src, work / dialect / eng, eng, master, msrp_map)
+        print(f"[{dialect}]")
+        bad += compare(work / dialect / ENGINES[0], work / dialect / ENGINES[1])
+
+    print("ผลตรงกันทั้งหมด" if not bad else f"❌ ไม่ตรงกัน {bad} ไฟล์")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
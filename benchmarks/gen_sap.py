@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+สร้างไฟล์ sap1 / sap2 / MasterData จำลองสำหรับวัดความเร็ว pipeline
+
+ตัวอย่าง:
+    python benchmarks/gen_sap.py --out bench_data --sap1-rows 200000 --dialect tab
+    python benchmarks/gen_sap.py --out bench_data --sap1-rows 3000000 --sap2-rows 10000000 --master-format xlsx
+"""
+import os
+import csv
+import random
+import argparse
+from pathlib import Path
+
+KEYWORD = "ส่วนลดติดลบ"
+DIALECTS = {"tab": "\t", "comma": ",", "pipe": "|"}
+
+SAP1_LABELS = ["เลขที่เอกสาร", "วันที่เอกสาร", "รหัสลูกค้า", "ชื่อลูกค้า", "หมายเหตุ", "ยอดรวม"]
+SAP1_COLS   = ["DocNum", "DocDate", "CardCode", "CardName", "Comments", "DocTotal"]
+SAP2_LABELS = ["เลขที่เอกสาร", "รหัสสินค้า", "ชื่อสินค้า", "จำนวน", "ราคาก่อนส่วนลด", "ราคารวม VAT", "ยอดรวม"]
+SAP2_COLS   = ["DocNum", "ItemCode", "Dscription", "Quantity", "GPBefDisc", "PriceAfVAT", "GTotal"]
+
+PRODUCT_NAMES = ["ครีมกันแดด", "เซรั่มบำรุงผิว", "โฟมล้างหน้า", "โลชั่นน้ำนม", "มาส์กหน้า, สูตรเข้มข้น", "ลิปบาล์ม"]
+CUSTOMERS = ["ร้านสมใจ", "บริษัท เอ บี ซี จำกัด", "Shopee Mall", "Lazada | Official", "ลูกค้าทั่วไป"]
+REMARKS = ["", "", "", "ส่งด่วน", "โปรโมชั่นเดือนนี้", "ลูกค้ารับเอง"]
+
+# ---------- helpers ----------
+def sku(i: int) -> str:
+    return f"SKU{i:06d}"
+
+def money(v: float) -> str:
+    return f"{v:.2f}"
+
+def open_writer(path: Path, delimiter: str):
+    f = open(path, "w", encoding="utf-8", newline="", buffering=1024 * 1024)
+    return f, csv.writer(f, delimiter=delimiter, lineterminator="\n")
+
+# ---------- generators ----------
+def gen_sap(out_dir: Path, sap1_rows: int, sap2_rows: int, dialect: str = "tab", skus: int = 300000,
+            negative_ratio: float = 0.01, duplicate_ratio: float = 0.005, free_ratio: float = 0.05, seed: int = 1):
+    """
+    เขียน sap1_bench.txt / sap2_bench.txt (หัวตาราง 2 แถว) ลงใน out_dir
+    - sap1: 1 แถวต่อ DocNum, มี "ส่วนลดติดลบ" ตาม negative_ratio และ DocNum ซ้ำตาม duplicate_ratio
+    - sap2: แถวสินค้ากระจายไปตาม DocNum ของ sap1, มี "(แถม)" ตาม free_ratio
+    """
+    rnd = random.Random(seed)
+    delim = DIALECTS[dialect]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    base_doc = 100000000
+
+    f, w = open_writer(out_dir / "sap1_bench.txt", delim)
+    with f:
+        w.writerow(SAP1_LABELS)
+        w.writerow(SAP1_COLS)
+        for i in range(sap1_rows):
+            doc = base_doc + i
+            if i and rnd.random() < duplicate_ratio:
+                doc -= 1
+            remark = rnd.choice(REMARKS)
+            if rnd.random() < negative_ratio:
+                remark = (remark + " " + KEYWORD).strip()
+            w.writerow([doc, "2025-08-%02d" % (i % 28 + 1), "C%05d" % rnd.randrange(50000),
+                        rnd.choice(CUSTOMERS), remark, money(rnd.uniform(100, 50000))])
+
+    f, w = open_writer(out_dir / "sap2_bench.txt", delim)
+    with f:
+        w.writerow(SAP2_LABELS)
+        w.writerow(SAP2_COLS)
+        for i in range(sap2_rows):
+            doc = base_doc + (i * sap1_rows // max(sap2_rows, 1))
+            name = rnd.choice(PRODUCT_NAMES)
+            if rnd.random() < free_ratio:
+                name += " (แถม)"
+            qty = rnd.randint(1, 12)
+            price = rnd.uniform(50, 3000)
+            w.writerow([doc, sku(rnd.randrange(skus)), name, qty, money(price), money(price), money(price * qty)])
+
+def gen_master(out_dir: Path, skus: int = 300000, fmt: str = "csv", seed: int = 2) -> Path:
+    """เขียน MasterData (code, msrp) เป็น .csv หรือ .xlsx (ต้องมี openpyxl)"""
+    rnd = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    def rows():
+        for i in range(skus):
+            v = rnd.uniform(50, 5000)
+            # รูปแบบราคาปนกันแบบไฟล์จริง: 1,234.50 / ฿990 / (12.00)
+            r = rnd.random()
+            if r < 0.6:
+                msrp = f"{v:,.2f}"
+            elif r < 0.9:
+                msrp = f"฿{v:.0f}"
+            elif r < 0.97:
+                msrp = f"({v:.2f})"
+            else:
+                msrp = ""
+            yield [sku(i), f"สินค้า {i}", msrp]
+
+    if fmt == "csv":
+        path = out_dir / "MasterData.csv"
+        f, w = open_writer(path, ",")
+        with f:
+            w.writerow(["code", "name", "msrp"])
+            w.writerows(rows())
+        return path
+
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("ต้องติดตั้ง openpyxl เพื่อสร้าง MasterData.xlsx")
+    path = out_dir / "MasterData.xlsx"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["code", "name", "msrp"])
+    for r in rows():
+        ws.append(r)
+    wb.save(path)
+    return path
+
+# ---------- main ----------
+def main():
+    p = argparse.ArgumentParser(description="สร้างไฟล์ sap1/sap2/MasterData จำลองสำหรับ benchmark")
+    p.add_argument("--out", required=True, help="โฟลเดอร์ปลายทาง")
+    p.add_argument("--sap1-rows", type=int, default=100000)
+    p.add_argument("--sap2-rows", type=int, default=None, help="ดีฟอลต์ = 3 เท่าของ sap1 (สูงสุดที่ทดสอบ 10M)")
+    p.add_argument("--dialect", choices=sorted(DIALECTS), default="tab")
+    p.add_argument("--skus", type=int, default=300000, help="จำนวนสินค้าใน MasterData")
+    p.add_argument("--master-format", choices=["csv", "xlsx"], default="csv")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+
+    out = Path(args.out)
+    sap2_rows = args.sap2_rows if args.sap2_rows is not None else args.sap1_rows * 3
+    print(f"[gen] sap1={args.sap1_rows:,} sap2={sap2_rows:,} dialect={args.dialect} -> {out}")
+    gen_sap(out, args.sap1_rows, sap2_rows, dialect=args.dialect, skus=args.skus, seed=args.seed)
+    master = gen_master(out, skus=args.skus, fmt=args.master_format, seed=args.seed + 1)
+    for fn in sorted(os.listdir(out)):
+        fp = out / fn
+        if fp.is_file():
+            print(f" - {fn}: {fp.stat().st_size / 1e6:,.1f} MB")
+    print(f"[gen] master: {master}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+"""
+ตัวช่วยดึงไฟล์ export (sap1, sap2, sap3, dl0, ...) จาก API
+- ดาวน์โหลดหลายไฟล์พร้อมกันด้วย thread pool (จำกัดจำนวนได้) + retry รายไฟล์
+- ดาวน์โหลดลง .part ต่อจากเดิมได้ด้วย Range, ตรวจขนาด/ETag/hash ก่อน rename เป็นชื่อจริง
+- cache ไฟล์ export รายวัน: สั่ง export เฉพาะวันที่ยังไม่มี/หมดอายุ แล้วรวมเป็นไฟล์ของช่วงวันที่
+- ช่วงวันที่ยาว: แบ่งเป็นช่วงย่อย สั่ง export พร้อมกัน (จำกัดจำนวน) แล้วรวมไฟล์ต่อ key
+- สรุปขนาดไฟล์ / เวลา / ความเร็วของแต่ละไฟล์
+- fetch_range: ทางเดียวที่สคริปต์ใช้ดึงไฟล์ของช่วงวันที่ (cache รายวัน / แบ่งช่วง / export ครั้งเดียว)
+"""
+import os
+import json
+import time
+import shutil
+import base64
+import hashlib
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import HttpClient
+
+DOWNLOAD_WORKERS = 4   # ค่าเริ่มต้น (สคริปต์หลักอ่านจาก .env: DOWNLOAD_WORKERS)
+DOWNLOAD_RETRIES = 3   # ค่าเริ่มต้น (.env: DOWNLOAD_RETRIES)
+EXPORT_CONCURRENCY = 3 # ค่าเริ่มต้นจำนวน export ที่สั่งพร้อมกัน (.env: EXPORT_CONCURRENCY)
+CHUNK_SIZE = 1024 * 256
+MERGE_BLOCK = 1024 * 1024
+PART_SUFFIX = ".part"
+MANIFEST_SUFFIX = ".dl.json"
+DAY_MANIFEST = ".day.json"
+
+class DownloadError(OSError):
+    """ไฟล์ที่ได้ไม่ตรงกับที่ server บอก (ขนาด / ETag / hash) — retry ใหม่ได้"""
+
+# ---------- config ----------
+def export_settings() -> Dict:
+    """ค่าจาก .env ของการดึงไฟล์ export (อ่านตอนเรียก เพราะสคริปต์ load_dotenv หลัง import)"""
+    return {
+        "download_workers": int(os.getenv("DOWNLOAD_WORKERS", str(DOWNLOAD_WORKERS))),  # จำนวนไฟล์ที่ดาวน์โหลดพร้อมกัน
+        "download_retries": int(os.getenv("DOWNLOAD_RETRIES", str(DOWNLOAD_RETRIES))),
+        "cache": os.getenv("EXPORT_CACHE", "false").lower() == "true",         # cache ไฟล์ export รายวัน
+        "cache_dir": os.getenv("EXPORT_CACHE_DIR") or "",                       # ว่าง = <out-dir>/.export_cache
+        "cache_ttl_hours": float(os.getenv("EXPORT_CACHE_TTL_HOURS", "24")),    # 0 = ไม่หมดอายุ (วันนี้ดึงใหม่เสมอ)
+        "split_days": int(os.getenv("EXPORT_SPLIT_DAYS", "0")),                 # >0 = ช่วงยาวกว่านี้แบ่ง export ทีละช่วงย่อย
+        "concurrency": int(os.getenv("EXPORT_CONCURRENCY", str(EXPORT_CONCURRENCY))),  # จำนวน export ที่สั่งพร้อมกัน
+    }
+
+def add_export_args(parser, settings: Dict):
+    """เพิ่ม --download-workers / --split-days / --export-concurrency / --export-cache (ดีฟอลต์จาก settings)"""
+    parser.add_argument("--download-workers", type=int, default=settings["download_workers"],
+                        help="จำนวนไฟล์ที่ดาวน์โหลดพร้อมกัน (ดีฟอลต์ DOWNLOAD_WORKERS ใน .env)")
+    parser.add_argument("--split-days", type=int, default=settings["split_days"],
+                        help="แบ่งช่วงวันที่ที่ยาวกว่า N วันเป็นช่วงละ N วัน แล้ว export พร้อมกัน (0 = ไม่แบ่ง)")
+    parser.add_argument("--export-concurrency", type=int, default=settings["concurrency"],
+                        help="จำนวน export ที่สั่งพร้อมกัน (ใช้กับ --split-days / --export-cache)")
+    parser.add_argument("--export-cache", action="store_true", default=settings["cache"],
+                        help="ใช้ cache ไฟล์ export รายวัน: export เฉพาะวันที่ยังไม่มี/หมดอายุ/วันนี้ แล้วรวมเป็นไฟล์ของช่วง")
+
+# ---------- resumable download ----------
+def part_path(dest) -> Path:
+    dest = Path(dest)
+    return dest.with_name(dest.name + PART_SUFFIX)
+
+def manifest_path(dest) -> Path:
+    """sidecar ของ dest (ซ่อนไว้ ไม่ให้ชน pattern sap1*.txt / *.txt)"""
+    dest = Path(dest)
+    return dest.with_name("." + dest.name + MANIFEST_SUFFIX)
+
+def read_manifest(dest) -> Dict:
+    try:
+        with open(manifest_path(dest), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(dest, data: Dict):
+    p = manifest_path(dest)
+    tmp = p.with_name(p.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, p)
+
+def verified_copy(dest, manifest: Optional[Dict] = None) -> Optional[Dict]:
+    """คืน manifest ถ้า dest เป็นไฟล์ที่ตรวจครบแล้วและยังไม่ถูกแก้ (size/mtime ตรง) ไม่งั้น None"""
+    m = read_manifest(dest) if manifest is None else manifest
+    if m.get("state") != "complete":
+        return None
+    try:
+        st = os.stat(dest)
+    except OSError:
+        return None
+    if st.st_size != m.get("size") or st.st_mtime_ns != m.get("mtime_ns"):
+        return None
+    return m
+
+def forget_unvalidated(dest):
+    """ลืม manifest ของ dest ที่ไม่มี ETag/Last-Modified ให้ fetch_resumable รอบหน้าโหลดใหม่แทนใช้ไฟล์เดิม"""
+    m = read_manifest(dest)
+    if m and not (m.get("etag") or m.get("last_modified")):
+        _drop(manifest_path(dest))
+
+def _b64_hex(v: str) -> Optional[str]:
+    try:
+        return base64.b64decode(v.strip().strip(":")).hex()
+    except ValueError:
+        return None
+
+def response_digests(resp, partial: bool = False) -> Dict[str, str]:
+    """
+    hash ของทั้งไฟล์ที่ server แนบมา {"sha256": hex, "md5": hex}
+    รองรับ Repr-Digest / Digest / X-Checksum-* และ (เฉพาะตอบทั้งไฟล์) Content-Digest / Content-MD5
+    """
+    h = resp.headers
+    out = {}
+    names = ["Repr-Digest", "Digest"] + ([] if partial else ["Content-Digest"])
+    for name in names:
+        for part in (h.get(name) or "").split(","):
+            algo, _, val = part.strip().partition("=")
+            algo = algo.strip().lower().replace("-", "")
+            if algo in ("sha256", "md5") and val and algo not in out:
+                hx = _b64_hex(val)
+                if hx:
+                    out[algo] = hx
+    for algo, name in (("sha256", "X-Checksum-Sha256"), ("md5", "X-Checksum-Md5")):
+        if h.get(name) and algo not in out:
+            out[algo] = h[name].strip().lower()
+    if not partial and h.get("Content-MD5") and "md5" not in out:
+        hx = _b64_hex(h["Content-MD5"])
+        if hx:
+            out["md5"] = hx
+    return out
+
+def _content_range(resp) -> Tuple[Optional[int], Optional[int]]:
+    """Content-Range: bytes a-b/total -> (a, total)  (bytes */total -> (None, total))"""
+    v = (resp.headers.get("Content-Range") or "").strip()
+    try:
+        unit, _, rng = v.partition(" ")
+        span, _, total = rng.partition("/")
+        start = None if span == "*" else int(span.split("-")[0])
+        return start, (int(total) if total and total != "*" else None)
+    except ValueError:
+        return None, None
+
+def _hash_file(path: Path, algos) -> Dict:
+    hs = {a: hashlib.new(a) for a in algos}
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            for h in hs.values():
+                h.update(chunk)
+    return hs
+
+def _drop(*paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def fetch_resumable(client: HttpClient, url: str, dest, headers: Optional[Dict] = None,
+                    timeout: int = 60, verify: bool = True, expected_sha256: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    ดาวน์โหลด url -> dest แบบต่อได้ คืนจำนวน byte ที่โหลดรอบนี้ (0 = ใช้ไฟล์เดิม)
+    - เขียนลง <dest>.part + manifest (.<dest>.dl.json) แล้ว rename เป็น dest เมื่อตรวจครบ
+    - มี .part ค้างของ url เดิม -> ขอต่อด้วย Range (+ If-Range ถ้ามี ETag/Last-Modified)
+    - ตรวจขนาดตาม Content-Length / Content-Range, ETag ต้องไม่เปลี่ยนระหว่างต่อ
+      และ hash (expected_sha256 หรือที่ server แนบมา) ถ้ามี
+    - dest ที่ตรวจแล้วและ server มี validator -> ถามแบบ conditional ได้ 304 ก็ไม่โหลดซ้ำ
+    - dest ที่ตรวจแล้วแต่ไม่มี validator (ไม่มี ETag/Last-Modified) และเป็น url เดิม -> ใช้ไฟล์เดิมเลย
+      (ถามแบบ conditional ไม่ได้) url เปลี่ยนจึงโหลดใหม่ ต้องการบังคับโหลดใหม่ใช้ forget_unvalidated
+    """
+    dest = Path(dest)
+    part = part_path(dest)
+    man = read_manifest(dest)
+    hdrs = dict(headers or {})
+
+    done = verified_copy(dest, man)
+    offset = 0
+    if done:
+        if done.get("etag"):
+            hdrs["If-None-Match"] = done["etag"]
+        elif done.get("last_modified"):
+            hdrs["If-Modified-Since"] = done["last_modified"]
+        elif done.get("url") == url:
+            print(f"[info] {dest.name} ตรวจครบแล้ว (url เดิม ไม่มี ETag/Last-Modified) ใช้ไฟล์เดิม", flush=True)
+            return 0
+    elif (man.get("state") == "partial" and man.get("resumable") and man.get("url") == url
+          and part.exists()):
+        offset = part.stat().st_size
+        if offset:
+            hdrs["Range"] = f"bytes={offset}-"
+            etag = man.get("etag") or ""
+            validator = etag if etag and not etag.startswith("W/") else man.get("last_modified")
+            if validator:
+                hdrs["If-Range"] = validator
+
+    with client.stream("GET", url, headers=hdrs, timeout=timeout,
+                       verify=verify, allow_redirects=True) as r:
+        if done and r.status_code == 304:
+            print(f"[info] {dest.name} ไม่เปลี่ยน (304) ใช้ไฟล์เดิม", flush=True)
+            if done.get("url") != url:
+                write_manifest(dest, dict(done, url=url))
+            return 0
+        if offset and r.status_code == 416:
+            # .part อาจครบแล้วตั้งแต่รอบก่อน ไม่งั้นเริ่มใหม่
+            _, total = _content_range(r)
+            if total is None or total != offset:
+                _drop(part, manifest_path(dest))
+                raise DownloadError(f"{dest.name}: resume ไม่ได้ (416) เริ่มใหม่รอบถัดไป")
+            return _finish(dest, part, url, man, offset, None, expected_sha256, sent=0)
+        r.raise_for_status()
+
+        etag = r.headers.get("ETag")
+        encoded = (r.headers.get("Content-Encoding") or "identity").lower() != "identity"
+        if offset and r.status_code == 206:
+            start, total = _content_range(r)
+            if (start != offset or (man.get("etag") and etag and etag != man["etag"])
+                    or (man.get("length") and total != man["length"])):
+                _drop(part, manifest_path(dest))
+                raise DownloadError(f"{dest.name}: ไฟล์บน server เปลี่ยนระหว่างต่อ เริ่มใหม่รอบถัดไป")
+            print(f"[info] resume {dest.name} จาก {offset:,} bytes", flush=True)
+            digests = dict(man.get("digests") or {}, **response_digests(r, partial=True))
+            length = total
+            mode = "ab"
+        else:
+            offset = 0
+            digests = response_digests(r)
+            clen = r.headers.get("Content-Length", "")
+            # ถูกบีบอัด (gzip) -> Content-Length เป็นขนาดก่อนคลาย เทียบไม่ได้ และต่อด้วย Range ไม่ได้
+            length = int(clen) if clen.isdigit() and not encoded else None
+            mode = "wb"
+            man = {"url": url, "etag": etag, "last_modified": r.headers.get("Last-Modified"),
+                   "length": length, "digests": digests, "state": "partial",
+                   "resumable": not encoded and (r.headers.get("Accept-Ranges", "").lower() == "bytes"
+                                                 or bool(etag or length))}
+            write_manifest(dest, man)
+        if expected_sha256:
+            digests["sha256"] = expected_sha256.lower()
+
+        algos = ["sha256"] + (["md5"] if "md5" in digests else [])
+        hs = _hash_file(part, algos) if mode == "ab" else {a: hashlib.new(a) for a in algos}
+        sent = 0
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    for h in hs.values():
+                        h.update(chunk)
+                    sent += len(chunk)
+    man["digests"] = digests
+    return _finish(dest, part, url, man, offset + sent, hs, expected_sha256, sent)
+
+def _finish(dest: Path, part: Path, url: str, man: Dict, size: int, hs, expected_sha256, sent: int) -> int:
+    """ตรวจขนาด/hash ของ .part แล้ว rename เป็น dest + บันทึก manifest ว่าครบ"""
+    if os.path.getsize(part) != size:
+        raise DownloadError(f"{dest.name}: ขนาด .part ไม่ตรง ({os.path.getsize(part):,} != {size:,})")
+    length = man.get("length")
+    if length is not None and size != length:
+        # ยังไม่ครบ: เก็บ .part ไว้ต่อรอบถัดไป
+        raise DownloadError(f"{dest.name}: ได้ {size:,} / {length:,} bytes")
+    digests = dict(man.get("digests") or {})
+    if expected_sha256:
+        digests["sha256"] = expected_sha256.lower()
+    if hs is None:
+        hs = _hash_file(part, ["sha256"] + (["md5"] if "md5" in digests else []))
+    got = {a: h.hexdigest() for a, h in hs.items()}
+    for algo, want in digests.items():
+        if algo in got and got[algo] != want:
+            _drop(part, manifest_path(dest))
+            raise DownloadError(f"{dest.name}: {algo} ไม่ตรง ({got[algo]} != {want})")
+    os.replace(part, dest)
+    st = os.stat(dest)
+    write_manifest(dest, {"url": url, "etag": man.get("etag"), "last_modified": man.get("last_modified"),
+                          "length": size, "digests": digests, "sha256": got["sha256"], "state": "complete",
+                          "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+    return sent
+
+# ---------- download ----------
+def _backoff(attempt: int):
+    time.sleep(min(30, 2 ** attempt))
+
+def _retryable(e: Exception) -> bool:
+    """4xx (ยกเว้น 408/429) retry ไปก็ได้ผลเดิม"""
+    resp = getattr(e, "response", None)
+    if isinstance(e, requests.HTTPError) and resp is not None:
+        return resp.status_code >= 500 or resp.status_code in (408, 429)
+    return True
+
+def _download_one(key, url, dest, fetch: Callable[[str, str], Optional[int]], retries: int) -> Dict:
+    t0 = time.perf_counter()
+    err = None
+    for attempt in range(1, retries + 1):
+        try:
+            n = fetch(url, dest)
+            if n is None:
+                n = os.path.getsize(dest)
+            return {"key": key, "url": url, "dest": dest, "ok": True, "bytes": n,
+                    "seconds": time.perf_counter() - t0, "attempts": attempt, "error": None}
+        except (requests.RequestException, OSError) as e:
+            err = e
+            if not _retryable(e):
+                break
+            if attempt < retries:
+                print(f"[warn] download {key} ครั้งที่ {attempt} ล้มเหลว: {e}; retry...", flush=True)
+                _backoff(attempt - 1)
+        except Exception as e:
+            # error อื่น (เช่นข้อมูลผิดรูปแบบ) retry ไปก็ไม่หาย
+            err = e
+            break
+    return {"key": key, "url": url, "dest": dest, "ok": False, "bytes": 0,
+            "seconds": time.perf_counter() - t0, "attempts": attempt, "error": err}
+
+def download_all(jobs: List[Tuple[str, str, str]], fetch: Callable[[str, str], Optional[int]],
+                 workers: int = DOWNLOAD_WORKERS, retries: int = DOWNLOAD_RETRIES,
+                 verbose: bool = True) -> List[Dict]:
+    """
+    ดาวน์โหลด jobs [(key, url, dest), ...] พร้อมกันไม่เกิน workers ไฟล์
+    fetch(url, dest) ดาวน์โหลด 1 ไฟล์ (คืนจำนวน byte หรือ None) — ล้มเหลวจะ retry สูงสุด retries ครั้ง
+    คืนผลของแต่ละไฟล์ตามลำดับ jobs: {"key", "url", "dest", "ok", "bytes", "seconds", "attempts", "error"}
+    """
+    if not jobs:
+        return []
+    t0 = time.perf_counter()
+    n = max(1, min(workers, len(jobs)))
+    if verbose:
+        print(f"[info] downloading {len(jobs)} files (พร้อมกัน {n})", flush=True)
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        futs = [ex.submit(_download_one, key, url, dest, fetch, max(1, retries)) for key, url, dest in jobs]
+        results = [f.result() for f in futs]
+    if verbose:
+        print_download_summary(results, time.perf_counter() - t0)
+    return results
+
+def print_download_summary(results: List[Dict], wall: float):
+    """พิมพ์ขนาด / เวลา / MB/s รายไฟล์ และรวม"""
+    print("[info] download summary:", flush=True)
+    for r in results:
+        if r["ok"]:
+            mb = r["bytes"] / 1e6
+            rate = mb / r["seconds"] if r["seconds"] > 0 else 0.0
+            retry = f" (ครั้งที่ {r['attempts']})" if r["attempts"] > 1 else ""
+            print(f" - {r['key']}: {mb:,.2f} MB in {r['seconds']:.2f}s = {rate:,.2f} MB/s{retry}", flush=True)
+        else:
+            print(f" - {r['key']}: ❌ {r['error']}", flush=True)
+    total = sum(r["bytes"] for r in results) / 1e6
+    ok = sum(1 for r in results if r["ok"])
+    rate = total / wall if wall > 0 else 0.0
+    print(f"   รวม {ok}/{len(results)} ไฟล์ {total:,.2f} MB in {wall:.2f}s = {rate:,.2f} MB/s", flush=True)
+
+# ---------- merge ----------
+def merge_key_files(parts: List, dest, header_rows: int) -> int:
+    """
+    ต่อไฟล์ export ของ key เดียวกัน (หลายวัน/หลายช่วง) เป็นไฟล์เดียวตามลำดับ parts
+    เก็บหัวตาราง header_rows แถวจากไฟล์แรกที่มีเนื้อหาเท่านั้น คืนขนาดไฟล์ (byte)
+    """
+    dest = Path(dest)
+    tmp = part_path(dest)
+    wrote_header = False
+    nl = b"\n"
+    last = b"\n"
+    with open(tmp, "wb") as out:
+        for p in parts:
+            with open(p, "rb") as f:
+                head = b"".join(f.readline() for _ in range(header_rows))
+                if not wrote_header:
+                    if not head:
+                        continue
+                    if head.endswith(b"\r\n"):
+                        nl = b"\r\n"
+                    out.write(head)
+                    last = head[-1:]
+                    wrote_header = True
+                block = f.read(MERGE_BLOCK)
+                if block and last != b"\n":
+                    out.write(nl)  # ไฟล์ก่อนหน้าไม่ขึ้นบรรทัดใหม่ท้ายไฟล์ (ตรวจครั้งเดียวก่อน body ของไฟล์นี้)
+                while block:
+                    out.write(block)
+                    last = block[-1:]
+                    block = f.read(MERGE_BLOCK)
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+def merge_all(parts: Dict[str, List], out_dir, filename: Callable[[str], str], header_rows: int) -> List[Dict]:
+    """merge_key_files ทุก key ลง out_dir/filename(key) คืนผลรูปแบบเดียวกับ download_all (url = "")"""
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    for key, paths in parts.items():
+        t0 = time.perf_counter()
+        dest = os.path.join(out_dir, filename(key))
+        n = merge_key_files(paths, dest, header_rows)
+        results.append({"key": key, "url": "", "dest": dest, "ok": True, "bytes": n,
+                        "seconds": time.perf_counter() - t0, "attempts": 1, "error": None})
+    return results
+
+# ---------- export + download ----------
+def export_files(from_date: str, to_date: str, dest_dir, post_export: Callable[[str, str], Dict],
+                 fetch: Callable[[str, str], Optional[int]], workers: int = DOWNLOAD_WORKERS,
+                 retries: int = DOWNLOAD_RETRIES, verbose: bool = True) -> List[Dict]:
+    """สั่ง export หนึ่งช่วงแล้วดาวน์โหลดทุกไฟล์ลง dest_dir/<key>.txt (API / ดาวน์โหลดล้มเหลว -> RuntimeError)"""
+    data = post_export(from_date, to_date)
+    if str(data.get("status", "")).lower() != "success":
+        raise RuntimeError(f"API status != success ({from_date}→{to_date}): {data.get('message', '')}")
+    os.makedirs(dest_dir, exist_ok=True)
+    jobs = [(key, link, os.path.join(dest_dir, f"{key}.txt"))
+            for key, link in (data.get("files") or {}).items() if link]
+    results = download_all(jobs, fetch, workers=workers, retries=retries, verbose=verbose)
+    failed = [r for r in results if not r["ok"]]
+    if failed:
+        raise RuntimeError(f"ดาวน์โหลด {from_date}→{to_date} ไม่ครบ: "
+                           + ", ".join(f"{r['key']} ({r['error']})" for r in failed))
+    return results
+
+def map_ranges(fn: Callable[[str, str], object], ranges: List[Tuple[str, str]], concurrency: int) -> List:
+    """
+    เรียก fn(from, to) ทุกช่วงพร้อมกันไม่เกิน concurrency คืนผลตามลำดับ ranges
+    รอทุกช่วงจบก่อน ถ้ามีช่วงล้มเหลว -> RuntimeError รวมทุกช่วงที่พัง
+    """
+    n = max(1, min(concurrency, len(ranges)))
+    out, errors = [], []
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        futs = [ex.submit(fn, f, t) for f, t in ranges]
+        for (f, t), fut in zip(ranges, futs):
+            try:
+                out.append(fut.result())
+            except (RuntimeError, requests.RequestException, OSError) as e:
+                errors.append(f"{f}→{t}: {e}")
+    if errors:
+        raise RuntimeError(f"export ไม่สำเร็จ {len(errors)}/{len(ranges)} ช่วง: " + "; ".join(errors))
+    return out
+
+# ---------- per-day export cache ----------
+def split_days(from_date: str, to_date: str) -> List[str]:
+    """'yyyy-mm-dd' ถึง 'yyyy-mm-dd' -> ทุกวันในช่วง (รวมหัวท้าย)"""
+    d0 = datetime.strptime(from_date, "%Y-%m-%d").date()
+    d1 = datetime.strptime(to_date, "%Y-%m-%d").date()
+    return [(d0 + timedelta(days=i)).isoformat() for i in range((d1 - d0).days + 1)]
+
+def split_range(from_date: str, to_date: str, span_days: int) -> List[Tuple[str, str]]:
+    """แบ่งช่วงวันที่เป็นช่วงย่อยละ span_days วัน [(from, to), ...]"""
+    days = split_days(from_date, to_date)
+    span = max(1, span_days)
+    return [(days[i], days[min(i + span, len(days)) - 1]) for i in range(0, len(days), span)]
+
+class ExportCache:
+    """
+    cache ไฟล์ export รายวัน: <root>/<yyyy-mm-dd>/<key>.txt + .day.json (เวลาที่ดึง, ขนาด, sha256)
+    - วันที่ยังไม่มี / เกิน ttl_hours / วันนี้ขึ้นไป -> สั่ง export ใหม่เฉพาะวันนั้น
+    - ช่วงวันที่ = ต่อไฟล์รายวันของแต่ละ key (หัวตารางชุดเดียว)
+    """
+    def __init__(self, root, ttl_hours: float = 24.0):
+        self.root = Path(root)
+        self.ttl = ttl_hours * 3600
+
+    def day_dir(self, day: str) -> Path:
+        return self.root / day
+
+    def read_day(self, day: str) -> Dict:
+        try:
+            with open(self.day_dir(day) / DAY_MANIFEST, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def is_fresh(self, day: str, now: Optional[float] = None) -> bool:
+        """วันนี้ (หรืออนาคต) ไม่นับว่าสดเสมอ เพราะข้อมูลยังเพิ่มได้"""
+        now = time.time() if now is None else now
+        if day >= datetime.fromtimestamp(now).date().isoformat():
+            return False
+        m = self.read_day(day)
+        if "fetched_at" not in m:
+            return False
+        if self.ttl > 0 and now - m["fetched_at"] > self.ttl:
+            return False
+        return all(verified_copy(self.day_dir(day) / info["name"]) for info in m.get("files", {}).values())
+
+    def refresh_day(self, day: str, post_export: Callable[[str, str], Dict],
+                    fetch: Callable[[str, str], Optional[int]],
+                    workers: int = DOWNLOAD_WORKERS, retries: int = DOWNLOAD_RETRIES,
+                    verbose: bool = True) -> Dict:
+        """สั่ง export วันเดียว ดาวน์โหลดลงโฟลเดอร์ของวันนั้น แล้วบันทึก .day.json (ล้มเหลว -> RuntimeError)"""
+        ddir = self.day_dir(day)
+        # วันที่ต้อง refresh: ไฟล์เดิมที่ไม่มี validator ต้องโหลดใหม่ (มี validator -> ถามแบบ conditional เอง)
+        for info in self.read_day(day).get("files", {}).values():
+            forget_unvalidated(ddir / info["name"])
+        results = export_files(day, day, ddir, post_export, fetch, workers=workers, retries=retries, verbose=verbose)
+        files = {}
+        for r in results:
+            dl = read_manifest(r["dest"])
+            files[r["key"]] = {"name": Path(r["dest"]).name, "size": os.path.getsize(r["dest"]),
+                               "sha256": dl.get("sha256")}
+        m = {"day": day, "fetched_at": time.time(), "files": files}
+        tmp = ddir / (DAY_MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(m, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, ddir / DAY_MANIFEST)
+        return m
+
+    def export_range(self, from_date: str, to_date: str, out_dir, filename: Callable[[str], str],
+                     post_export: Callable[[str, str], Dict], fetch: Callable[[str, str], Optional[int]],
+                     header_rows: int, workers: int = DOWNLOAD_WORKERS,
+                     retries: int = DOWNLOAD_RETRIES, concurrency: int = 1) -> List[Dict]:
+        """
+        ได้ไฟล์ของช่วงวันที่ใน out_dir (ชื่อจาก filename(key)) โดยสั่ง export เฉพาะวันที่ต้อง refresh
+        (พร้อมกันไม่เกิน concurrency วัน) คืนผลรูปแบบเดียวกับ download_all (url = "")
+        """
+        t0 = time.perf_counter()
+        days = split_days(from_date, to_date)
+        stale = [d for d in days if not self.is_fresh(d)]
+        print(f"[info] export cache: {len(days) - len(stale)}/{len(days)} วันใช้ cache, "
+              f"export ใหม่ {len(stale)} วัน", flush=True)
+        n = max(1, min(concurrency, len(stale)))
+
+        def refresh(day, _):
+            print(f"[info] export {day}", flush=True)
+            return self.refresh_day(day, post_export, fetch, workers=max(1, workers // n),
+                                    retries=retries, verbose=n == 1)
+        map_ranges(refresh, [(d, d) for d in stale], n)
+
+        parts: Dict[str, List[Path]] = {}
+        for d in days:
+            for key, info in self.read_day(d).get("files", {}).items():
+                parts.setdefault(key, []).append(self.day_dir(d) / info["name"])
+        results = merge_all(parts, out_dir, filename, header_rows)
+        print(f"[info] export cache: รวม {len(results)} ไฟล์จาก {len(days)} วัน "
+              f"in {time.perf_counter() - t0:.2f}s", flush=True)
+        return results
+
+# ---------- split long ranges ----------
+def export_split(from_date: str, to_date: str, out_dir, filename: Callable[[str], str],
+                 post_export: Callable[[str, str], Dict], fetch: Callable[[str, str], Optional[int]],
+                 header_rows: int, span_days: int = 7, concurrency: int = EXPORT_CONCURRENCY,
+                 workers: int = DOWNLOAD_WORKERS, retries: int = DOWNLOAD_RETRIES) -> List[Dict]:
+    """
+    แบ่งช่วงยาวเป็นช่วงละ span_days วัน สั่ง export พร้อมกันไม่เกิน concurrency ช่วง
+    แล้วรวมไฟล์ของแต่ละ key ตามลำดับวันที่ (หัวตารางชุดเดียว) ลง out_dir/filename(key)
+    ไฟล์ย่อยพักไว้ที่ <parent>/.ranges/<ชื่อ out_dir> (ไม่สร้าง out_dir จนกว่าจะรวม เพื่อไม่ให้ตัวเฝ้าโฟลเดอร์เห็นโฟลเดอร์ว่าง)
+    รวมเสร็จแล้วลบ, ล้มเหลวเก็บไว้ให้รอบหน้าต่อได้
+    """
+    t0 = time.perf_counter()
+    ranges = split_range(from_date, to_date, span_days)
+    work = Path(out_dir).parent / ".ranges" / Path(out_dir).name
+    n = max(1, min(concurrency, len(ranges)))
+    print(f"[info] แบ่ง {from_date} → {to_date} เป็น {len(ranges)} ช่วง "
+          f"(ช่วงละ {span_days} วัน, พร้อมกัน {n})", flush=True)
+
+    def one(f, t):
+        print(f"[info] export {f} → {t}", flush=True)
+        return export_files(f, t, work / f"{f}_to_{t}", post_export, fetch,
+                            workers=max(1, workers // n), retries=retries, verbose=False)
+    subs = map_ranges(one, ranges, n)
+    print_download_summary([dict(r, key=f"{r['key']} [{f}→{t}]") for (f, t), rs in zip(ranges, subs) for r in rs],
+                           time.perf_counter() - t0)
+
+    parts: Dict[str, List] = {}
+    for rs in subs:
+        for r in rs:
+            parts.setdefault(r["key"], []).append(r["dest"])
+    results = merge_all(parts, out_dir, filename, header_rows)
+    shutil.rmtree(work, ignore_errors=True)
+    print(f"[info] รวม {len(results)} ไฟล์จาก {len(ranges)} ช่วง in {time.perf_counter() - t0:.2f}s", flush=True)
+    return results
+
+# ---------- entry point ----------
+def fetch_range(from_date: str, to_date: str, out_dir, filename: Callable[[str], str],
+                post_export: Callable[[str, str], Dict], fetch: Callable[[str, str], Optional[int]],
+                header_rows: int, workers: int = DOWNLOAD_WORKERS, retries: int = DOWNLOAD_RETRIES,
+                span_days: int = 0, concurrency: int = EXPORT_CONCURRENCY, cache: bool = False,
+                cache_dir: str = "", cache_ttl_hours: float = 24.0) -> List[Dict]:
+    """
+    ได้ไฟล์ของช่วงวันที่ลง out_dir/filename(key)
+    - cache=True -> ExportCache (ที่ cache_dir หรือ <parent ของ out_dir>/.export_cache) export เฉพาะวันที่ต้อง refresh
+    - span_days > 0 และช่วงยาวกว่า -> export_split
+    - ไม่งั้น export ครั้งเดียวแล้ว download_all (ไฟล์ที่โหลดไม่สำเร็จคืนเป็น ok=False)
+    คืนผลรูปแบบเดียวกับ download_all / API ไม่ success หรือ export แบบ cache/แบ่งช่วงล้มเหลว -> RuntimeError
+    """
+    if cache:
+        ec = ExportCache(cache_dir or Path(out_dir).parent / ".export_cache", ttl_hours=cache_ttl_hours)
+        return ec.export_range(from_date, to_date, out_dir, filename, post_export, fetch,
+                               header_rows=header_rows, workers=workers, retries=retries,
+                               concurrency=concurrency)
+    if span_days > 0 and len(split_days(from_date, to_date)) > span_days:
+        # ช่วงยาว: export ทีละช่วงย่อยพร้อมกัน แล้วรวมไฟล์ต่อ key (กัน TIMEOUT ของ export ก้อนใหญ่)
+        return export_split(from_date, to_date, out_dir, filename, post_export, fetch,
+                            header_rows=header_rows, span_days=span_days, concurrency=concurrency,
+                            workers=workers, retries=retries)
+
+    data = post_export(from_date, to_date)
+    status = str(data.get("status", "")).lower()
+    print(f"[info] status={status} message={data.get('message', '')}", flush=True)
+    if status != "success":
+        print(json.dumps(data, indent=2, ensure_ascii=False), flush=True)
+        raise RuntimeError("API did not return success status.")
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    for key, link in (data.get("files") or {}).items():
+        if not link:
+            print(f"[warn] missing link for key={key}, skip", flush=True)
+            continue
+        dest = os.path.join(out_dir, filename(key))
+        print(f"[info] downloading {key} -> {dest}", flush=True)
+        jobs.append((key, link, dest))
+    return download_all(jobs, fetch, workers=workers, retries=retries)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+ตรวจว่าไฟล์ "เขียนเสร็จแล้ว" จาก event ของ watchdog แทนการ sleep/poll
+- StabilityTracker: ทุก event (created/modified/moved/closed) ของไฟล์ = touch()
+  ไฟล์นิ่งเมื่อไม่มี event มา quiet วินาที แล้ว stat ยืนยันว่าขนาด/mtime ตรงกับที่เห็นล่าสุด
+  (กัน event หาย) ได้ event closed -> รอแค่ CLOSE_GRACE
+- FolderReadiness: โฟลเดอร์พร้อมเมื่อมีไฟล์ตรงทุก glob ที่ต้องการ และทุกไฟล์นั้นนิ่งแล้ว
+  ไม่ครบภายใน max_wait -> on_timeout(folder, globs ที่ยังขาด)
+ใช้ thread เดียวจับเวลาทุกไฟล์ ไม่ poll ขนาดไฟล์ระหว่างรอ
+on_ready ถูกเรียกจาก thread dispatch แยก: callback ที่รอ (เช่น pool.submit ตอนคิวเต็ม) ไม่หยุดการจับเวลาไฟล์
+"""
+import os
+import time
+import queue
+import fnmatch
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CLOSE_GRACE = 0.5   # วินาทีหลัง event closed (writer ปิดไฟล์แล้ว) ก่อนถือว่านิ่ง
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+class StabilityTracker:
+    """
+    tracker = StabilityTracker(quiet=2, on_stable=fn, max_wait=600, on_timeout=fn).start()
+    handler ของ watchdog เรียก tracker.touch(path) / touch(path, closed=True)
+    on_stable(path) / on_timeout(path) ถูกเรียกใน thread ของ tracker
+    """
+    def __init__(self, quiet: float = 2.0, on_stable: Optional[Callable[[str], None]] = None,
+                 max_wait: Optional[float] = None, on_timeout: Optional[Callable[[str], None]] = None):
+        self.quiet = max(0.0, quiet)
+        self.max_wait = max_wait
+        self.on_stable = on_stable
+        self.on_timeout = on_timeout
+        self._files: Dict[str, Dict] = {}   # path -> {"first", "due", "stat"}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def touch(self, path, closed: bool = False):
+        """บันทึกว่าไฟล์เพิ่งเปลี่ยน (เรียกจาก event)"""
+        path = os.path.abspath(path)
+        now = time.monotonic()
+        st = _stat(path)
+        with self._cond:
+            ent = self._files.get(path)
+            if ent is None:
+                ent = self._files[path] = {"first": now}
+            ent["stat"] = st
+            ent["due"] = now + (min(self.quiet, CLOSE_GRACE) if closed else self.quiet)
+            self._cond.notify()
+
+    def forget(self, path):
+        with self._cond:
+            self._files.pop(os.path.abspath(path), None)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._files)
+
+    def busy_in(self, folder: str) -> bool:
+        """มีไฟล์ในโฟลเดอร์นี้ (ชั้นเดียว) ที่ยังไม่นิ่งหรือไม่"""
+        with self._cond:
+            return any(os.path.dirname(p) == folder for p in self._files)
+
+    def _check(self, now: float) -> Tuple[List[str], List[str], Optional[float]]:
+        """(ไฟล์ที่นิ่งแล้ว, ไฟล์ที่หมดเวลา, เวลาที่ต้องตื่นครั้งถัดไป) เรียกตอนถือ lock"""
+        stable, expired, next_due = [], [], None
+        for path, ent in list(self._files.items()):
+            if self.max_wait is not None and now - ent["first"] >= self.max_wait:
+                expired.append(path)
+                del self._files[path]
+                continue
+            if ent["due"] <= now:
+                st = _stat(path)
+                if st is None:
+                    del self._files[path]          # ถูกลบ/ย้ายไปแล้ว
+                    continue
+                if st == ent["stat"]:
+                    stable.append(path)
+                    del self._files[path]
+                    continue
+                # มีการเขียนที่ไม่ได้ event มา -> เริ่มนับใหม่
+                ent["stat"] = st
+                ent["due"] = now + self.quiet
+            due = ent["due"]
+            if self.max_wait is not None:
+                due = min(due, ent["first"] + self.max_wait)
+            next_due = due if next_due is None else min(next_due, due)
+        return stable, expired, next_due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                stable, expired, next_due = self._check(time.monotonic())
+                if not stable and not expired:
+                    self._cond.wait(None if next_due is None else max(0.0, next_due - time.monotonic()))
+                    continue
+            for path in stable:
+                self._emit(self.on_stable, path)
+            for path in expired:
+                self._emit(self.on_timeout, path)
+
+    @staticmethod
+    def _emit(cb, path):
+        if not cb:
+            return
+        try:
+            cb(path)
+        except Exception as e:
+            print(f"[warn] [stable] callback ของ {path} ล้มเหลว: {e}", flush=True)
+
+    def start(self) -> "StabilityTracker":
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="file-stability", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+
+class FolderReadiness:
+    """
+    รอให้โฟลเดอร์ export ใหม่พร้อมประมวลผล
+    ready = FolderReadiness(("sap1_*.txt", "sap2_*.txt"), quiet=3, max_wait=1800,
+                            on_ready=fn(folder), on_timeout=fn(folder, missing)).start()
+    ready.watch(folder)    # จาก on_created ของโฟลเดอร์
+    ready.touch(path)      # จาก event ของไฟล์ในโฟลเดอร์ (ไฟล์นอกโฟลเดอร์ที่เฝ้าถูกข้าม)
+    on_ready(folder) ถูกเรียกตามลำดับใน thread "folder-ready" (ไม่ใช่ thread ของ tracker)
+    on_ready รอได้ (backpressure) โฟลเดอร์ที่พร้อมระหว่างนั้นต่อคิวไว้ stop() ส่งที่ค้างให้ครบก่อนคืน
+    """
+    def __init__(self, globs: Iterable[str], quiet: float = 3.0, max_wait: float = 1800,
+                 on_ready: Optional[Callable[[Path], None]] = None,
+                 on_timeout: Optional[Callable[[Path, List[str]], None]] = None):
+        self.globs = list(globs)
+        self.max_wait = max_wait
+        self.on_ready = on_ready
+        self.on_timeout = on_timeout
+        self._lock = threading.Lock()
+        self._folders: Dict[str, Dict] = {}   # folder -> {"path", "stable": set, "timer"}
+        self._tracker = StabilityTracker(quiet=quiet, on_stable=self._file_stable)
+        self._ready_q: "queue.Queue" = queue.Queue()   # โฟลเดอร์ที่พร้อมแล้ว รอส่งให้ on_ready
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def _wanted(self, name: str) -> bool:
+        return any(fnmatch.fnmatch(name.lower(), g.lower()) for g in self.globs)
+
+    def watch(self, folder) -> bool:
+        """เริ่มรอโฟลเดอร์ (False = รออยู่แล้ว) ไฟล์ที่มีอยู่ก่อนได้ event ก็นับด้วย"""
+        folder = Path(folder)
+        key = os.path.abspath(folder)
+        with self._lock:
+            if key in self._folders:
+                return False
+            timer = threading.Timer(self.max_wait, self._expire, args=(key,))
+            timer.daemon = True
+            self._folders[key] = {"path": folder, "stable": set(), "t0": time.monotonic(), "timer": timer}
+        timer.start()
+        try:
+            existing = [p for p in folder.iterdir() if p.is_file() and self._wanted(p.name)]
+        except OSError:
+            existing = []
+        for p in existing:
+            self._tracker.touch(p)
+        return True
+
+    def touch(self, path, closed: bool = False):
+        path = os.path.abspath(path)
+        folder, name = os.path.split(path)
+        if not self._wanted(name):
+            return
+        with self._lock:
+            ent = self._folders.get(folder)
+            if ent is None:
+                return
+            ent["stable"].discard(name)   # เขียนเพิ่มหลังนิ่ง -> ต้องนิ่งใหม่
+        self._tracker.touch(path, closed=closed)
+
+    def _missing(self, ent: Dict) -> List[str]:
+        return [g for g in self.globs
+                if not any(fnmatch.fnmatch(n.lower(), g.lower()) for n in ent["stable"])]
+
+    def _file_stable(self, path: str):
+        folder, name = os.path.split(path)
+        with self._lock:
+            ent = self._folders.get(folder)
+            if ent is None:
+                return
+            ent["stable"].add(name)
+            # ยังมีไฟล์ของโฟลเดอร์นี้ที่กำลังเขียนอยู่ -> ยังไม่พร้อม
+            if self._missing(ent) or self._tracker.busy_in(folder):
+                return
+            del self._folders[folder]
+        ent["timer"].cancel()
+        print(f"[info] [ready] {ent['path'].name} พร้อมหลังรอ {time.monotonic() - ent['t0']:.1f}s", flush=True)
+        if self.on_ready:
+            if self._ready_q.qsize():
+                print(f"[warn] [ready] on_ready ยังไม่ว่าง -> {ent['path'].name} ต่อคิว "
+                      f"(รอส่ง {self._ready_q.qsize() + 1})", flush=True)
+            self._ready_q.put(ent["path"])   # ไม่เรียกตรงนี้: thread ของ tracker ต้องไม่ถูกบล็อก
+
+    def _expire(self, key: str):
+        with self._lock:
+            ent = self._folders.pop(key, None)
+        if ent is None:
+            return
+        missing = self._missing(ent)
+        print(f"❌ [ready] {ent['path'].name} ไม่พร้อมภายใน {self.max_wait:.0f}s "
+              f"(ยังขาด/ยังเขียนไม่เสร็จ: {', '.join(missing) or 'ไฟล์ยังเปลี่ยนอยู่'})", flush=True)
+        if self.on_timeout:
+            try:
+                self.on_timeout(ent["path"], missing)
+            except Exception as e:
+                print(f"[warn] [ready] callback ของ {ent['path'].name} ล้มเหลว: {e}", flush=True)
+
+    def _dispatch(self):
+        """ส่งโฟลเดอร์ที่พร้อมให้ on_ready ทีละโฟลเดอร์ตามลำดับ (None = หยุด)"""
+        while True:
+            folder = self._ready_q.get()
+            if folder is None:
+                return
+            try:
+                self.on_ready(folder)
+            except Exception as e:
+                print(f"[warn] [ready] callback ของ {folder.name} ล้มเหลว: {e}", flush=True)
+
+    def start(self) -> "FolderReadiness":
+        if self.on_ready and not (self._dispatcher and self._dispatcher.is_alive()):
+            self._dispatcher = threading.Thread(target=self._dispatch, name="folder-ready", daemon=True)
+            self._dispatcher.start()
+        self._tracker.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            for ent in self._folders.values():
+                ent["timer"].cancel()
+            self._folders.clear()
+        self._tracker.stop()
+        if self._dispatcher:
+            self._ready_q.put(None)   # ส่งโฟลเดอร์ที่พร้อมแล้วให้ครบก่อนหยุด
+            self._dispatcher.join()
+            self._dispatcher = None
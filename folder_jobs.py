@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+คิวงานประมวลผลโฟลเดอร์สำหรับตัวเฝ้าโฟลเดอร์ (Alert / Auto_Checkminus_0)
+- handler ของ watchdog แค่ submit() แล้วคืนทันที งานจริงรันใน worker process N ตัว
+- คิวมีขนาดจำกัด (เต็ม -> submit รอ = backpressure)
+- โฟลเดอร์เดียวกันที่อยู่ในคิว/กำลังรัน ไม่ถูกเพิ่มซ้ำ
+- log เวลารอคิว/เวลารันต่องาน + ความลึกคิว และสรุปตอนปิด
+fn ต้องเป็นฟังก์ชันระดับ module (ส่งข้าม process ได้) และคืนค่าที่ pickle ได้
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+def _timed(fn: Callable, folder: Path):
+    """รันใน worker: คืน (ผลลัพธ์, วินาทีที่ใช้)"""
+    t0 = time.perf_counter()
+    res = fn(folder)
+    return res, time.perf_counter() - t0
+
+class FolderJobPool:
+    """
+    pool = FolderJobPool(process_folder, workers=2, on_result=..., on_error=...)
+    pool.submit(folder)  # จาก on_created
+    pool.shutdown()      # ตอนปิดโปรแกรม (รองานที่ค้างให้จบ)
+    on_result(folder, result) / on_error(folder, exc) ถูกเรียกใน process หลัก
+    """
+    def __init__(self, fn: Callable[[Path], Any], workers: int = 2, max_queue: int = 100,
+                 on_result: Optional[Callable[[Path, Any], None]] = None,
+                 on_error: Optional[Callable[[Path, BaseException], None]] = None):
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.on_result = on_result
+        self.on_error = on_error
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, max_queue))
+        self._slots = threading.Semaphore(self.workers)
+        self._lock = threading.Lock()
+        self._active = set()   # โฟลเดอร์ที่อยู่ในคิวหรือกำลังรัน
+        self._running = 0
+        self.stats = {"done": 0, "failed": 0, "skipped": 0, "run_s": 0.0, "wait_s": 0.0, "max_depth": 0}
+        self._ex = ProcessPoolExecutor(max_workers=self.workers)
+        self._feeder = threading.Thread(target=self._feed, name="folder-jobs", daemon=True)
+        self._feeder.start()
+
+    @staticmethod
+    def _key(folder: Path) -> str:
+        return os.path.normcase(os.path.abspath(folder))
+
+    def _depth(self) -> str:
+        return f"queue={self._q.qsize()} running={self._running}/{self.workers}"
+
+    def submit(self, folder: Path) -> bool:
+        """เพิ่มงาน (False = โฟลเดอร์นี้อยู่ในคิว/กำลังรันอยู่แล้ว)"""
+        folder = Path(folder)
+        key = self._key(folder)
+        with self._lock:
+            if key in self._active:
+                self.stats["skipped"] += 1
+                print(f"[info] [jobs] {folder.name} อยู่ในคิวแล้ว -> ข้าม event ซ้ำ", flush=True)
+                return False
+            self._active.add(key)
+        if self._q.full():
+            print(f"[warn] [jobs] คิวเต็ม ({self._q.maxsize}) รอคิวว่างก่อนเพิ่ม {folder.name}", flush=True)
+        self._q.put((folder, key, time.perf_counter()))
+        with self._lock:
+            self.stats["max_depth"] = max(self.stats["max_depth"], self._q.qsize())
+        print(f"[info] [jobs] + {folder.name} ({self._depth()})", flush=True)
+        return True
+
+    def _feed(self):
+        """ดึงงานจากคิวส่งให้ worker เมื่อมีช่องว่าง (คิวจริงจึงอยู่ที่ _q ให้วัดความลึกได้)"""
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            self._slots.acquire()
+            folder, key, t_queued = item
+            with self._lock:
+                self._running += 1
+            waited = time.perf_counter() - t_queued
+            try:
+                fut = self._ex.submit(_timed, self.fn, folder)
+            except RuntimeError as e:  # pool ถูกปิดไปแล้ว
+                self._finish(folder, key, waited, None, e)
+                continue
+            fut.add_done_callback(lambda f, a=(folder, key, waited): self._collect(f, *a))
+
+    def _collect(self, fut, folder: Path, key: str, waited: float):
+        try:
+            res, run_s = fut.result()
+        except BaseException as e:
+            self._finish(folder, key, waited, None, e)
+            return
+        self._finish(folder, key, waited, run_s, None, res)
+
+    def _finish(self, folder: Path, key: str, waited: float, run_s: Optional[float],
+                err: Optional[BaseException], res: Any = None):
+        with self._lock:
+            self._active.discard(key)
+            self._running -= 1
+            self.stats["wait_s"] += waited
+            if err is None:
+                self.stats["done"] += 1
+                self.stats["run_s"] += run_s
+            else:
+                self.stats["failed"] += 1
+        self._slots.release()
+        if err is None:
+            print(f"[info] [jobs] ✓ {folder.name} รอคิว {waited:.1f}s รัน {run_s:.1f}s ({self._depth()})", flush=True)
+            cb = self.on_result and (lambda: self.on_result(folder, res))
+        else:
+            print(f"❌ [jobs] {folder.name} ล้มเหลวหลังรอคิว {waited:.1f}s: {err} ({self._depth()})", flush=True)
+            cb = self.on_error and (lambda: self.on_error(folder, err))
+        if cb:
+            try:
+                cb()
+            except Exception as e:
+                print(f"[warn] [jobs] callback ของ {folder.name} ล้มเหลว: {e}", flush=True)
+
+    def shutdown(self, wait: bool = True):
+        """หยุดรับงาน รองานในคิว/ที่รันอยู่ให้จบ (wait=True) แล้วพิมพ์สรุป"""
+        self._q.put(None)
+        if wait:
+            self._feeder.join()
+        self._ex.shutdown(wait=wait)
+        s = self.stats
+        avg = s["run_s"] / s["done"] if s["done"] else 0.0
+        print(f"[info] [jobs] สรุป: สำเร็จ {s['done']} ล้มเหลว {s['failed']} ข้ามซ้ำ {s['skipped']} "
+              f"เฉลี่ย {avg:.1f}s/งาน คิวลึกสุด {s['max_depth']}", flush=True)
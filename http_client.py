@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP client กลางที่ทุกสคริปต์ใช้ร่วมกัน (export API, ดาวน์โหลดไฟล์, LINE)
+- requests.Session เดียวต่อ process: connection pool + keep-alive ไม่ต้อง TLS handshake ใหม่ทุก request
+- จำกัดจำนวน request ที่วิ่งพร้อมกันต่อ host (ใช้ข้าม thread ได้)
+- retry/backoff แบบเดียวกันทุกที่: 429/502/503/504 + network error, เคารพ Retry-After
+  network error retry เฉพาะ method ที่ส่งซ้ำได้ (GET/HEAD/...) — POST ต้องขอเองด้วย retry_errors=True
+  (timeout หลัง server รับไปแล้ว ส่งซ้ำ = ทำซ้ำ)
+- timeout ดีฟอลต์
+ตั้งค่าจาก .env (อ่านตอนสร้าง client ครั้งแรก): HTTP_POOL_SIZE, HTTP_HOST_LIMIT, HTTP_RETRIES
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+DEFAULT_TIMEOUT = 60
+MAX_BACKOFF = 30
+MAX_RETRY_AFTER = 300   # รอตาม Retry-After นานสุดกี่วินาที
+
+# ---------- backoff ----------
+def backoff_delay(attempt: int) -> float:
+    """1, 2, 4, 8, 16, 30, 30, ... วินาที"""
+    return min(MAX_BACKOFF, 2 ** attempt)
+
+def retry_after(resp) -> Optional[float]:
+    """Retry-After (วินาที หรือ HTTP-date) -> วินาทีที่ต้องรอ / None ถ้าไม่มี"""
+    v = (resp.headers.get("Retry-After") or "").strip()
+    if not v:
+        return None
+    if v.isdigit():
+        return float(v)
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# ---------- client ----------
+class HttpClient:
+    """
+    Session + pool ที่ใช้ร่วมกันทั้ง process
+    request() คืน Response สุดท้าย (ไม่ raise ตาม status) ให้ผู้เรียกตัดสินเอง เหมือน requests
+    """
+    def __init__(self, pool_size: int = 16, host_limit: int = 8, retries: int = 6,
+                 timeout: float = DEFAULT_TIMEOUT, host_limits: Optional[Dict[str, int]] = None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_limit = max(1, host_limit)
+        self.host_limits = dict(host_limits or {})
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self._sems: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _sem(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.host_limits.get(host, self.host_limit))
+            return sem
+
+    def _send(self, method: str, url: str, retry_status: Iterable[int], retries: Optional[int],
+              retry_errors: Optional[bool], max_wait: Optional[float], hold: bool, **kw):
+        """
+        ส่งพร้อม retry คืน (resp, semaphore ที่ยังถืออยู่ถ้า hold=True)
+        retry_errors: retry network error ด้วยไหม (None = เฉพาะ method ใน IDEMPOTENT_METHODS)
+        max_wait: รอระหว่าง retry นานสุดกี่วินาที (ทั้ง backoff และ Retry-After)
+        """
+        kw.setdefault("timeout", self.timeout)
+        retry_status = tuple(retry_status)
+        if retry_errors is None:
+            retry_errors = method.upper() in IDEMPOTENT_METHODS
+        attempts = self.retries if retries is None else max(1, retries)
+        sem = self._sem(url)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            sem.acquire()
+            try:
+                resp = self.session.request(method, url, **kw)
+            except requests.RequestException as e:
+                sem.release()
+                if last or not retry_errors:
+                    raise
+                print(f"[warn] {method} {url} ล้มเหลว: {e}; retry...", flush=True)
+                time.sleep(min(backoff_delay(attempt), max_wait or MAX_BACKOFF))
+                continue
+            if resp.status_code in retry_status and not last:
+                wait = retry_after(resp)
+                wait = backoff_delay(attempt) if wait is None else min(wait, MAX_RETRY_AFTER)
+                if max_wait is not None:
+                    wait = min(wait, max_wait)
+                resp.close()
+                sem.release()
+                print(f"[warn] {method} {url} -> {resp.status_code}; รอ {wait:.0f}s แล้ว retry", flush=True)
+                time.sleep(wait)
+                continue
+            if not hold:
+                sem.release()
+                return resp, None
+            return resp, sem
+
+    def request(self, method: str, url: str, retry_status: Iterable[int] = RETRY_STATUS,
+                retries: Optional[int] = None, retry_errors: Optional[bool] = None,
+                max_wait: Optional[float] = None, **kw) -> requests.Response:
+        resp, _ = self._send(method, url, retry_status, retries, retry_errors, max_wait, hold=False, **kw)
+        return resp
+
+    def get(self, url: str, **kw) -> requests.Response:
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw) -> requests.Response:
+        return self.request("POST", url, **kw)
+
+    @contextmanager
+    def stream(self, method: str, url: str, retry_status: Iterable[int] = RETRY_STATUS,
+               retries: Optional[int] = None, retry_errors: Optional[bool] = None,
+               max_wait: Optional[float] = None, **kw) -> Iterator[requests.Response]:
+        """request แบบ stream=True ที่นับเป็น 1 ช่องของ host จนอ่าน body เสร็จ"""
+        resp, sem = self._send(method, url, retry_status, retries, retry_errors, max_wait,
+                               hold=True, stream=True, **kw)
+        try:
+            yield resp
+        finally:
+            resp.close()
+            sem.release()
+
+_client: Optional[HttpClient] = None
+_client_lock = threading.Lock()
+
+def get_client() -> HttpClient:
+    """client กลางของ process (สร้างครั้งแรกที่เรียก หลัง load_dotenv แล้ว)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(pool_size=int(os.getenv("HTTP_POOL_SIZE", "16")),
+                                 host_limit=int(os.getenv("HTTP_HOST_LIMIT", "8")),
+                                 retries=int(os.getenv("HTTP_RETRIES", "6")))
+        return _client
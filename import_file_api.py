@@ -9,6 +9,9 @@ from urllib.parse import urljoin
 import requests
 from dotenv import load_dotenv
 
+from http_client import get_client
+from export_client import fetch_resumable, export_settings, add_export_args, fetch_range
+
 # ---------- env & config ----------
 load_dotenv()
 BASE_URL = os.getenv("BASE_URL", "https://mizerp.com").rstrip("/")
@@ -17,11 +20,13 @@ VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() == "true"
 TIMEOUT = int(os.getenv("TIMEOUT_SECONDS", "60"))
 AUTH_HEADER_NAME = os.getenv("AUTH_HEADER_NAME") or None
 AUTH_HEADER_VALUE = os.getenv("AUTH_HEADER_VALUE") or None
+EXPORT = export_settings()   # DOWNLOAD_* / EXPORT_* จาก .env (ดู export_client.export_settings)
+HEADER_ROWS = int(os.getenv("HEADER_ROWS", "2"))  # ใช้ตอนรวมไฟล์รายวัน (หัวตารางชุดเดียว)
 
 # โฟลเดอร์ปลายทาง (แก้ได้ด้วย --out-dir)
 FIXED_OUT_DIR = os.getenv("FIXED_OUT_DIR", r"C:\Users\kornkanok\Documents\Automation_api\Mizerp_api")
 
-SESSION = requests.Session()
+HTTP = get_client()  # session + pool กลาง (export / ดาวน์โหลด / LINE)
 
 # ---------- helpers ----------
 def iso_date(s: str) -> str:
@@ -58,17 +63,11 @@ def normalize_url(u: str) -> str:
         return u
     return urljoin(BASE_URL + "/", u.lstrip("/"))
 
-def ensure_dir(path: str):
-    os.makedirs(path, exist_ok=True)
-
 def sanitize_filename(name: str) -> str:
     for ch in '<>:"/\\|?*':
         name = name.replace(ch, "_")
     return name
 
-def backoff_sleep(attempt: int):
-    time.sleep(min(30, 2 ** attempt))  # 1,2,4,8,16,30
-
 def _dump_response(resp):
     os.makedirs("debug", exist_ok=True)
     ts = time.strftime("%Y%m%d_%H%M%S")
@@ -99,40 +98,24 @@ def post_export(from_date: str, to_date: str) -> dict:
     payload = {"fromDate": from_date, "toDate": to_date}
     headers = build_post_headers()
 
-    for attempt in range(6):
-        try:
-            resp = SESSION.post(
-                url, headers=headers, data=payload,
-                timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True
-            )
-            print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
-
-            if resp.status_code in (429, 502, 503, 504):
-                backoff_sleep(attempt); continue
-
-            if not (200 <= resp.status_code < 300):
-                dump_path = _dump_response(resp)
-                resp.raise_for_status()
-                raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
+    # retry 429/502/503/504 + network error อยู่ใน http_client (backoff 1,2,4,..,30s หรือ Retry-After)
+    # สั่ง export ซ้ำได้ผลเหมือนเดิม -> ขอ retry network error ของ POST นี้ด้วย
+    resp = HTTP.post(url, headers=headers, data=payload,
+                     timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True, retry_errors=True)
+    print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
 
-            return safe_json(resp)
+    if not (200 <= resp.status_code < 300):
+        dump_path = _dump_response(resp)
+        resp.raise_for_status()
+        raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
 
-        except requests.RequestException as e:
-            if attempt == 5:
-                raise
-            print(f"[warn] request failed: {e}; retry...", flush=True)
-            backoff_sleep(attempt)
+    return safe_json(resp)
 
-def download_file(file_url: str, dest_path: str):
+def download_file(file_url: str, dest_path: str) -> int:
+    # โหลดลง .part (ต่อจากเดิมได้) ตรวจครบแล้วค่อย rename เป็น dest_path
     url = normalize_url(file_url)
-    headers = build_get_headers()
-    with SESSION.get(url, stream=True, timeout=TIMEOUT,
-                     verify=VERIFY_TLS, headers=headers, allow_redirects=True) as r:
-        r.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    f.write(chunk)
+    return fetch_resumable(HTTP, url, dest_path, headers=build_get_headers(),
+                           timeout=TIMEOUT, verify=VERIFY_TLS)
 
 # ---------- date extraction from content / url ----------
 DATE_PATTERNS = [
@@ -207,6 +190,7 @@ def main():
         action="store_true",
         help="ถ้าระบุ จะพยายามรีเนมไฟล์ตามวันที่ที่พบในไฟล์/URL"
     )
+    add_export_args(parser, EXPORT)
 
     args = parser.parse_args()
 
@@ -225,40 +209,30 @@ def main():
         date_suffix = f"{from_date}_to_{to_date}"
 
     print(f"[info] Requesting export from {from_date} to {to_date} ...", flush=True)
-    data = post_export(from_date, to_date)
-
-    status = str(data.get("status", "")).lower()
-    message = data.get("message", "")
-    files = data.get("files", {}) or {}
-
-    print(f"[info] status={status} message={message}", flush=True)
-    if status != "success":
-        print("[error] API did not return success status.", flush=True)
-        print(json.dumps(data, indent=2, ensure_ascii=False), flush=True)
-        sys.exit(1)
-
     # โฟลเดอร์ปลายทาง: แยก subfolder ตามช่วงวันที่ที่สั่ง
     folder_name = f"{from_date}_to_{to_date}"
     out_root = args.out_dir
     out_dir = os.path.join(out_root, folder_name)
-    ensure_dir(out_dir)
 
     # ดาวน์โหลดไฟล์ แล้ว (ถ้าไม่ปิด) จะพยายามเปลี่ยนชื่อให้เป็นวันที่ที่อยู่ในไฟล์/URL
     downloaded = []
-    for key, link in files.items():
-        if not link:
-            print(f"[warn] missing link for key={key}, skip", flush=True)
-            continue
-
-        # ตั้งชื่อจากช่วงวันที่ที่สั่ง (ค่ามาตรฐานให้เหมือนกันทุกไฟล์)
-        fname = sanitize_filename(f"{key}_{date_suffix}.txt")
-        dest  = os.path.join(out_dir, fname)
+    try:
+        results = fetch_range(from_date, to_date, out_dir,
+                              lambda key: sanitize_filename(f"{key}_{date_suffix}.txt"),
+                              post_export, download_file, HEADER_ROWS,
+                              workers=args.download_workers, retries=EXPORT["download_retries"],
+                              span_days=args.split_days, concurrency=args.export_concurrency,
+                              cache=args.export_cache, cache_dir=EXPORT["cache_dir"],
+                              cache_ttl_hours=EXPORT["cache_ttl_hours"])
+    except (RuntimeError, requests.RequestException) as e:
+        print(f"[error] export failed: {e}", flush=True)
+        sys.exit(1)
 
-        print(f"[info] downloading {key} -> {dest}", flush=True)
-        try:
-            download_file(link, dest)
-        except requests.RequestException as e:
-            print(f"[error] download failed for {key}: {e}", flush=True)
+    # ดาวน์โหลดพร้อมกันหลายไฟล์ (retry รายไฟล์) แล้วค่อยรีเนมตามลำดับเดิม
+    for r in results:
+        key, link, dest = r["key"], r["url"], r["dest"]
+        if not r["ok"]:
+            print(f"[error] download failed for {key}: {r['error']}", flush=True)
             continue
 
         # ถ้าต้องการ “อนุญาต” ให้รีเนมตามวันที่ในไฟล์/URL ค่อยทำเมื่อใส่ --use-file-date เท่านั้น
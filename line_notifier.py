@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+ส่งข้อความ LINE (Messaging API) ไปหลายผู้รับพร้อมกัน
+- วางแผนผู้รับครั้งเดียว: user หลายคน -> multicast ก้อนละไม่เกิน 500, group/room/ผู้รับเดี่ยว -> push ทีละ id
+- ส่งพร้อมกัน (จำกัดจำนวน + จำกัดอัตราต่อ endpoint ตาม rate limit ของ LINE)
+- retry 429/5xx/network error ผ่าน http_client แค่ LINE_RETRIES ครั้ง รอไม่เกิน LINE_MAX_WAIT วินาที
+  (ผู้รับที่ช้าไม่ค้าง worker นาน ๆ — outbox ลองใหม่ให้เองภายหลัง) พร้อม X-Line-Retry-Key กันข้อความซ้ำ
+- คืนผลรายผู้รับ {id: {"ok", "status", "via", "error", "request_id"}}
+ตั้งค่าจาก .env: LINE_CONCURRENCY (ดีฟอลต์ 8)
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from http_client import get_client
+
+PUSH_URL = "https://api.line.me/v2/bot/message/push"
+MULTICAST_URL = "https://api.line.me/v2/bot/message/multicast"
+MULTICAST_MAX = 500
+# rate limit ของ LINE: push 2,000 req/s, multicast 200 req/s
+RATE_PER_SEC = {PUSH_URL: 2000, MULTICAST_URL: 200}
+# ส่งซ้ำได้ปลอดภัยเพราะมี X-Line-Retry-Key (LINE ตอบ 409 ถ้ารับไปแล้ว)
+LINE_RETRY_STATUS = (429, 500, 502, 503, 504)
+LINE_RETRIES = 3     # ครั้งต่อ delivery (รวมครั้งแรก)
+LINE_MAX_WAIT = 5    # วินาที: รอระหว่าง retry / Retry-After นานสุด
+
+def _obf(s: str) -> str:
+    s = s or ""
+    return f"{s[:3]}…{s[-4:]}" if len(s) > 8 else s
+
+# ---------- rate limit ----------
+class RateLimiter:
+    """เว้นระยะการเรียกให้ไม่เกิน rate ครั้ง/วินาที (ใช้ข้าม thread ได้)"""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+_limiters = {url: RateLimiter(rate) for url, rate in RATE_PER_SEC.items()}
+
+# ---------- plan ----------
+def _dedup(ids: Iterable[str]) -> List[str]:
+    seen, out = set(), []
+    for i in ids:
+        i = (i or "").strip()
+        if i and i not in seen:
+            seen.add(i)
+            out.append(i)
+    return out
+
+def plan_recipients(user_ids: Iterable[str] = (), group_ids: Iterable[str] = (),
+                    to_ids: Iterable[str] = ()) -> List[Dict]:
+    """
+    แผนการส่ง [{"url", "to"}] (ใส่ "retry_key" เพิ่มได้ ถ้าต้องการ key คงที่):
+    - to_ids (id เดี่ยวแบบเดิม อาจเป็น user หรือ group) และ group_ids -> push ทีละ id
+    - user_ids หลายคน -> multicast ก้อนละไม่เกิน 500 (multicast รับเฉพาะ user) / คนเดียว -> push
+    id ซ้ำกันส่งครั้งเดียว
+    """
+    singles = _dedup(list(to_ids) + list(group_ids))
+    users = [u for u in _dedup(user_ids) if u not in singles]
+    plan = [{"url": PUSH_URL, "to": i} for i in singles]
+    if len(users) == 1:
+        plan.append({"url": PUSH_URL, "to": users[0]})
+    else:
+        for i in range(0, len(users), MULTICAST_MAX):
+            plan.append({"url": MULTICAST_URL, "to": users[i:i + MULTICAST_MAX]})
+    return plan
+
+# ---------- send ----------
+def _deliver(item: Dict, headers: Dict, messages: List[Dict], timeout: float) -> Dict:
+    url, to = item["url"], item["to"]
+    # retry key เดียวกันทุกครั้งที่ส่งซ้ำของ delivery นี้ (outbox เก็บ key ไว้ใน item เพื่อใช้ซ้ำหลัง restart)
+    hdrs = dict(headers, **{"X-Line-Retry-Key": item.get("retry_key") or str(uuid.uuid4())})
+    _limiters[url].wait()
+    t0 = time.perf_counter()
+    try:
+        r = get_client().post(url, headers=hdrs, json={"to": to, "messages": messages},
+                              timeout=timeout, retry_status=LINE_RETRY_STATUS, retries=LINE_RETRIES,
+                              retry_errors=True, max_wait=LINE_MAX_WAIT)
+        ok = r.status_code == 200 or r.status_code == 409  # 409 = retry ที่ LINE รับไปแล้ว
+        res = {"ok": ok, "status": r.status_code, "error": None if ok else (r.text or "")[:300],
+               "request_id": r.headers.get("x-line-request-id")}
+    except requests.RequestException as e:
+        res = {"ok": False, "status": None, "error": str(e), "request_id": None}
+    res["via"] = "multicast" if url == MULTICAST_URL else "push"
+    res["seconds"] = time.perf_counter() - t0
+    return res
+
+def send_text(text: str, token: str, plan: List[Dict], concurrency: Optional[int] = None,
+              timeout: float = 20, verbose: bool = True) -> Dict[str, Dict]:
+    """
+    ส่ง text ตาม plan พร้อมกันไม่เกิน concurrency (ดีฟอลต์ LINE_CONCURRENCY)
+    คืนผลรายผู้รับ {id: {"ok", "status", "via", "error", "request_id", "seconds"}}
+    """
+    if not plan:
+        return {}
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    messages = [{"type": "text", "text": text}]
+    n = concurrency if concurrency is not None else int(os.getenv("LINE_CONCURRENCY", "8"))
+    n = max(1, min(n, len(plan)))
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        results = list(ex.map(lambda it: _deliver(it, headers, messages, timeout), plan))
+
+    report = {}
+    for item, res in zip(plan, results):
+        for rid in (item["to"] if isinstance(item["to"], list) else [item["to"]]):
+            report[rid] = res
+        if verbose:
+            to = item["to"]
+            who = f"{len(to)} users" if isinstance(to, list) else _obf(to)
+            mark = "ok" if res["ok"] else f"❌ {res['error']}"
+            print(f"[LINE] {res['via']} to={who} status={res['status']} {res['seconds']:.2f}s {mark}", flush=True)
+    return report
+
+def all_ok(report: Dict[str, Dict]) -> bool:
+    return bool(report) and all(r["ok"] for r in report.values())
+
+def notify(text: str, token: str, user_ids: Iterable[str] = (), group_ids: Iterable[str] = (),
+           to_ids: Iterable[str] = (), **kw) -> Dict[str, Dict]:
+    """plan_recipients + send_text (ไม่มี token หรือผู้รับ -> {})"""
+    if not token:
+        print("⚠️ LINE token ไม่ถูกตั้งค่า (.env: LINE_CHANNEL_ACCESS_TOKEN)")
+        return {}
+    plan = plan_recipients(user_ids, group_ids, to_ids)
+    if not plan:
+        print("⚠️ ไม่พบ LINE target (ตั้ง LINE_TO_ID/LINE_USER_ID(S) หรือ LINE_GROUP_IDS)")
+        return {}
+    return send_text(text, token, plan, **kw)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+คิวแจ้งเตือน LINE แบบเบื้องหลัง + outbox บนดิสก์
+- enqueue() เขียนข้อความลงไฟล์ JSON ใน outbox แล้วคืนทันที (ไม่รอ LINE)
+- thread dispatcher ส่งตามลำดับผ่าน line_notifier.send_text
+- ข้อความค้างใน outbox จนส่งครบทุกผู้รับ: process ตาย/เน็ตหลุด -> เปิดใหม่ก็ส่งต่อ
+- retry key ของแต่ละ delivery เก็บในไฟล์ ส่งซ้ำหลัง restart แล้ว LINE ตอบ 409 (ไม่ซ้ำ)
+- ผู้รับที่ error ถาวร (4xx) ถูกตัดทิ้ง, ส่งไม่สำเร็จเกิน max_attempts -> ย้ายไป dead/
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from line_notifier import plan_recipients, send_text
+
+RETRY_BASE = 5     # วินาที: 5, 10, 20, ... สูงสุด RETRY_MAX
+RETRY_MAX = 600
+IDLE_POLL = 30     # ตื่นมาตรวจ outbox อย่างน้อยทุกกี่วินาที
+DEAD_DIR = "dead"
+
+def _permanent(status: Optional[int]) -> bool:
+    """4xx ที่ส่งซ้ำไปก็ไม่สำเร็จ (ยกเว้น 429)"""
+    return status is not None and 400 <= status < 500 and status != 429
+
+class LineOutbox:
+    """
+    outbox = โฟลเดอร์ของไฟล์ <เวลา>-<id>.json หนึ่งไฟล์ต่อหนึ่งข้อความ
+    ใช้: ob = LineOutbox(dir, token); ob.start(); ob.enqueue(text, to_ids=[...]); ... ob.stop()
+    """
+    def __init__(self, root, token: str, max_attempts: int = 20, verbose: bool = True):
+        self.root = Path(root)
+        self.token = token
+        self.max_attempts = max(1, max_attempts)
+        self.verbose = verbose
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- ไฟล์ ----------
+    def _write(self, path: Path, msg: Dict):
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(msg, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def pending(self) -> List[Path]:
+        return sorted(self.root.glob("*.json")) if self.root.exists() else []
+
+    def enqueue(self, text: str, user_ids: Iterable[str] = (), group_ids: Iterable[str] = (),
+                to_ids: Iterable[str] = ()) -> Optional[str]:
+        """บันทึกข้อความลง outbox แล้วปลุก dispatcher คืน id (None ถ้าไม่มีผู้รับ)"""
+        plan = plan_recipients(user_ids, group_ids, to_ids)
+        if not plan:
+            print("⚠️ ไม่พบ LINE target (ตั้ง LINE_TO_ID/LINE_USER_ID(S) หรือ LINE_GROUP_IDS)")
+            return None
+        for item in plan:
+            item["retry_key"] = str(uuid.uuid4())
+        mid = uuid.uuid4().hex[:12]
+        msg = {"id": mid, "text": text, "plan": plan, "created": time.time(), "attempts": 0, "next_at": 0}
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._write(self.root / f"{time.time_ns()}-{mid}.json", msg)
+        with self._lock:
+            self._idle.clear()
+            self._wake.set()
+        return mid
+
+    # ---------- ส่ง ----------
+    def _send_one(self, path: Path, msg: Dict) -> Optional[float]:
+        """ส่งหนึ่งข้อความ คืนวินาทีจนถึงการลองใหม่ (None = เสร็จ/ย้ายไป dead แล้ว)"""
+        report = send_text(msg["text"], self.token, msg["plan"], verbose=self.verbose)
+        left = []
+        for item in msg["plan"]:
+            first = item["to"][0] if isinstance(item["to"], list) else item["to"]
+            res = report.get(first) or {}
+            if res.get("ok"):
+                continue
+            if _permanent(res.get("status")):
+                print(f"❌ [outbox] {msg['id']}: ผู้รับถูกปฏิเสธถาวร status={res.get('status')} -> ตัดทิ้ง", flush=True)
+                continue
+            left.append(item)
+
+        if not left:
+            path.unlink(missing_ok=True)
+            print(f"[outbox] ส่ง {msg['id']} ครบแล้ว", flush=True)
+            return None
+        msg["plan"] = left
+        msg["attempts"] += 1
+        if msg["attempts"] >= self.max_attempts:
+            dead = self.root / DEAD_DIR
+            dead.mkdir(exist_ok=True)
+            self._write(dead / path.name, msg)
+            path.unlink(missing_ok=True)
+            print(f"❌ [outbox] {msg['id']} ส่งไม่สำเร็จ {msg['attempts']} ครั้ง -> ย้ายไป {dead}", flush=True)
+            return None
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (msg["attempts"] - 1))
+        msg["next_at"] = time.time() + delay
+        self._write(path, msg)
+        print(f"[warn] [outbox] {msg['id']} ค้าง {len(left)} ปลายทาง; ลองใหม่ใน {delay}s", flush=True)
+        return delay
+
+    def drain(self) -> float:
+        """ส่งทุกข้อความที่ถึงเวลา คืนจำนวนวินาทีจนถึงข้อความถัดไป"""
+        if not self.token:
+            print("⚠️ LINE token ไม่ถูกตั้งค่า (.env: LINE_CHANNEL_ACCESS_TOKEN) : ข้อความค้างใน outbox")
+            return IDLE_POLL
+        wait = IDLE_POLL
+        for path in self.pending():
+            if self._stop.is_set():
+                break
+            try:
+                with open(path, encoding="utf-8") as f:
+                    msg = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[warn] [outbox] อ่าน {path.name} ไม่ได้: {e}", flush=True)
+                continue
+            due = msg.get("next_at", 0) - time.time()
+            if due > 0:
+                wait = min(wait, due)
+                continue
+            try:
+                retry = self._send_one(path, msg)
+                if retry is not None:
+                    wait = min(wait, retry)
+            except Exception as e:
+                print(f"❌ [outbox] ส่ง {path.name} ล้มเหลว: {e}", flush=True)
+                wait = min(wait, RETRY_BASE)
+        return wait
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            wait = self.drain()
+            with self._lock:
+                # รอบนี้ไม่มี enqueue ใหม่ -> ทุกข้อความที่ถึงเวลาถูกส่ง/เลื่อนไปแล้ว
+                if not self._wake.is_set():
+                    self._idle.set()
+            self._wake.wait(wait)
+
+    # ---------- lifecycle ----------
+    def start(self) -> "LineOutbox":
+        """เริ่ม thread dispatcher (ส่งข้อความค้างจากรอบก่อนด้วย)"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        left = len(self.pending())
+        if left:
+            print(f"[info] [outbox] มีข้อความค้าง {left} รายการใน {self.root}", flush=True)
+        self._thread = threading.Thread(target=self._run, name="line-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """รอจน dispatcher ส่งข้อความที่ถึงเวลาหมด (True = outbox ไม่มีข้อความที่ถึงเวลาแล้ว)"""
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def stop(self, flush_timeout: float = 10):
+        """รอส่งที่ค้างสักครู่ แล้วหยุด thread ข้อความที่ยังไม่ส่งอยู่ใน outbox รอรอบหน้า"""
+        if not self._thread:
+            return
+        if flush_timeout:
+            self.flush(flush_timeout)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(flush_timeout or None)
+        left = len(self.pending())
+        if left:
+            print(f"[info] [outbox] หยุด dispatcher: ค้าง {left} ข้อความ จะส่งต่อเมื่อเปิดใหม่", flush=True)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+cache ของ msrp map (code -> msrp) ที่ parse จาก MasterData แล้ว
+- เก็บเป็นไฟล์ binary ข้าง ๆ MasterData (หรือใน MSRP_CACHE_DIR)
+- key = path, mtime, size, ชื่อคอลัมน์ code/msrp, tag และ version ของ loader
+  (loader เปลี่ยนวิธี parse -> caller เพิ่ม version ให้ cache เก่าใช้ไม่ได้)
+- MasterData เปลี่ยนเมื่อไร cache จะถูกสร้างใหม่เองในรอบถัดไป
+"""
+import os
+import marshal
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+CACHE_MAGIC   = b"MSRPMAP1"
+CACHE_SUFFIX  = ".msrp.cache"
+
+# อ่าน .env ตอนเรียก (สคริปต์หลัก import โมดูลนี้ก่อน load_dotenv)
+def cache_enabled() -> bool:
+    return os.getenv("MSRP_CACHE", "true").lower() == "true"
+
+def cache_dir() -> Optional[str]:
+    return os.getenv("MSRP_CACHE_DIR") or None
+
+# ---------- path / key ----------
+def cache_path(master_path: Path, tag: str = "") -> Path:
+    """ไฟล์ cache ของ master_path (ชื่อ .<ไฟล์>[.tag].msrp.cache)"""
+    master_path = Path(master_path)
+    name = "." + master_path.name + (f".{tag}" if tag else "") + CACHE_SUFFIX
+    base = Path(cache_dir() or master_path.parent)
+    return base / name
+
+def cache_key(master_path: Path, code_col: str, msrp_col: str, tag: str = "", version: int = 0) -> tuple:
+    st = os.stat(master_path)
+    return (str(Path(master_path).resolve()), st.st_mtime_ns, st.st_size,
+            code_col.strip().lower(), msrp_col.strip().lower(), tag, version, marshal.version)
+
+# ---------- read / write ----------
+def read_cache(path: Path, key: tuple) -> Optional[Dict[str, float]]:
+    """คืน map ถ้าไฟล์ cache ตรง key (ไม่ตรง/เสีย -> None)"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            saved_key, data = marshal.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[warn] อ่าน msrp cache ไม่ได้ ({path.name}): {e}")
+        return None
+    if tuple(saved_key) != key or not isinstance(data, dict):
+        return None
+    return data
+
+def write_cache(path: Path, key: tuple, data: Dict[str, float]) -> bool:
+    """เขียน cache แบบ atomic (tmp -> replace) คืน False ถ้าเขียนไม่ได้"""
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(CACHE_MAGIC)
+            marshal.dump((key, dict(data)), f)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        print(f"[warn] เขียน msrp cache ไม่ได้ ({path}): {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+# ---------- main entry ----------
+def cached_msrp_map(master_path: Path, code_col: str, msrp_col: str,
+                    loader: Callable[[], Dict[str, float]], tag: str = "", version: int = 0) -> Dict[str, float]:
+    """
+    คืน msrp map จาก cache ถ้า MasterData ไม่เปลี่ยน ไม่งั้นเรียก loader() แล้วเก็บ cache ไว้
+    version = เวอร์ชันของ loader (เพิ่มเมื่อผลของ loader เปลี่ยนกับไฟล์เดิม)
+    ปิดได้ด้วย .env: MSRP_CACHE=false
+    """
+    if not cache_enabled():
+        return loader()
+    master_path = Path(master_path)
+    try:
+        key = cache_key(master_path, code_col, msrp_col, tag, version)
+    except OSError:
+        return loader()  # ให้ loader แจ้ง error เรื่องไฟล์เอง
+
+    cp = cache_path(master_path, tag)
+    data = read_cache(cp, key)
+    if data is not None:
+        print(f"[info] msrp cache hit: {cp.name} ({len(data)} items)")
+        return data
+
+    data = loader()
+    if write_cache(cp, key, data):
+        print(f"[info] msrp cache saved: {cp}")
+    return data
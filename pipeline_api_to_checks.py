@@ -5,13 +5,16 @@ import sys
 import json
 import time
 import re
-import csv
-from io import StringIO
 from datetime import datetime, timedelta
 from urllib.parse import urljoin
 import requests
 from dotenv import load_dotenv
 
+from sap_stream import SapReader, split_keyword_stream, match_docnums_stream
+from http_client import get_client
+from line_notifier import notify, all_ok
+from export_client import fetch_resumable, export_settings, add_export_args, fetch_range
+
 # ---------- env & config ----------
 load_dotenv()
 BASE_URL = os.getenv("BASE_URL", "https://mizerp.com").rstrip("/")
@@ -20,6 +23,7 @@ VERIFY_TLS = os.getenv("VERIFY_TLS", "true").lower() == "true"
 TIMEOUT = int(os.getenv("TIMEOUT_SECONDS", "60"))
 AUTH_HEADER_NAME = os.getenv("AUTH_HEADER_NAME") or None
 AUTH_HEADER_VALUE = os.getenv("AUTH_HEADER_VALUE") or None
+EXPORT = export_settings()   # DOWNLOAD_* / EXPORT_* จาก .env (ดู export_client.export_settings)
 
 # โฟลเดอร์ปลายทาง (แก้ได้ด้วย --out-dir)
 FIXED_OUT_DIR = os.getenv("FIXED_OUT_DIR", r"C:\Users\kornkanok\Documents\Automation_api\Mizerp_api")
@@ -33,7 +37,7 @@ CASE_INSENSITIVE = os.getenv("CASE_INSENSITIVE", "true").lower() == "true"
 LINE_CHANNEL_ACCESS_TOKEN = (os.getenv("LINE_CHANNEL_ACCESS_TOKEN") or "").strip()
 LINE_TO_ID = (os.getenv("LINE_TO_ID") or "").strip()
 
-SESSION = requests.Session()
+HTTP = get_client()  # session + pool กลาง (export / ดาวน์โหลด / LINE)
 
 # ---------- helpers ----------
 def iso_date(s: str) -> str:
@@ -78,9 +82,6 @@ def sanitize_filename(name: str) -> str:
         name = name.replace(ch, "_")
     return name
 
-def backoff_sleep(attempt: int):
-    time.sleep(min(30, 2 ** attempt))  # 1,2,4,8,16,30
-
 def _dump_response(resp):
     os.makedirs("debug", exist_ok=True)
     ts = time.strftime("%Y%m%d_%H%M%S")
@@ -111,40 +112,24 @@ def post_export(from_date: str, to_date: str) -> dict:
     payload = {"fromDate": from_date, "toDate": to_date}
     headers = build_post_headers()
 
-    for attempt in range(6):
-        try:
-            resp = SESSION.post(
-                url, headers=headers, data=payload,
-                timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True
-            )
-            print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
-
-            if resp.status_code in (429, 502, 503, 504):
-                backoff_sleep(attempt); continue
+    # retry 429/502/503/504 + network error อยู่ใน http_client (backoff 1,2,4,..,30s หรือ Retry-After)
+    # สั่ง export ซ้ำได้ผลเหมือนเดิม -> ขอ retry network error ของ POST นี้ด้วย
+    resp = HTTP.post(url, headers=headers, data=payload,
+                     timeout=TIMEOUT, verify=VERIFY_TLS, allow_redirects=True, retry_errors=True)
+    print(f"[debug] POST {resp.status_code} ct={resp.headers.get('Content-Type')} len={len(resp.content)}", flush=True)
 
-            if not (200 <= resp.status_code < 300):
-                dump_path = _dump_response(resp)
-                resp.raise_for_status()
-                raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
-
-            return safe_json(resp)
+    if not (200 <= resp.status_code < 300):
+        dump_path = _dump_response(resp)
+        resp.raise_for_status()
+        raise RuntimeError(f"HTTP {resp.status_code}; raw saved to {dump_path}")
 
-        except requests.RequestException as e:
-            if attempt == 5:
-                raise
-            print(f"[warn] request failed: {e}; retry...", flush=True)
-            backoff_sleep(attempt)
+    return safe_json(resp)
 
-def download_file(file_url: str, dest_path: str):
+def download_file(file_url: str, dest_path: str) -> int:
+    # โหลดลง .part (ต่อจากเดิมได้) ตรวจครบแล้วค่อย rename เป็น dest_path
     url = normalize_url(file_url)
-    headers = build_get_headers()
-    with SESSION.get(url, stream=True, timeout=TIMEOUT,
-                     verify=VERIFY_TLS, headers=headers, allow_redirects=True) as r:
-        r.raise_for_status()
-        with open(dest_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    f.write(chunk)
+    return fetch_resumable(HTTP, url, dest_path, headers=build_get_headers(),
+                           timeout=TIMEOUT, verify=VERIFY_TLS)
 
 # ---------- date extraction from content / url ----------
 DATE_PATTERNS = [
@@ -194,64 +179,12 @@ def detect_file_date(path: str, url: str, max_bytes: int = 256 * 1024) -> str:
     except Exception:
         return ""
 
-# ---------- CSV helpers for processing ----------
-def detect_dialect(sample_text: str):
-    sniffer = csv.Sniffer()
-    try:
-        return sniffer.sniff(sample_text, delimiters=[",", "\t", "|", ";"])
-    except Exception:
-        class Fallback(csv.Dialect):
-            delimiter = "\t"
-            quotechar = '"'
-            doublequote = True
-            skipinitialspace = False
-            lineterminator = "\n"
-            quoting = csv.QUOTE_MINIMAL
-        return Fallback
-
-def iter_rows(text: str, header_rows: int = 1):
-    lines = text.splitlines(keepends=True)
-    return lines[:header_rows], lines[header_rows:]
-
-def find_docnum_index(header_line: str, dialect):
-    reader = csv.reader(StringIO(header_line), dialect=dialect)
-    cols = next(reader)
-    lowered = [c.strip().lower() for c in cols]
-    for i, name in enumerate(lowered):
-        if name == "docnum":
-            return i
-    return None
-
-def get_field(line: str, idx, dialect):
-    reader = csv.reader(StringIO(line), dialect=dialect)
-    try:
-        row = next(reader)
-        if idx is None or idx >= len(row):
-            return None
-        return row[idx]
-    except Exception:
-        return None
-
 # ---------- LINE ----------
 def line_push(text: str) -> bool:
     if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_TO_ID:
         print("⚠️ LINE config ไม่ครบ (LINE_CHANNEL_ACCESS_TOKEN/LINE_TO_ID) : ข้ามการส่งแจ้งเตือน")
         return False
-    try:
-        resp = requests.post(
-            "https://api.line.me/v2/bot/message/push",
-            headers={"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-                     "Content-Type": "application/json"},
-            json={"to": LINE_TO_ID, "messages": [{"type": "text", "text": text}]},
-            timeout=20,
-        )
-        if resp.status_code == 200:
-            return True
-        print(f"⚠️ ส่ง LINE ไม่สำเร็จ: {resp.status_code} {resp.text}")
-        return False
-    except Exception as e:
-        print(f"❌ ส่ง LINE error: {e}")
-        return False
+    return all_ok(notify(text, LINE_CHANNEL_ACCESS_TOKEN, to_ids=[LINE_TO_ID]))
 
 # ---------- processing ----------
 def process_negative_and_match(folder: str):
@@ -277,72 +210,23 @@ def process_negative_and_match(folder: str):
     sap2_path = sorted(sap2_candidates)[0]
 
     # อ่าน sap1
-    with open(sap1_path, "r", encoding="utf-8-sig") as f:
-        src_text = f.read()
-    src_header, src_body = iter_rows(src_text, header_rows=HEADER_ROWS)
-
-    sample_for_sniff = "".join(src_header[-1:]) or "".join(src_body[:1])
-    src_dialect = detect_dialect(sample_for_sniff)
-    docnum_idx_src = find_docnum_index(src_header[-1], src_dialect)
-
-    lines_with_keyword = []
-    lines_without_keyword = []
-    docnums_found = {}
-    count_keyword = 0
-
-    for line in src_body:
-        target_line = line.lower() if CASE_INSENSITIVE else line
-        target_kw = KEYWORD.lower() if CASE_INSENSITIVE else KEYWORD
-        occ = target_line.count(target_kw)
-        if occ > 0:
-            lines_with_keyword.append(line)
-            count_keyword += occ
-            dv = get_field(line, docnum_idx_src, src_dialect)
-            dv = (dv or "").strip()
-            if dv:
-                docnums_found[dv] = True
-        else:
-            lines_without_keyword.append(line)
-
     minus_dir = os.path.join(folder_p, "minus_0")
     ensure_dir(minus_dir)
     out_with_keyword    = os.path.join(minus_dir, "sap1_only_negative.txt")
     out_without_keyword = os.path.join(minus_dir, "sap1_without_negative.txt")
 
-    with open(out_with_keyword, "w", encoding="utf-8") as f:
-        f.write("".join(src_header) + "".join(lines_with_keyword))
-    with open(out_without_keyword, "w", encoding="utf-8") as f:
-        f.write("".join(src_header) + "".join(lines_without_keyword))
-
-    # อ่าน sap2 + match
-    with open(sap2_path, "r", encoding="utf-8-sig") as f:
-        lookup_text = f.read()
-    lookup_header, lookup_body = iter_rows(lookup_text, header_rows=HEADER_ROWS)
-    sample_for_sniff2 = "".join(lookup_header[-1:]) or "".join(lookup_body[:1])
-    lookup_dialect = detect_dialect(sample_for_sniff2)
-    docnum_idx_lookup = find_docnum_index(lookup_header[-1], lookup_dialect)
-
-    lookup_matches = []
-    lookup_without_matches = []
-
-    if docnum_idx_lookup is None:
-        print("⚠️ ไม่พบคอลัมน์ DocNum ในไฟล์ sap2")
-    else:
-        targets = set(docnums_found.keys())
-        for line in lookup_body:
-            dv = get_field(line, docnum_idx_lookup, lookup_dialect)
-            dv = (dv or "").strip()
-            if dv in targets:
-                lookup_matches.append(line)
-            else:
-                lookup_without_matches.append(line)
+    # อ่าน sap1 ทีละบรรทัด แยก keyword และเก็บ DocNum ไปพร้อมกัน
+    with SapReader(sap1_path, header_rows=HEADER_ROWS) as rd:
+        res = split_keyword_stream(rd, out_with_keyword, out_without_keyword,
+                                   keyword=KEYWORD, case_insensitive=CASE_INSENSITIVE)
+    docnums_found = res["docnums"]
+    count_keyword = res["count_keyword"]
 
+    # อ่าน sap2 + match (ทีละ record)
     out_lookup_matches = os.path.join(minus_dir, "sap2_match_negative_docnums.txt")
     out_lookup_without = os.path.join(minus_dir, "sap2_without_negative_docnums.txt")
-    with open(out_lookup_matches, "w", encoding="utf-8") as f:
-        f.write("".join(lookup_header) + "".join(lookup_matches))
-    with open(out_lookup_without, "w", encoding="utf-8") as f:
-        f.write("".join(lookup_header) + "".join(lookup_without_matches))
+    with SapReader(sap2_path, header_rows=HEADER_ROWS) as rd:
+        match_docnums_stream(rd, out_lookup_matches, out_lookup_without, docnums_found)
 
     # สรุป/แจ้ง LINE ถ้าพบ
     summary = (
@@ -380,6 +264,7 @@ def main():
                         help="ถ้าระบุ จะพยายามรีเนมไฟล์ตามวันที่ที่พบในไฟล์/URL")
     parser.add_argument("--skip-process", action="store_true",
                         help="ไม่ต้องทำขั้นตอนตรวจ 'ส่วนลดติดลบ'/จับคู่ DocNum/แจ้ง LINE")
+    add_export_args(parser, EXPORT)
 
     args = parser.parse_args()
 
@@ -397,39 +282,30 @@ def main():
         date_suffix = f"{from_date}_to_{to_date}"
 
     print(f"[info] Requesting export from {from_date} to {to_date} ...", flush=True)
-    data = post_export(from_date, to_date)
-
-    status = str(data.get("status", "")).lower()
-    message = data.get("message", "")
-    files = data.get("files", {}) or {}
-
-    print(f"[info] status={status} message={message}", flush=True)
-    if status != "success":
-        print("[error] API did not return success status.", flush=True)
-        print(json.dumps(data, indent=2, ensure_ascii=False), flush=True)
-        sys.exit(1)
-
     # โฟลเดอร์ปลายทาง: แยก subfolder ตามช่วงวันที่ที่สั่ง
     folder_name = f"{from_date}_to_{to_date}"
     out_root = args.out_dir
     out_dir = os.path.join(out_root, folder_name)
-    ensure_dir(out_dir)
 
     # ดาวน์โหลดไฟล์ แล้ว (ถ้าไม่ปิด) จะพยายามเปลี่ยนชื่อให้เป็นวันที่ที่อยู่ในไฟล์/URL
     downloaded = []
-    for key, link in files.items():
-        if not link:
-            print(f"[warn] missing link for key={key}, skip", flush=True)
-            continue
-
-        fname = sanitize_filename(f"{key}_{date_suffix}.txt")
-        dest  = os.path.join(out_dir, fname)
+    try:
+        results = fetch_range(from_date, to_date, out_dir,
+                              lambda key: sanitize_filename(f"{key}_{date_suffix}.txt"),
+                              post_export, download_file, HEADER_ROWS,
+                              workers=args.download_workers, retries=EXPORT["download_retries"],
+                              span_days=args.split_days, concurrency=args.export_concurrency,
+                              cache=args.export_cache, cache_dir=EXPORT["cache_dir"],
+                              cache_ttl_hours=EXPORT["cache_ttl_hours"])
+    except (RuntimeError, requests.RequestException) as e:
+        print(f"[error] export failed: {e}", flush=True)
+        sys.exit(1)
 
-        print(f"[info] downloading {key} -> {dest}", flush=True)
-        try:
-            download_file(link, dest)
-        except requests.RequestException as e:
-            print(f"[error] download failed for {key}: {e}", flush=True)
+    # ดาวน์โหลดพร้อมกันหลายไฟล์ (retry รายไฟล์) แล้วค่อยรีเนมตามลำดับเดิม
+    for r in results:
+        key, link, dest = r["key"], r["url"], r["dest"]
+        if not r["ok"]:
+            print(f"[error] download failed for {key}: {r['error']}", flush=True)
             continue
 
         if args.use_file_date:
@@ -1,4 +1,5 @@
-import os, sys, time, threading, queue, posixpath, fnmatch
+import os, sys, time, threading, posixpath, fnmatch, sqlite3
+from collections import deque
 from pathlib import Path
 
 # ---- .env optional ----
@@ -12,6 +13,9 @@ import paramiko
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
 
+from file_stability import StabilityTracker
+from sftp_sync import sha256_file, remote_listing, needs_upload, mark_uploaded
+
 # ================== CONFIG (มีค่า default ใช้งานได้ทันที) ==================
 
 LOCAL_WATCH_DIR = os.getenv("LOCAL_WATCH_DIR", r"C:\Users\kornkanok\Documents\Mizerp_api")
@@ -30,42 +34,149 @@ SFTP_REMOTE_DIR = os.getenv(
     "/C:/Users/Administrator.WIN-LRO1J4IE0N1/Desktop/AR/2025/Test_api"
 )
 
+# จำนวน worker อัปโหลดพร้อมกัน (แต่ละตัวมี SSH connection ของตัวเอง)
+SFTP_WORKERS = max(1, int(os.getenv("SFTP_WORKERS", "4")))
+UPLOAD_RETRIES = max(1, int(os.getenv("UPLOAD_RETRIES", "3")))  # connection หลุดระหว่างอัปโหลด -> ต่อใหม่แล้วลองซ้ำ
+# sync mode: เทียบกับปลายทาง (listdir_attr ต่อโฟลเดอร์ เก็บไว้ SFTP_LIST_TTL วินาที) อัปโหลดเฉพาะที่ต่าง
+SFTP_SYNC = (os.getenv("SFTP_SYNC", "false").lower() == "true")
+SFTP_SYNC_HASH = (os.getenv("SFTP_SYNC_HASH", "false").lower() == "true")  # + sidecar <file>.sha256
+SFTP_LIST_TTL = float(os.getenv("SFTP_LIST_TTL", "60"))
+
 STABLE_CHECKS = int(os.getenv("STABLE_CHECKS", "3"))
 STABLE_INTERVAL = float(os.getenv("STABLE_INTERVAL", "1.0"))
+# ไฟล์ไม่มี event มากี่วินาทีจึงถือว่าเขียนเสร็จ (ดีฟอลต์ = STABLE_CHECKS x STABLE_INTERVAL แบบเดิม)
+STABLE_QUIET_S = float(os.getenv("STABLE_QUIET_S") or STABLE_CHECKS * STABLE_INTERVAL)
+# ยังเปลี่ยนอยู่เกินเวลานี้ -> ข้าม (event ถัดไปของไฟล์จะเริ่มนับใหม่)
+STABLE_MAX_WAIT_S = float(os.getenv("STABLE_MAX_WAIT_S") or STABLE_CHECKS * 10 * STABLE_INTERVAL)
+
+# บันทึกไฟล์ที่อัปโหลดสำเร็จแล้ว (path/size/mtime/sha256/remote) เปิดใหม่ไม่ต้องอัปโหลดซ้ำ
+UPLOAD_LEDGER = os.getenv("UPLOAD_LEDGER", str(Path(__file__).resolve().parent / ".upload_ledger.sqlite3"))
 
 # ============================================================================
 
 def log(*a): print(*a, flush=True)
 def to_posix(p: str) -> str: return p.replace("\\", "/")
 
-def wait_file_stable(path: str, checks=3, interval=1.0) -> bool:
-    """รอจนไฟล์นิ่ง (ขนาดไม่เปลี่ยน) ติดต่อกัน 'checks' ครั้ง"""
-    prev = -1
-    ok = 0
-    for _ in range(checks * 10):
-        if not os.path.exists(path):
-            time.sleep(interval)
-            continue
-        try:
-            size = os.path.getsize(path)
-        except OSError:
-            time.sleep(interval)
-            continue
-        if size == prev and size >= 0:
-            ok += 1
-            if ok >= checks:
-                return True
-        else:
-            ok = 0
-            prev = size
-        time.sleep(interval)
-    return False
+class UploadQueue:
+    """
+    คิวอัปโหลดที่รวม event: หนึ่ง path มีรายการรอได้รายการเดียว (ล่าสุดชนะ)
+    - path ที่กำลังอัปโหลดอยู่จะไม่ถูกหยิบซ้ำจนกว่าจะ done()
+    - นับ event / การอัปโหลดที่ถูกตัดทิ้ง แล้วสรุปเมื่อคิวว่าง
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._order = deque()
+        self._pending = {}      # path -> เหตุผลล่าสุดที่เข้าคิว
+        self._inflight = set()
+        self.stats = {"events": 0, "queued": 0, "coalesced": 0, "unchanged": 0, "uploaded": 0}
+
+    def note_event(self):
+        with self._cond:
+            self.stats["events"] += 1
+
+    def put(self, path: str, reason: str = "stable"):
+        path = os.path.abspath(path)
+        with self._cond:
+            if path in self._pending:
+                self.stats["coalesced"] += 1
+            else:
+                self._order.append(path)
+                self.stats["queued"] += 1
+            self._pending[path] = reason
+            self._cond.notify()
+
+    def get(self) -> str:
+        """รอจนมี path ที่ไม่มีใครกำลังอัปโหลดอยู่"""
+        with self._cond:
+            while True:
+                for path in self._order:
+                    if path not in self._inflight:
+                        self._order.remove(path)
+                        del self._pending[path]
+                        self._inflight.add(path)
+                        return path
+                self._cond.wait()
+
+    def note_unchanged(self):
+        """ไฟล์ตรงกับที่อัปโหลดไปแล้ว (ตาม ledger) -> นับเป็นการอัปโหลดที่ตัดทิ้ง"""
+        with self._cond:
+            self.stats["unchanged"] += 1
+
+    def done(self, path: str, uploaded: bool = False):
+        with self._cond:
+            self._inflight.discard(path)
+            if uploaded:
+                self.stats["uploaded"] += 1
+            idle = not self._order and not self._inflight
+            self._cond.notify_all()
+        if idle:
+            log(f"[info] queue idle: {self.summary()}")
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"events={s['events']} uploads={s['uploaded']} "
+                f"suppressed={s['coalesced'] + s['unchanged']} "
+                f"(coalesced={s['coalesced']} unchanged={s['unchanged']})")
+
+class UploadLedger:
+    """
+    ledger (SQLite) ของไฟล์ที่ put_atomic สำเร็จ: path, size, mtime, sha256, remote
+    - is_current: size+mtime+remote ตรง -> ไม่ต้องอ่านไฟล์เลย
+    - same_content: mtime เปลี่ยนแต่ sha256 เดิม (เช่นเซฟทับด้วยเนื้อหาเดิม) -> อัปเดต mtime แล้วข้าม
+    ใช้ร่วมกันหลาย thread (connection เดียว + lock)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS uploads ("
+                             "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                             "sha256 TEXT, remote TEXT, uploaded_at REAL)")
+
+    def get(self, path: str):
+        with self._lock:
+            return self._db.execute("SELECT size, mtime_ns, sha256, remote FROM uploads WHERE path = ?",
+                                    (path,)).fetchone()
+
+    def is_current(self, path: str, st: os.stat_result, remote: str) -> bool:
+        row = self.get(path)
+        return bool(row) and row[0] == st.st_size and row[1] == st.st_mtime_ns and row[3] == remote
+
+    def same_content(self, path: str, st: os.stat_result, digest: str, remote: str) -> bool:
+        row = self.get(path)
+        if not row or row[2] != digest or row[3] != remote:
+            return False
+        with self._lock, self._db:
+            self._db.execute("UPDATE uploads SET size = ?, mtime_ns = ? WHERE path = ?",
+                             (st.st_size, st.st_mtime_ns, path))
+        return True
+
+    def record(self, path: str, st: os.stat_result, digest: str, remote: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                             (path, st.st_size, st.st_mtime_ns, digest, remote, time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 class SFTPManager:
     def __init__(self):
         self.client = None
         self.sftp = None
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
+        self._listings = {}  # remote_dir -> (เวลาที่ list, {ชื่อ: attrs}) สำหรับ sync mode
+        self._known_dirs = set()  # โฟลเดอร์ปลายทางที่รู้แล้วว่ามีอยู่ (ของ session นี้)
+
+    def alive(self) -> bool:
+        t = self.client.get_transport() if self.client else None
+        return bool(self.sftp and t and t.is_active())
 
     def _load_pkey(self):
         if not SFTP_KEY_PATH:
@@ -79,8 +190,10 @@ class SFTPManager:
 
     def connect(self):
         with self.lock:
-            if self.sftp:
+            if self.alive():
                 return
+            if self.sftp or self.client:
+                self.close()  # session เดิมหลุดไปแล้ว
             client = paramiko.SSHClient()
             client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             pkey = self._load_pkey()
@@ -113,14 +226,32 @@ class SFTPManager:
             finally:
                 self.sftp = None
                 self.client = None
+                self._listings.clear()
+                self._known_dirs.clear()
 
     def mkdirs(self, remote_dir: str):
+        """สร้างโฟลเดอร์ปลายทางที่ยังไม่มี (โฟลเดอร์ที่รู้แล้วว่ามี ไม่ stat ซ้ำใน session นี้)"""
         parts = [p for p in remote_dir.strip("/").split("/") if p]
+        chain = []
         cur = ""
         for part in parts:
             cur = "/" + part if not cur else posixpath.join(cur, part)
+            chain.append((part, cur))
+        if not chain or chain[-1][1] in self._known_dirs:
+            return
+        # ปกติโฟลเดอร์มีอยู่แล้ว: stat ชั้นล่างสุดครั้งเดียวแทนทีละชั้น
+        try:
+            self.sftp.stat(chain[-1][1])
+            self._known_dirs.update(c for _, c in chain)
+            return
+        except IOError:
+            pass
+        for part, cur in chain:
+            if cur in self._known_dirs:
+                continue
             try:
                 self.sftp.stat(cur)
+                self._known_dirs.add(cur)
                 continue
             except IOError:
                 # ข้าม drive root เช่น /C:
@@ -134,23 +265,57 @@ class SFTPManager:
                         self.sftp.stat(cur)
                     except IOError as e:
                         raise
-
-    def put_atomic(self, local_path: str, remote_path: str):
-        """อัปโหลดแบบ atomic: put เป็น .part แล้ว rename เป็นชื่อจริง"""
+                self._known_dirs.add(cur)
+
+    def listing(self, remote_dir: str) -> dict:
+        """listdir_attr ของโฟลเดอร์ปลายทาง (cache SFTP_LIST_TTL วินาทีต่อ session)"""
+        hit = self._listings.get(remote_dir)
+        if hit and time.monotonic() - hit[0] < SFTP_LIST_TTL:
+            return hit[1]
+        names = remote_listing(self.sftp, remote_dir)
+        self._listings[remote_dir] = (time.monotonic(), names)
+        return names
+
+    def put_atomic(self, local_path: str, remote_path: str, sync: bool = False,
+                   use_hash: bool = False, digest: str = None) -> bool:
+        """
+        อัปโหลดแบบ atomic: put เป็น .part แล้ว rename เป็นชื่อจริง
+        sync=True: ปลายทางมีไฟล์เดียวกันอยู่แล้ว -> ไม่อัปโหลด คืน False
+        """
         remote_dir = posixpath.dirname(remote_path)
         self.mkdirs(remote_dir)
+        if sync:
+            listing = self.listing(remote_dir)
+            todo, why = needs_upload(self.sftp, local_path, remote_path, listing, use_hash=use_hash, digest=digest)
+            if not todo:
+                log(f"[info] remote identical ({why}), skip: {remote_path}")
+                return False
         tmp_path = remote_path + ".part"
-        self.sftp.put(local_path, tmp_path)
         try:
-            self.sftp.remove(remote_path)
+            self.sftp.put(local_path, tmp_path)
+            try:
+                self.sftp.remove(remote_path)
+            except IOError:
+                pass
+            self.sftp.rename(tmp_path, remote_path)
         except IOError:
-            pass
-        self.sftp.rename(tmp_path, remote_path)
+            # โฟลเดอร์อาจถูกลบจากฝั่ง server -> ล้าง cache ให้ mkdirs ตรวจใหม่รอบหน้า
+            self._known_dirs.clear()
+            raise
+        if sync:
+            mark_uploaded(self.sftp, local_path, remote_path, use_hash=use_hash, digest=digest)
+            try:
+                listing[posixpath.basename(remote_path)] = self.sftp.stat(remote_path)
+            except IOError:
+                self._listings.pop(remote_dir, None)
+        return True
 
 class UploadWorker(threading.Thread):
-    def __init__(self, q: queue.Queue, sftp_mgr: SFTPManager, base_local: str, base_remote: str, preserve: bool):
-        super().__init__(daemon=True)
+    def __init__(self, q: UploadQueue, sftp_mgr: SFTPManager, base_local: str, base_remote: str, preserve: bool,
+                 ledger: UploadLedger, name: str = "sftp"):
+        super().__init__(daemon=True, name=name)
         self.q = q
+        self.ledger = ledger
         self.sftp = sftp_mgr
         self.base_local = os.path.abspath(base_local)
         self.base_remote = base_remote.rstrip("/")
@@ -159,41 +324,77 @@ class UploadWorker(threading.Thread):
     def run(self):
         while True:
             path = self.q.get()
+            uploaded = False
             try:
-                self.process(path)
+                uploaded = self.process(path)
             except Exception as e:
-                log(f"[error] upload failed for {path}: {e}")
+                log(f"[error] [{self.name}] upload failed for {path}: {e}")
             finally:
-                self.q.task_done()
-
-    def process(self, local_path: str):
-        if not os.path.isfile(local_path):
-            return
-        log(f"[debug] event for: {local_path}")
-        if not wait_file_stable(local_path, STABLE_CHECKS, STABLE_INTERVAL):
-            log(f"[warn] file not stable, skip: {local_path}")
-            return
+                self.q.done(path, uploaded=uploaded)
 
+    def remote_for(self, local_path: str) -> str:
         if self.preserve:
             rel = os.path.relpath(local_path, self.base_local)
             rel_posix = to_posix(rel)
-            remote_path = posixpath.join(self.base_remote, rel_posix)
-        else:
-            fname = os.path.basename(local_path)
-            remote_path = posixpath.join(self.base_remote, fname)
+            return posixpath.join(self.base_remote, rel_posix)
+        fname = os.path.basename(local_path)
+        return posixpath.join(self.base_remote, fname)
 
-        log(f"[info] uploading -> {remote_path}")
-        self.sftp.connect()
-        self.sftp.put_atomic(local_path, remote_path)
-        log(f"[info] done: {remote_path}")
+    def process(self, local_path: str) -> bool:
+        """อัปโหลดหนึ่งไฟล์ (False = ข้าม เพราะไม่มีไฟล์/อัปโหลดเนื้อหานี้ไปแล้ว)"""
+        # ไฟล์ในคิวผ่าน StabilityTracker มาแล้ว (นิ่งแล้ว)
+        if not os.path.isfile(local_path):
+            return False
+        st = os.stat(local_path)
+        remote_path = self.remote_for(local_path)
+        if self.ledger.is_current(local_path, st, remote_path):
+            self.q.note_unchanged()
+            log(f"[info] already uploaded, skip: {local_path}")
+            return False
+        digest = sha256_file(local_path)
+        if self.ledger.same_content(local_path, st, digest, remote_path):
+            self.q.note_unchanged()
+            log(f"[info] unchanged since last upload, skip: {local_path}")
+            return False
+
+        size = st.st_size
+        log(f"[info] [{self.name}] uploading -> {remote_path}")
+        t0 = time.perf_counter()
+        for attempt in range(UPLOAD_RETRIES):
+            try:
+                self.sftp.connect()
+                sent = self.sftp.put_atomic(local_path, remote_path, sync=SFTP_SYNC,
+                                            use_hash=SFTP_SYNC_HASH, digest=digest)
+                break
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                if attempt == UPLOAD_RETRIES - 1:
+                    raise
+                wait = min(30, 2 ** attempt)
+                log(f"[warn] [{self.name}] {e}; reconnect แล้วลองใหม่ใน {wait}s")
+                self.sftp.close()
+                time.sleep(wait)
+        if not sent:
+            # ปลายทางมีไฟล์นี้อยู่แล้ว: บันทึก ledger ไว้ รอบหน้าไม่ต้องถามปลายทางอีก
+            self.ledger.record(local_path, st, digest, remote_path)
+            self.q.note_unchanged()
+            return False
+        sec = time.perf_counter() - t0
+        mbps = size / (1024 * 1024) / sec if sec > 0 else 0.0
+        log(f"[info] [{self.name}] done: {remote_path} ({size / (1024 * 1024):.1f} MB in {sec:.1f}s, {mbps:.2f} MB/s)")
+        self.ledger.record(local_path, st, digest, remote_path)
+        return True
 
 class Handler(PatternMatchingEventHandler):
-    def __init__(self, patterns, q):
+    """ส่ง event ให้ tracker ไฟล์เข้าคิวอัปโหลดเมื่อนิ่งแล้วเท่านั้น (หลาย event ต่อไฟล์ -> รวมเป็นครั้งเดียว)"""
+    def __init__(self, patterns, tracker: StabilityTracker, q: UploadQueue):
         super().__init__(patterns=patterns, ignore_directories=True, case_sensitive=False)
+        self.tracker = tracker
         self.q = q
-    def on_created(self, e): log(f"[evt] created : {e.src_path}"); self.q.put(os.path.abspath(e.src_path))
-    def on_modified(self, e): log(f"[evt] modified: {e.src_path}"); self.q.put(os.path.abspath(e.src_path))
-    def on_moved(self, e): log(f"[evt] moved   : {e.dest_path}"); self.q.put(os.path.abspath(e.dest_path))
+    def _touch(self, path, closed=False): self.q.note_event(); self.tracker.touch(path, closed=closed)
+    def on_created(self, e): log(f"[evt] created : {e.src_path}"); self._touch(e.src_path)
+    def on_modified(self, e): log(f"[evt] modified: {e.src_path}"); self._touch(e.src_path)
+    def on_moved(self, e): log(f"[evt] moved   : {e.dest_path}"); self._touch(e.dest_path)
+    def on_closed(self, e): self._touch(e.src_path, closed=True)
 
 def _matches_patterns(filename: str) -> bool:
     name = filename.lower()
@@ -216,6 +417,7 @@ def main():
     log(f"[info] Preserve : {PRESERVE_SUBDIR}")
     log(f"[info] SFTP     : {SFTP_USER}@{SFTP_HOST}:{SFTP_PORT}")
     log(f"[info] Remote   : {SFTP_REMOTE_DIR}")
+    log(f"[info] Sync     : {SFTP_SYNC} (hash sidecar: {SFTP_SYNC_HASH})")
 
     # Self-check: เชื่อมต่อ + สร้างโฟลเดอร์ปลายทางฐาน
     try:
@@ -228,21 +430,45 @@ def main():
         log(f"[error] SFTP self-check failed: {e}")
         sys.exit(1)
 
-    q = queue.Queue()
-    sftp_mgr = SFTPManager()
-    worker = UploadWorker(q, sftp_mgr, base_dir, SFTP_REMOTE_DIR, PRESERVE_SUBDIR)
-    worker.start()
-
-    # คิวไฟล์ที่มีอยู่แล้วในโฟลเดอร์ (และย่อย) ให้ส่งทันที
+    ledger = UploadLedger(UPLOAD_LEDGER)
+    log(f"[info] Ledger   : {UPLOAD_LEDGER} ({len(ledger)} files)")
+    q = UploadQueue()
+    workers = [UploadWorker(q, SFTPManager(), base_dir, SFTP_REMOTE_DIR, PRESERVE_SUBDIR, ledger, name=f"sftp-{i + 1}")
+               for i in range(SFTP_WORKERS)]
+    for w in workers:
+        w.start()
+    log(f"[info] Workers  : {SFTP_WORKERS} SFTP sessions")
+
+    def _stable(path):
+        log(f"[debug] stable: {path}")
+        q.put(path)
+    def _unstable(path):
+        log(f"[warn] file not stable after {STABLE_MAX_WAIT_S:.0f}s, skip: {path}")
+    tracker = StabilityTracker(quiet=STABLE_QUIET_S, on_stable=_stable,
+                               max_wait=STABLE_MAX_WAIT_S, on_timeout=_unstable).start()
+
+    # ไฟล์ที่มีอยู่แล้วในโฟลเดอร์ (และย่อย): ข้ามที่ ledger บอกว่าอัปโหลดแล้ว (size/mtime เดิม)
+    # ที่เหลือส่งเมื่อนิ่ง (อาจมีไฟล์ที่กำลังเขียนค้างอยู่)
+    queued = skipped = 0
     for root, _, files in os.walk(base_dir):
         for fn in files:
-            if _matches_patterns(fn):
-                q.put(os.path.abspath(os.path.join(root, fn)))
-    log("[info] queued existing files (if any).")
+            if not _matches_patterns(fn):
+                continue
+            path = os.path.abspath(os.path.join(root, fn))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if ledger.is_current(path, st, workers[0].remote_for(path)):
+                skipped += 1
+                continue
+            tracker.touch(path)
+            queued += 1
+    log(f"[info] existing files: queued {queued}, already uploaded {skipped}.")
     log("[info] --- ready; drop a file to test ---")
 
     observer = Observer()
-    observer.schedule(Handler(WATCH_PATTERNS, q), base_dir, recursive=True)
+    observer.schedule(Handler(WATCH_PATTERNS, tracker, q), base_dir, recursive=True)
     observer.start()
 
     try:
@@ -253,7 +479,11 @@ def main():
     finally:
         observer.stop()
         observer.join()
-        sftp_mgr.close()
+        tracker.stop()
+        for w in workers:
+            w.sftp.close()
+        ledger.close()
+        log(f"[info] {q.summary()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+"""
+ตัวช่วยอ่าน/เขียนไฟล์ export ของ sap แบบ streaming
+- อ่านทีละบรรทัด ไม่โหลดทั้งไฟล์เป็น string ก้อนเดียว
+- เขียนผลลัพธ์ผ่าน buffer ไปพร้อมกับการอ่าน หน่วยความจำคงที่ไม่ขึ้นกับขนาดไฟล์
+"""
+import io
+import os
+import re
+import csv
+import mmap
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Callable, Dict, Iterator, Tuple
+
+WRITE_BUFFER = 1024 * 1024  # 1MB ต่อไฟล์ผลลัพธ์
+SCAN_BLOCK = 8 * 1024 * 1024        # ขนาด block ตอนหาจุดตัด chunk
+MIN_CHUNK_BYTES = 4 * 1024 * 1024   # chunk เล็กกว่านี้ไม่คุ้มส่งข้าม process
+ASCII_SPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"  # อักขระ ASCII ที่ str.strip() ตัดออก
+
+def use_mmap() -> bool:
+    """SAP_MMAP=false ปิดทาง mmap (อ่านตอนเรียก เพราะ .env ถูกโหลดหลัง import)"""
+    return os.getenv("SAP_MMAP", "true").lower() == "true"
+
+# ---------- CSV helpers ----------
+def detect_dialect(sample_text: str):
+    sniffer = csv.Sniffer()
+    try:
+        return sniffer.sniff(sample_text, delimiters=[",", "\t", "|", ";"])
+    except Exception:
+        class Fallback(csv.Dialect):
+            delimiter = "\t"
+            quotechar = '"'
+            doublequote = True
+            skipinitialspace = False
+            lineterminator = "\n"
+            quoting = csv.QUOTE_MINIMAL
+        return Fallback
+
+# ---------- row parsing ----------
+class _LineTap:
+    """iterator ที่จำบรรทัดดิบที่ csv.reader ดึงไป (field ใน quote อาจกินหลายบรรทัด)"""
+    def __init__(self, lines):
+        self._it = iter(lines)
+        self.buf: List[str] = []
+        self.pending: Optional[str] = None  # บรรทัดที่อ่านมาแล้วแต่ให้ csv.reader ใช้ก่อน
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pending is not None:
+            line, self.pending = self.pending, None
+        else:
+            line = next(self._it)
+        self.buf.append(line)
+        return line
+
+def iter_records(lines, dialect) -> Iterator[Tuple[str, List[str]]]:
+    """
+    ใช้ csv.reader ตัวเดียว parse ทั้ง body แล้วคืน (raw, row) ทีละ record
+    - raw: ข้อความดิบของ record (ไว้เขียนต่อแบบไม่แตะต้อง)
+    - row: field ที่ parse แล้ว (บรรทัดที่ parse ไม่ได้จะได้ [])
+    """
+    tap = _LineTap(lines)
+    rdr = csv.reader(tap, dialect=dialect)
+    buf = tap.buf
+    while True:
+        try:
+            row = next(rdr)
+        except StopIteration:
+            break
+        except csv.Error:
+            row = []
+        raw = buf[0] if len(buf) == 1 else "".join(buf)
+        buf.clear()
+        yield raw, row
+
+def iter_field(lines, dialect, idx: Optional[int]) -> Iterator[Tuple[str, str]]:
+    """
+    วน body แล้วคืน (raw, ค่า field ที่ idx แบบ strip แล้ว) ทีละ record
+    - บรรทัดที่ไม่มี quotechar/escapechar: ตัดด้วย delimiter ตรง ๆ ไม่ผ่าน csv
+    - บรรทัดที่มี: ส่งให้ csv.reader (อาจกินหลายบรรทัดถ้ามี newline ใน quote)
+    ผลลัพธ์เท่ากับ cell(row, idx) ของ iter_records
+    """
+    delim = dialect.delimiter
+    q, esc = dialect.quotechar, dialect.escapechar
+    tap = _LineTap(lines)
+    rdr = csv.reader(tap, dialect=dialect)
+    buf = tap.buf
+    cut = -1 if idx is None else idx + 1
+    for line in tap._it:
+        if (not q or q not in line) and (not esc or esc not in line):
+            if cut < 0:
+                yield line, ""
+                continue
+            parts = line.split(delim, cut)
+            yield line, (parts[idx].strip() if idx < len(parts) else "")
+            continue
+        tap.pending = line
+        try:
+            row = next(rdr)
+        except csv.Error:
+            row = []
+        raw = buf[0] if len(buf) == 1 else "".join(buf)
+        buf.clear()
+        yield raw, cell(row, idx)
+
+def cell(row: List[str], idx: Optional[int]) -> str:
+    """คืนค่า field ที่ strip แล้ว ("" ถ้าไม่มีคอลัมน์นั้น)"""
+    if idx is None or idx >= len(row):
+        return ""
+    return row[idx].strip()
+
+def open_out(path):
+    """เปิดไฟล์ผลลัพธ์ utf-8 พร้อม buffer ขนาดใหญ่"""
+    return open(path, "w", encoding="utf-8", buffering=WRITE_BUFFER)
+
+# ---------- reader ----------
+class SapReader:
+    """
+    เปิดไฟล์ sap (utf-8-sig) อ่านหัวตาราง header_rows บรรทัด แล้วเดา dialect จากหัวแถวสุดท้าย
+    วน `for line in reader` เพื่ออ่าน body ทีละบรรทัด (คง newline เดิมไว้)
+    """
+    def __init__(self, path, header_rows: int = 2):
+        self.path = Path(path)
+        self.header_rows = header_rows
+        self.header: List[str] = []
+        self.columns: List[str] = []
+        self.dialect = None
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "r", encoding="utf-8-sig")
+        for _ in range(self.header_rows):
+            line = self._f.readline()
+            if not line:
+                break
+            self.header.append(line)
+        sample = self.header[-1] if self.header else ""
+        self.dialect = detect_dialect(sample)
+        if self.header:
+            self.columns = next(csv.reader(StringIO(self.header[-1]), dialect=self.dialect), [])
+        return self
+
+    def __exit__(self, *exc):
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def records(self) -> Iterator[Tuple[str, List[str]]]:
+        """วน body เป็น (raw, row) ด้วย csv.reader ตัวเดียว"""
+        return iter_records(self, self.dialect)
+
+    def iter_field(self, idx: Optional[int]) -> Iterator[Tuple[str, str]]:
+        """วน body เป็น (raw, ค่า field ที่ idx) ด้วย fast path (ดู iter_field)"""
+        return iter_field(self, self.dialect, idx)
+
+    def index(self, *names) -> Optional[int]:
+        """หา index คอลัมน์แบบไม่สนตัวพิมพ์ (คืนชื่อแรกที่เจอ)"""
+        colmap = {c.strip().lower(): i for i, c in enumerate(self.columns)}
+        for name in names:
+            i = colmap.get(name.lower())
+            if i is not None:
+                return i
+        return None
+
+# ---------- sap1 keyword split ----------
+def split_keyword_stream(reader: SapReader, out_with, out_without, keyword: str,
+                         case_insensitive: bool = True,
+                         transform: Optional[Callable[[str, List[str]], str]] = None) -> Dict:
+    """
+    แยก body ของ reader เป็นบรรทัดที่มี keyword / ไม่มี keyword แล้วเขียนลงสองไฟล์ไปพร้อมกัน
+    - เก็บ DocNum ของบรรทัดที่มี keyword ระหว่างอ่าน
+    - transform(line, row) (ถ้ามี) ใช้แปลงบรรทัดก่อนเขียน
+    - ไม่มี transform: ดึง DocNum ด้วย fast path ไม่ต้อง parse ทั้งแถว
+    """
+    kw = keyword.lower() if case_insensitive else keyword
+    doc_idx = reader.index("docnum")
+    docnums = {}
+    cnt = n_with = n_without = 0
+
+    with open_out(out_with) as fw, open_out(out_without) as fo:
+        fw.writelines(reader.header)
+        fo.writelines(reader.header)
+        if transform:
+            recs = ((line, cell(row, doc_idx), transform(line, row)) for line, row in reader.records())
+        else:
+            recs = ((line, dv, line) for line, dv in reader.iter_field(doc_idx))
+        for line, dv, out in recs:
+            tgt = line.lower() if case_insensitive else line
+            occ = tgt.count(kw)
+            if occ > 0:
+                fw.write(out)
+                cnt += occ; n_with += 1
+                if dv:
+                    docnums[dv] = True
+            else:
+                fo.write(out)
+                n_without += 1
+
+    return {"docnums": docnums, "count_keyword": cnt,
+            "rows_with": n_with, "rows_without": n_without}
+
+# ---------- sap2 DocNum match ----------
+def match_docnums_stream(reader: SapReader, out_match, out_other, docnums) -> Dict:
+    """
+    แยก body ของ reader ตาม DocNum: อยู่ใน docnums -> out_match, ที่เหลือ -> out_other
+    (ถ้าไม่มีคอลัมน์ DocNum ทุกแถวจะไปอยู่ out_other)
+    """
+    doc_idx = reader.index("docnum")
+    if doc_idx is None:
+        print("⚠️ ไม่พบคอลัมน์ DocNum ใน %s" % reader.path.name)
+    targets = set(docnums or [])
+    n_match = n_other = 0
+
+    with open_out(out_match) as fm, open_out(out_other) as fo:
+        fm.writelines(reader.header)
+        fo.writelines(reader.header)
+        for line, dv in reader.iter_field(doc_idx):
+            if dv in targets:
+                fm.write(line); n_match += 1
+            else:
+                fo.write(line); n_other += 1
+
+    return {"matched": n_match, "others": n_other}
+
+# ---------- mmap (zero-copy) ----------
+class MappedSap(SapReader):
+    """
+    SapReader ที่ map ไฟล์ด้วย mmap แล้วสแกน byte ตรง ๆ
+    - หา record ด้วย regex บน mapping, decode เฉพาะ field ที่ต้องใช้
+    - บรรทัดที่ไม่เปลี่ยนคัดลอกจาก mapping ลงไฟล์ผลลัพธ์เป็นช่วงต่อเนื่อง (ไม่สร้าง str)
+    ใช้ได้เมื่อ .native เป็น True (newline ของไฟล์ตรงกับ os.linesep และไม่มี escapechar)
+    """
+    def __enter__(self):
+        super().__enter__()
+        self._f.close()
+        self.start = body_offset(self.path, self.header_rows)
+        self._f = open(self.path, "rb")
+        self.mm = self.mv = None
+        self.native = False
+        if os.fstat(self._f.fileno()).st_size == 0:
+            return self
+        self.mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mv = memoryview(self.mm)
+        if os.linesep == "\n":
+            self.native = self.mm.find(b"\r") < 0
+        else:
+            self.native = re.search(rb"(?<!\r)\n|\r(?!\n)", self.mm) is None
+        if self.dialect.escapechar:
+            self.native = False
+        return self
+
+    def __exit__(self, *exc):
+        if self.mv is not None:
+            self.mv.release()
+            self.mm.close()
+            self.mv = self.mm = None
+        super().__exit__(*exc)
+
+    def header_bytes(self) -> bytes:
+        """หัวตารางแบบเดียวกับที่ open_out เขียน (newline ตาม os.linesep)"""
+        return "".join(self.header).replace("\n", os.linesep).encode("utf-8")
+
+    def _csv_record(self, a: int, idx: Optional[int]) -> Tuple[int, str]:
+        """parse record ที่เริ่มที่ byte a ด้วย csv.reader (อาจกินหลายบรรทัด) คืน (byte ท้าย record, ค่า field)"""
+        mm, end = self.mm, len(self.mm)
+        ends = []
+        def lines():
+            p = a
+            while p < end:
+                nl = mm.find(b"\n", p, end)
+                e = end if nl < 0 else nl + 1
+                ends.append(e)
+                line, p = mm[p:e], e
+                yield line.decode("utf-8").replace("\r\n", "\n")
+        try:
+            row = next(csv.reader(lines(), dialect=self.dialect))
+        except (csv.Error, StopIteration):
+            row = []
+        return ends[-1], cell(row, idx)
+
+    def spans(self, idx: Optional[int], targets=None) -> Iterator[Tuple[int, int, str]]:
+        """
+        วน body เป็น (byte เริ่ม, byte ท้าย, ค่า field ที่ idx แบบ strip) ทีละ record
+        ส่ง targets มา: คืนเฉพาะ record ที่ค่าอยู่ใน targets (เทียบบน byte ไม่ต้อง decode ทุกบรรทัด)
+        จำนวน record ทั้งหมดที่วนผ่านอยู่ใน self.records
+        """
+        self.records = 0
+        mm = self.mm
+        if mm is None:
+            return
+        end = len(mm)
+        d = re.escape(self.dialect.delimiter.encode("utf-8"))
+        if idx is None:
+            rx = re.compile(rb"()[^\n]*(?:\n|\Z)")
+        elif idx == 0:
+            rx = re.compile(rb"([^%s\n]*)[^\n]*(?:\n|\Z)" % d)
+        else:
+            rx = re.compile(rb"(?:(?:[^%s\n]*%s){%d}([^%s\n]*))?[^\n]*(?:\n|\Z)" % (d, d, idx, d))
+        tb = None if targets is None else {t.encode("utf-8") for t in targets}
+        q = self.dialect.quotechar.encode("utf-8") if self.dialect.quotechar else None
+        pos = self.start
+        next_q = mm.find(q, pos) if q else -1
+        n = 0
+        while pos < end:
+            for m in rx.finditer(mm, pos):
+                a, b = m.span()
+                if a >= end:
+                    pos = end
+                    break
+                n += 1
+                if 0 <= next_q < b:
+                    # บรรทัดนี้มี quote: ให้ csv.reader ตัดสิน (field อาจมี newline)
+                    b, value = self._csv_record(a, idx)
+                    if targets is None or value in targets:
+                        yield a, b, value
+                    pos = b
+                    next_q = mm.find(q, b)
+                    break
+                v = m.group(1)
+                if tb is None:
+                    yield a, b, v.decode("utf-8").strip() if v else ""
+                    continue
+                if not v:
+                    if "" in targets:
+                        yield a, b, ""
+                    continue
+                key = v.strip(ASCII_SPACE)
+                if key in tb if key.isascii() else key.decode("utf-8").strip() in targets:
+                    yield a, b, key.decode("utf-8").strip()
+            else:
+                pos = end
+        self.records = n
+
+def keyword_bytes_ok(keyword: str, case_insensitive: bool) -> bool:
+    """นับ keyword บน byte ได้ผลเท่ากับ str.lower().count() หรือไม่ (keyword ไม่มีตัวพิมพ์เล็ก/ใหญ่)"""
+    return bool(keyword) and (not case_insensitive or keyword.lower() == keyword == keyword.upper())
+
+def split_keyword_mmap(reader: MappedSap, out_with, out_without, keyword: str) -> Dict:
+    """
+    split_keyword_stream บน mmap: หา keyword ใน byte ตรง ๆ (keyword ต้องผ่าน keyword_bytes_ok)
+    บรรทัดที่ไม่มี keyword คัดลอกจาก mapping เป็นช่วงต่อเนื่องลง out_without
+    """
+    mm, mv = reader.mm, reader.mv
+    kw = keyword.encode("utf-8")
+    docnums = {}
+    cnt = n_with = n_without = 0
+    with open(out_with, "wb", buffering=WRITE_BUFFER) as fw, open(out_without, "wb", buffering=WRITE_BUFFER) as fo:
+        head = reader.header_bytes()
+        fw.write(head)
+        fo.write(head)
+        if mm is None:
+            return {"docnums": docnums, "count_keyword": 0, "rows_with": 0, "rows_without": 0}
+        k = mm.find(kw, reader.start)
+        run = reader.start
+        for a, b, dv in reader.spans(reader.index("docnum")):
+            if 0 <= k < b:
+                occ = 0
+                while 0 <= k < b:
+                    occ += 1
+                    k = mm.find(kw, k + len(kw))
+                if a > run:
+                    fo.write(mv[run:a])
+                fw.write(mv[a:b])
+                run = b
+                cnt += occ; n_with += 1
+                if dv:
+                    docnums[dv] = True
+            else:
+                n_without += 1
+        if len(mm) > run:
+            fo.write(mv[run:])
+    return {"docnums": docnums, "count_keyword": cnt,
+            "rows_with": n_with, "rows_without": n_without}
+
+def match_docnums_mmap(reader: MappedSap, out_match, out_other, docnums) -> Dict:
+    """match_docnums_stream บน mmap: แถวที่ไม่ match คัดลอกจาก mapping เป็นช่วงต่อเนื่องลง out_other"""
+    doc_idx = reader.index("docnum")
+    if doc_idx is None:
+        print("⚠️ ไม่พบคอลัมน์ DocNum ใน %s" % reader.path.name)
+    targets = set(docnums or [])
+    mm, mv = reader.mm, reader.mv
+    n_match = 0
+    with open(out_match, "wb", buffering=WRITE_BUFFER) as fm, open(out_other, "wb", buffering=WRITE_BUFFER) as fo:
+        head = reader.header_bytes()
+        fm.write(head)
+        fo.write(head)
+        if mm is None:
+            return {"matched": 0, "others": 0}
+        run = reader.start
+        for a, b, _ in reader.spans(doc_idx, targets):
+            if a > run:
+                fo.write(mv[run:a])
+            fm.write(mv[a:b])
+            run = b
+            n_match += 1
+        if len(mm) > run:
+            fo.write(mv[run:])
+        n_other = reader.records - n_match
+    return {"matched": n_match, "others": n_other}
+
+# ---------- multi-process (แบ่งไฟล์เป็นช่วง byte) ----------
+class _ByteRange(io.RawIOBase):
+    """raw stream ที่อ่านได้เฉพาะช่วง byte [start, end) ของไฟล์"""
+    def __init__(self, path, start: int, end: int):
+        self._f = open(path, "rb")
+        self._f.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._left <= 0:
+            return 0
+        n = self._f.readinto(memoryview(b)[:min(len(b), self._left)])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+class SapChunk(SapReader):
+    """
+    SapReader ที่วนเฉพาะ body ในช่วง byte [start, end)
+    ใช้หัวตาราง/dialect ของไฟล์เดิม แต่ header = [] (ไฟล์ส่วนย่อยจะไม่มีหัวตาราง)
+    """
+    def __init__(self, path, header_rows: int, start: int, end: int):
+        super().__init__(path, header_rows)
+        self.start, self.end = start, end
+
+    def __enter__(self):
+        super().__enter__()
+        self._f.close()
+        self.header = []
+        self._f = io.TextIOWrapper(io.BufferedReader(_ByteRange(self.path, self.start, self.end), WRITE_BUFFER),
+                                   encoding="utf-8")
+        return self
+
+# ตัดบรรทัดแบบเดียวกับ SapReader (universal newlines): "\r\n", "\r" หรือ "\n"
+_EOL = re.compile(rb"\r\n|\r|\n")
+
+def body_offset(path, header_rows: int) -> int:
+    """ตำแหน่ง byte แรกของ body (ถัดจาก BOM + หัวตาราง) นับบรรทัดแบบเดียวกับ SapReader"""
+    with open(path, "rb") as f:
+        for _ in range(header_rows):
+            while True:
+                c = f.read(1)
+                if not c or c == b"\n":
+                    break
+                if c == b"\r":
+                    nxt = f.read(1)
+                    if nxt and nxt != b"\n":
+                        f.seek(-1, 1)
+                    break
+            if not c:
+                break
+        return f.tell()
+
+def body_ranges(path, start: int, parts: int, quotechar: Optional[str] = '"') -> List[Tuple[int, int]]:
+    """
+    แบ่ง [start, ขนาดไฟล์) เป็น parts ช่วง โดยตัดหลังจบบรรทัดเท่านั้น ("\r\n", "\r" หรือ "\n" แบบ SapReader)
+    และต้องเป็นจุดที่จำนวน quotechar สะสมเป็นเลขคู่ (ไม่ตัดกลาง field ที่มี newline ใน quote)
+    """
+    size = os.path.getsize(path)
+    if parts <= 1 or size - start <= 1:
+        return [(start, size)]
+    q = quotechar.encode("utf-8") if quotechar else None
+    step = (size - start) / parts
+    targets = [int(start + step * k) for k in range(1, parts)]
+    cuts = [start]
+    parity = 0      # จำนวน quote (mod 2) ก่อนตำแหน่ง pos
+    pos = start
+    with open(path, "rb") as f:
+        f.seek(start)
+        while targets:
+            block = f.read(SCAN_BLOCK)
+            if not block:
+                break
+            i = max(0, targets[0] - pos)
+            while targets and i < len(block):
+                m = _EOL.search(block, i)
+                if m is None:
+                    break
+                nl, end = m.start(), m.end()
+                if end == len(block) and block[nl:end] == b"\r":
+                    break  # "\r" ท้าย block อาจเป็นครึ่งแรกของ "\r\n": ไปตัดที่บรรทัดถัดไปแทน
+                if q is None or (parity + block.count(q, 0, nl)) % 2 == 0:
+                    cut = pos + end
+                    if cut > cuts[-1]:
+                        cuts.append(cut)
+                    while targets and targets[0] < cut:
+                        targets.pop(0)
+                    i = max(end, targets[0] - pos) if targets else len(block)
+                else:
+                    i = end
+            if q is not None:
+                parity = (parity + block.count(q)) % 2
+            pos += len(block)
+    if cuts[-1] < size:
+        cuts.append(size)
+    return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+def _run_chunk(task, path, header_rows, start, end, part_paths, kwargs):
+    with SapChunk(path, header_rows, start, end) as rd:
+        return task(rd, part_paths, **kwargs)
+
+def run_chunks(path, header_rows: int, out_paths, task, workers: int, **kwargs) -> List[Dict]:
+    """
+    รัน task(reader, part_paths, **kwargs) แยกตามช่วง byte ของ body ใน process pool
+    แล้วต่อไฟล์ส่วนย่อยตามลำดับเดิมเป็น out_paths (มีหัวตาราง) — คืนผลของแต่ละ chunk ตามลำดับ
+    task ต้องเป็นฟังก์ชันระดับ module (pickle ได้)
+    """
+    with SapReader(path, header_rows=header_rows) as rd:
+        header, quotechar, esc = rd.header, rd.dialect.quotechar, rd.dialect.escapechar
+    start = body_offset(path, header_rows)
+    size = os.path.getsize(path)
+    parts = max(1, min(workers, (size - start) // MIN_CHUNK_BYTES))
+    if esc:
+        parts = 1  # มี escapechar: หาจุดตัดจากจำนวน quote ไม่ได้
+    ranges = body_ranges(path, start, parts, quotechar)
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".chunks_", dir=Path(out_paths[0]).parent))
+    try:
+        parts_of = [[tmp_dir / f"{k}_{i}.part" for k in range(len(out_paths))] for i in range(len(ranges))]
+        if len(ranges) == 1:
+            results = [_run_chunk(task, path, header_rows, *ranges[0], parts_of[0], kwargs)]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as ex:
+                futs = [ex.submit(_run_chunk, task, path, header_rows, a, b, parts_of[i], kwargs)
+                        for i, (a, b) in enumerate(ranges)]
+                results = [f.result() for f in futs]
+        for k, out in enumerate(out_paths):
+            with open_out(out) as f:
+                f.writelines(header)
+            with open(out, "ab") as f:
+                for parts_i in parts_of:
+                    with open(parts_i[k], "rb") as src:
+                        shutil.copyfileobj(src, f, WRITE_BUFFER)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+def _split_task(rd, parts, keyword, case_insensitive):
+    return split_keyword_stream(rd, parts[0], parts[1], keyword, case_insensitive=case_insensitive)
+
+def _match_task(rd, parts, docnums):
+    return match_docnums_stream(rd, parts[0], parts[1], docnums)
+
+def split_keyword_file(path, header_rows: int, out_with, out_without, keyword: str,
+                       case_insensitive: bool = True, workers: int = 1) -> Dict:
+    """
+    split_keyword_stream ทั้งไฟล์ (workers > 1: แบ่ง chunk ทำหลาย process ผลเหมือนกัน)
+    ทำบน mmap เมื่อทำได้ (ดู MappedSap / keyword_bytes_ok) ไม่งั้นอ่านแบบข้อความ
+    """
+    if workers <= 1:
+        if use_mmap() and keyword_bytes_ok(keyword, case_insensitive):
+            with MappedSap(path, header_rows=header_rows) as rd:
+                if rd.native:
+                    return split_keyword_mmap(rd, out_with, out_without, keyword)
+        with SapReader(path, header_rows=header_rows) as rd:
+            return split_keyword_stream(rd, out_with, out_without, keyword, case_insensitive=case_insensitive)
+    results = run_chunks(path, header_rows, [out_with, out_without], _split_task, workers,
+                         keyword=keyword, case_insensitive=case_insensitive)
+    docnums = {}
+    for r in results:
+        docnums.update(r["docnums"])
+    return {"docnums": docnums,
+            "count_keyword": sum(r["count_keyword"] for r in results),
+            "rows_with": sum(r["rows_with"] for r in results),
+            "rows_without": sum(r["rows_without"] for r in results)}
+
+def match_docnums_file(path, header_rows: int, out_match, out_other, docnums, workers: int = 1) -> Dict:
+    """
+    match_docnums_stream ทั้งไฟล์ (workers > 1: แบ่ง chunk ทำหลาย process ผลเหมือนกัน)
+    ทำบน mmap เมื่อทำได้ (ดู MappedSap) ไม่งั้นอ่านแบบข้อความ
+    """
+    if workers <= 1:
+        if use_mmap():
+            with MappedSap(path, header_rows=header_rows) as rd:
+                if rd.native:
+                    return match_docnums_mmap(rd, out_match, out_other, docnums)
+        with SapReader(path, header_rows=header_rows) as rd:
+            return match_docnums_stream(rd, out_match, out_other, docnums)
+    results = run_chunks(path, header_rows, [out_match, out_other], _match_task, workers,
+                         docnums=set(docnums or []))
+    return {"matched": sum(r["matched"] for r in results), "others": sum(r["others"] for r in results)}
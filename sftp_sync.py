@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+เทียบไฟล์ local กับปลายทาง SFTP ก่อนอัปโหลด (sync mode)
+- list โฟลเดอร์ปลายทางครั้งเดียวต่อชุด (listdir_attr) แทน stat ทีละไฟล์
+- ขนาด + mtime (วินาที) ตรงกัน -> ไม่ต้องอัปโหลด (หลัง put ตั้ง mtime ปลายทาง = local ด้วย utime)
+- use_hash: เทียบ sha256 กับ sidecar "<ชื่อไฟล์>.sha256" ปลายทาง ใช้ตัดสินเมื่อ mtime ไม่ตรง
+  (เช่น เขียนไฟล์ใหม่ด้วยเนื้อหาเดิม) และเขียน sidecar ทุกครั้งที่อัปโหลด
+"""
+import os
+import stat
+import hashlib
+import posixpath
+from typing import Dict, Optional, Tuple
+
+SIDECAR_SUFFIX = ".sha256"
+
+def sha256_file(path: str, chunk: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(chunk), b""):
+            h.update(b)
+    return h.hexdigest()
+
+def remote_listing(sftp, remote_dir: str) -> Dict[str, object]:
+    """{ชื่อไฟล์: SFTPAttributes} ของไฟล์ในโฟลเดอร์ปลายทาง (ไม่มีโฟลเดอร์ -> {})"""
+    try:
+        return {a.filename: a for a in sftp.listdir_attr(remote_dir)
+                if not stat.S_ISDIR(a.st_mode or 0)}
+    except IOError:
+        return {}
+
+def read_sidecar(sftp, remote_path: str) -> Optional[str]:
+    try:
+        with sftp.open(remote_path + SIDECAR_SUFFIX, "r") as f:
+            return f.read().decode("ascii", "replace").split()[0].lower()
+    except (IOError, IndexError):
+        return None
+
+def needs_upload(sftp, local_path: str, remote_path: str, listing: Dict[str, object],
+                 use_hash: bool = False, digest: Optional[str] = None) -> Tuple[bool, str]:
+    """(ต้องอัปโหลดไหม, เหตุผล) เทียบกับ listing ของโฟลเดอร์ปลายทาง"""
+    name = posixpath.basename(remote_path)
+    attr = listing.get(name)
+    if attr is None:
+        return True, "new"
+    st = os.stat(local_path)
+    if attr.st_size != st.st_size:
+        return True, "size"
+    if attr.st_mtime == int(st.st_mtime):
+        return False, "same size/mtime"
+    if use_hash and (name + SIDECAR_SUFFIX) in listing:
+        remote_digest = read_sidecar(sftp, remote_path)
+        if remote_digest and remote_digest == (digest or sha256_file(local_path)):
+            return False, "same sha256"
+    return True, "mtime"
+
+def mark_uploaded(sftp, local_path: str, remote_path: str, use_hash: bool = False,
+                  digest: Optional[str] = None):
+    """หลัง put: ตั้ง mtime ปลายทางให้ตรง local (+ เขียน sidecar ถ้า use_hash)"""
+    st = os.stat(local_path)
+    sftp.utime(remote_path, (int(st.st_atime), int(st.st_mtime)))
+    if use_hash:
+        with sftp.open(remote_path + SIDECAR_SUFFIX, "w") as f:
+            f.write(f"{digest or sha256_file(local_path)}  {posixpath.basename(remote_path)}\n")